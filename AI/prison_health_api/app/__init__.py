@@ -1,14 +1,41 @@
-from flask import Flask
-from flask_cors import CORS
-from app.model import db
-from app.routes.inmate_routes import inmate_bp
-from app.routes.admin_routes import admin_bp
-from app.routes.staff_routes import staff_bp
-from app.routes.history_routes import history_bp
-from app.routes.auth_routes import auth_bp
+from app.utils import startup
+
+with startup.timed("import", "flask"):
+    from flask import Flask
+    from flask_cors import CORS
+    from flask_migrate import Migrate, upgrade
+with startup.timed("import", "app.model"):
+    from app.model import db
+# Route modules only import their services; torch, transformers, librosa,
+# langchain and chromadb are imported on first use (or by the warm-up)
+with startup.timed("import", "app.routes.inmate_routes"):
+    from app.routes.inmate_routes import inmate_bp
+with startup.timed("import", "app.routes.admin_routes"):
+    from app.routes.admin_routes import admin_bp
+with startup.timed("import", "app.routes.staff_routes"):
+    from app.routes.staff_routes import staff_bp
+with startup.timed("import", "app.routes.history_routes"):
+    from app.routes.history_routes import history_bp
+with startup.timed("import", "app.routes.auth_routes"):
+    from app.routes.auth_routes import auth_bp
+with startup.timed("import", "app.routes.job_routes"):
+    from app.routes.job_routes import job_bp
+with startup.timed("import", "app.routes.health_routes"):
+    from app.routes.health_routes import health_bp
+from app.routes.metrics_routes import metrics_bp
+from app.utils import metrics, profiling, uploads
+from app.services.job_service import recover_jobs
+from app.services import model_registry
 import os
 
-def create_app():
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1").lower() in ("1", "true", "yes")
+
+def create_app(start_background_work=True):
+    """
+    `start_background_work=False` skips job recovery and model warm-up; the
+    gunicorn entry point (wsgi.py / gunicorn.conf.py) does both around fork.
+    """
     app = Flask(__name__)
     
     # <--- 2. Enable CORS
@@ -20,8 +47,9 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///prison.db'
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
-    # Init DB
+    # Init DB (schema is managed by the Alembic migrations in ./migrations)
     db.init_app(app)
+    Migrate(app, db, directory=MIGRATIONS_DIR)
     
     # Register Blueprints
     app.register_blueprint(inmate_bp, url_prefix='/api/inmate')
@@ -29,12 +57,34 @@ def create_app():
     app.register_blueprint(staff_bp, url_prefix='/api/staff')
     app.register_blueprint(history_bp, url_prefix='/api/history')
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(job_bp, url_prefix='/api/jobs')
+    app.register_blueprint(health_bp, url_prefix='/api/health')
+    app.register_blueprint(metrics_bp)
+    
+    # Request latency histograms for /metrics
+    metrics.init_app(app)
+    # Opt-in per-request profiles (X-Profile: 1 from an admin)
+    profiling.init_app(app)
+    # Oversized request bodies are refused while they arrive (413)
+    uploads.init_app(app)
     
-    # Create DB Tables
-    with app.app_context():
-        db.create_all()
+    # Bring the DB schema up to date (AUTO_MIGRATE=0 leaves it to `flask db upgrade`)
+    if AUTO_MIGRATE:
+        with app.app_context(), startup.timed("phase", "migrate"):
+            upgrade(directory=MIGRATIONS_DIR)
         
     # Ensure upload folder exists
     os.makedirs('uploads', exist_ok=True)
+    
+    if not start_background_work:
+        return app
+    
+    # Re-queue background jobs left over from a previous run
+    with startup.timed("phase", "recover_jobs"):
+        recover_jobs(app)
+    
+    # Optionally load shared models now instead of on the first request
+    # (WARMUP_MODELS, in a background thread with WARMUP_BACKGROUND=1)
+    model_registry.warm_up()
         
-    return app
\ No newline at end of file
+    return app
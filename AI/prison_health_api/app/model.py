@@ -6,8 +6,8 @@ db = SQLAlchemy()
 class Inmate(db.Model):
     __tablename__ = 'inmates'
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    nic = db.Column(db.String(20))
+    name = db.Column(db.String(100), nullable=False, index=True)
+    nic = db.Column(db.String(20), unique=True, index=True) # NULL when unknown, never ''
     address = db.Column(db.String(200))
     tel_no = db.Column(db.String(20))
     crime_details = db.Column(db.Text)
@@ -23,6 +23,7 @@ class Inmate(db.Model):
 
 class SurveyAnswer(db.Model):
     __tablename__ = 'survey_answers'
+    __table_args__ = (db.Index('ix_survey_answers_inmate_id_timestamp', 'inmate_id', 'timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
     inmate_id = db.Column(db.Integer, db.ForeignKey('inmates.id'), nullable=False)
     question_text = db.Column(db.String(500), nullable=False)
@@ -32,6 +33,7 @@ class SurveyAnswer(db.Model):
 
 class EmotionLog(db.Model):
     __tablename__ = 'emotion_logs'
+    __table_args__ = (db.Index('ix_emotion_logs_inmate_id_timestamp', 'inmate_id', 'timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
     inmate_id = db.Column(db.Integer, db.ForeignKey('inmates.id'), nullable=False)
     predicted_emotion = db.Column(db.String(50), nullable=False) # e.g., "Angry", "Sad"
@@ -49,6 +51,7 @@ class Staff(db.Model):
 
 class HealthProfileLog(db.Model):
     __tablename__ = 'health_profile_logs'
+    __table_args__ = (db.Index('ix_health_profile_logs_inmate_id_timestamp', 'inmate_id', 'timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
     inmate_id = db.Column(db.Integer, db.ForeignKey('inmates.id'), nullable=False)
     risk_level = db.Column(db.String(50))
@@ -67,4 +70,28 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(50), default='admin')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (db.Index('ix_jobs_status_owner_pid', 'status', 'owner_pid'),)
+    id = db.Column(db.String(32), primary_key=True) # uuid4 hex
+    job_type = db.Column(db.String(50), nullable=False) # e.g., 'detect_emotion', 'analyze_inmate'
+    status = db.Column(db.String(20), nullable=False, default='queued') # 'queued', 'running', 'succeeded', 'failed'
+    payload = db.Column(db.Text) # Stored as JSON string
+    result = db.Column(db.Text, nullable=True) # Stored as JSON string
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    owner_pid = db.Column(db.Integer, nullable=True) # process whose pool holds the job while queued/running
+
+class HealthProfileCache(db.Model):
+    __tablename__ = 'health_profile_cache'
+    key = db.Column(db.String(64), primary_key=True) # sha256 of the assembled prompt inputs
+    inmate_id = db.Column(db.Integer, nullable=True)
+    profile = db.Column(db.Text, nullable=False) # Stored as JSON string
+    profile_log_id = db.Column(db.Integer, nullable=True) # HealthProfileLog written from this entry
+    hit_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_hit_at = db.Column(db.DateTime, default=datetime.utcnow)
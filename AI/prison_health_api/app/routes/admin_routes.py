@@ -1,12 +1,28 @@
-from flask import Blueprint, request, jsonify
-from app.services.pdf_service import store_pdf_in_vector_db
-from app.services.rag_service import generate_health_profile
-from app.model import db, Inmate, SurveyAnswer, EmotionLog, HealthProfileLog
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from app.services.pdf_service import ingest_pdfs
+from app.services.profile_service import analyze_inmate_profile
+from app.services.cohort_service import select_cohort, run_cohort, cohort_run_options
+from app.services import model_registry, profile_cache
+from app.services.guideline_index import schedule_rebuild as schedule_guideline_rebuild
+from app.services.job_service import register_handler, submit_job, wants_async, job_upload_path
+from app.model import Inmate
+from app.utils import profiling
 import os
 import json
 
 admin_bp = Blueprint('admin', __name__)
 
+def _ingestion_response(results):
+    stored = [r["filename"] for r in results if r["status"] in ("stored", "skipped_duplicate")]
+    return {"message": f"Successfully processed: {', '.join(stored)}", "files": results}
+
+def _process_medical_records(file_paths, inmate_id=None):
+    """Stores the saved PDFs in the inmate vector DB. file_paths: [[path, filename], ...]"""
+    results = ingest_pdfs([(path, filename) for path, filename in file_paths], inmate_id)
+    return _ingestion_response(results)
+
+register_handler('upload_medical_record', _process_medical_records)
+
 @admin_bp.route('/upload_medical_record', methods=['POST'])
 def upload_pdf():
     if 'file' not in request.files:
@@ -17,21 +33,24 @@ def upload_pdf():
     # Get ALL files sent with the key 'file'
     files = request.files.getlist('file') 
     
-    saved_files = []
+    run_async = wants_async(request)
+    
+    file_paths = []
     for file in files:
         if file.filename == '':
             continue
             
-        save_path = os.path.join("uploads", file.filename)
+        # Queued jobs read the file later, so give it a name no other upload can clobber
+        save_path = job_upload_path(file.filename) if run_async else os.path.join("uploads", file.filename)
         file.save(save_path)
-        
-        # Process each file (The new batched service will handle the rate limits)
-        success = store_pdf_in_vector_db(save_path, inmate_id)
-        if success:
-            saved_files.append(file.filename)
+        file_paths.append([save_path, file.filename])
+    
+    if run_async:
+        job_id = submit_job(current_app._get_current_object(), 'upload_medical_record',
+                            {"file_paths": file_paths, "inmate_id": inmate_id})
+        return jsonify({"job_id": job_id, "status": "queued"}), 202
             
-    return jsonify({"message": f"Successfully processed: {', '.join(saved_files)}"}), 200
-    return jsonify({"message": f"Successfully processed: {', '.join(saved_files)}"}), 200
+    return jsonify(_process_medical_records(file_paths, inmate_id)), 200
 
 @admin_bp.route('/upload_common_doc', methods=['POST'])
 def upload_common_doc():
@@ -43,20 +62,34 @@ def upload_common_doc():
     upload_dir = os.path.join("uploads", "common")
     os.makedirs(upload_dir, exist_ok=True)
     
-    saved_files = []
+    file_paths = []
     for file in files:
         if file.filename == '':
             continue
             
         save_path = os.path.join(upload_dir, file.filename)
         file.save(save_path)
-        
-        # Store in the general vector DB (no inmate_id)
-        success = store_pdf_in_vector_db(save_path, None)
-        if success:
-            saved_files.append(file.filename)
+        file_paths.append((save_path, file.filename))
+    
+    # Store in the general vector DB (no inmate_id)
+    results = ingest_pdfs(file_paths, None)
+    
+    # New guidelines change what each survey answer should retrieve
+    if any(r["status"] == "stored" for r in results):
+        schedule_guideline_rebuild()
             
-    return jsonify({"message": f"Successfully processed: {', '.join(saved_files)}"}), 200
+    return jsonify(_ingestion_response(results)), 200
+
+@admin_bp.route('/models', methods=['GET'])
+def list_models():
+    # Which shared models / vector stores this worker process has loaded
+    import resource
+    max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return jsonify({
+        "models": model_registry.describe(),
+        "process_max_rss_mb": round(max_rss_kb / 1024, 2),
+        "pid": os.getpid()
+    }), 200
 
 @admin_bp.route('/common_docs', methods=['GET'])
 def get_common_docs():
@@ -72,6 +105,8 @@ def get_common_docs():
     
     return jsonify({"docs": docs}), 200
 
+register_handler('analyze_inmate', analyze_inmate_profile)
+
 @admin_bp.route('/analyze_inmate', methods=['POST'])
 def analyze_inmate():
     data = request.json
@@ -85,52 +120,108 @@ def analyze_inmate():
     else:
         return jsonify({"error": "Username is required"}), 400
 
-    # 4. Fetch the inmate object securely
-    inmate = Inmate.query.get_or_404(target_inmate_id)
-    
-    # Fetch recent data from SQL
-    recent_emotions = EmotionLog.query.filter_by(inmate_id=target_inmate_id).order_by(EmotionLog.timestamp.desc()).limit(5).all()
-    emotion_str = ", ".join([e.predicted_emotion for e in recent_emotions])
-    
-    recent_answers = SurveyAnswer.query.filter_by(inmate_id=target_inmate_id).limit(10).all()
-    survey_summary = "; ".join([f"Q: {a.question_text} A: {a.answer_text} (Voice: {a.voice_emotion})" for a in recent_answers])
-    
-    # Fetch historical health profiles
-    past_logs = HealthProfileLog.query.filter_by(inmate_id=target_inmate_id).order_by(HealthProfileLog.timestamp.desc()).limit(3).all()
-    past_logs_summary = "None"
-    if past_logs:
-        summaries = []
-        for log in reversed(past_logs): # chronological order
-            summaries.append(f"Date: {log.timestamp.strftime('%Y-%m-%d %H:%M')}, Risk: {log.risk_level}, "
-                             f"Conditions: {log.suspected_conditions}, Progress: {log.progress_indicator}")
-        past_logs_summary = "\n".join(summaries)
-    
-    # Call RAG Service
-    analysis_json = generate_health_profile(inmate, emotion_str, survey_summary, past_logs_summary)
-    
-    # Save the report string to DB, so we don't have to keep querying the LLM
-    inmate.final_llm_report = json.dumps(analysis_json)
-    
-    # Create a new HealthProfileLog entry
-    new_log = HealthProfileLog(
-        inmate_id=target_inmate_id,
-        risk_level=analysis_json.get("risk_level", "Unknown"),
-        suspected_conditions=json.dumps(analysis_json.get("suspected_conditions", [])),
-        recommended_actions=json.dumps(analysis_json.get("recommended_actions", [])),
-        urgent_alert=analysis_json.get("urgent_alert", False),
-        reasoning=analysis_json.get("reasoning", ""),
-        progress_indicator=analysis_json.get("progress_indicator", "Initial")
+    force_refresh = str(data.get('force_refresh', request.args.get('force_refresh', ''))).lower() in ("1", "true", "yes")
+
+    if wants_async(request):
+        job_id = submit_job(current_app._get_current_object(), 'analyze_inmate',
+                            {"inmate_id": target_inmate_id, "force_refresh": force_refresh})
+        return jsonify({"job_id": job_id, "status": "queued"}), 202
+    
+    return jsonify(analyze_inmate_profile(target_inmate_id, force_refresh=force_refresh))
+
+@admin_bp.route('/analyze_cohort', methods=['POST'])
+def analyze_cohort():
+    """
+    Re-profiles a set of inmates concurrently and streams NDJSON progress events.
+    Body: {"usernames": [...]} and/or {"inmate_ids": [...]}, or a filter such as
+    {"filter": {"no_profile_days": 7}} / {"filter": {"urgent_alert": true}};
+    optional "concurrency", "batch_size", "limit", "force_refresh".
+    """
+    data = request.get_json(silent=True) or {}
+    filters = data.get('filter') or {}
+    usernames = data.get('usernames')
+    inmate_ids = data.get('inmate_ids')
+    
+    if not usernames and not inmate_ids and not filters and not data.get('all'):
+        return jsonify({"error": "Provide usernames, inmate_ids, a filter or all=true"}), 400
+    
+    try:
+        cohort_ids = select_cohort(
+            usernames=usernames,
+            inmate_ids=inmate_ids,
+            no_profile_days=filters.get('no_profile_days'),
+            urgent_alert=filters.get('urgent_alert'),
+            limit=data.get('limit')
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid cohort selection: {e}"}), 400
+    # Checked before the stream starts: errors inside it would arrive after the 200
+    try:
+        concurrency, batch_size = cohort_run_options(data.get('concurrency'), data.get('batch_size'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    events = run_cohort(
+        current_app._get_current_object(),
+        cohort_ids,
+        concurrency=concurrency,
+        force_refresh=bool(data.get('force_refresh')),
+        batch_size=batch_size
     )
-    db.session.add(new_log)
-    db.session.commit()
-    
-    past_logs_data = []
-    if past_logs:
-        for log in past_logs:
-            past_logs_data.append({
-                "date": log.timestamp.strftime('%Y-%m-%d %H:%M'),
-                "risk_level": log.risk_level,
-                "progress_indicator": log.progress_indicator
-            })
-    
-    return jsonify({"analysis": analysis_json, "history": past_logs_data})
\ No newline at end of file
+    ndjson = (json.dumps(event) + "\n" for event in events)
+    return Response(stream_with_context(ndjson), mimetype='application/x-ndjson')
+
+@admin_bp.route('/profile_cache/stats', methods=['GET'])
+def get_profile_cache_stats():
+    return jsonify(profile_cache.cache_stats()), 200
+
+@admin_bp.route('/profile_cache', methods=['DELETE'])
+def clear_profile_cache():
+    deleted = profile_cache.clear()
+    return jsonify({"message": f"Cleared {deleted} cached profiles"}), 200
+
+@admin_bp.route('/profiles', methods=['GET'])
+def list_profiles():
+    # Request profiles captured with X-Profile: 1 (admin only, they expose internals)
+    if profiling.admin_user(request) is None:
+        return jsonify({"error": "Admin token required"}), 403
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify({"profiles": profiling.list_profiles(limit)}), 200
+
+@admin_bp.route('/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    if profiling.admin_user(request) is None:
+        return jsonify({"error": "Admin token required"}), 403
+    try:
+        data = profiling.load(profile_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if data is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify(data), 200
+
+@admin_bp.route('/profiles/<profile_id>/folded', methods=['GET'])
+def get_profile_folded(profile_id):
+    # Folded stacks for flamegraph.pl / speedscope / inferno
+    if profiling.admin_user(request) is None:
+        return jsonify({"error": "Admin token required"}), 403
+    try:
+        folded = profiling.load_folded(profile_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if folded is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return Response(folded, mimetype='text/plain',
+                    headers={"Content-Disposition": f"attachment; filename={profile_id}.folded"})
+
+@admin_bp.route('/profiles/<profile_id>', methods=['DELETE'])
+def delete_profile(profile_id):
+    if profiling.admin_user(request) is None:
+        return jsonify({"error": "Admin token required"}), 403
+    try:
+        deleted = profiling.delete(profile_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not deleted:
+        return jsonify({"error": "Profile not found"}), 404
+    return jsonify({"message": "Profile deleted"}), 200
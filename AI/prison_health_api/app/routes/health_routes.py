@@ -0,0 +1,21 @@
+from flask import Blueprint, jsonify
+from app.services import model_registry
+from app.utils import startup
+
+health_bp = Blueprint('health', __name__)
+
+@health_bp.route('/live', methods=['GET'])
+def live():
+    # The process is up and serving requests
+    return jsonify({"status": "ok"}), 200
+
+@health_bp.route('/ready', methods=['GET'])
+def ready():
+    # 503 until the configured warm-up (WARMUP_MODELS) has loaded everything it was asked for
+    is_ready, details = model_registry.readiness()
+    return jsonify({"ready": is_ready, **details}), 200 if is_ready else 503
+
+@health_bp.route('/startup', methods=['GET'])
+def startup_report():
+    # Time spent per import / model load / startup phase in this process
+    return jsonify(startup.report()), 200
@@ -1,69 +1,89 @@
-from flask import Blueprint, jsonify
-from app.model import db, Inmate, SurveyAnswer, EmotionLog
-from app.services.rag_service import generate_health_profile
+from flask import Blueprint, jsonify, request, Response, stream_with_context
+from app.model import Inmate
+from app.services.inmate_listing import parse_list_args, list_inmates
+from app.services.inmate_history import parse_history_args, section_page, iter_section, encode_cursor
+from app.utils.http_cache import conditional_json
 import json
 
 history_bp = Blueprint('history', __name__)
 
 @history_bp.route('/inmates', methods=['GET'])
 def get_inmates():
-    inmates = Inmate.query.all()
+    # Same filters / sort / keyset pages as /api/inmate/all
+    try:
+        params = parse_list_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    rows, next_cursor = list_inmates(params)
     result = []
-    for i in inmates:
+    for i, profile_count, last_assessed_at, latest_risk, _latest_urgent in rows:
         result.append({
             "id": i.id,
             "name": i.name,
             "age": i.age,
             "gender": i.gender,
-            "visual_emotion": i.visual_emotion
+            "visual_emotion": i.visual_emotion,
+            "diagnosis_done": profile_count > 0,
+            "latest_risk_level": latest_risk,
+            "last_assessment_at": last_assessed_at.isoformat() if last_assessed_at else None
         })
-    return jsonify({"inmates": result}), 200
+    payload = {"inmates": result}
+    if params.paginated:
+        payload.update({"next_cursor": next_cursor, "limit": params.limit})
+    return conditional_json(payload)
 
 @history_bp.route('/inmate/<int:inmate_id>', methods=['GET'])
 def get_inmate_history(inmate_id):
+    """
+    Survey answers and health reports of an inmate, oldest first.
+    Optional: from / to, section, limit (+ qa_history_cursor / reports_cursor)
+    for per-section pages, and stream=1 (or Accept: application/x-ndjson) for
+    NDJSON: one "inmate" line, one line per row, then a "page" line per section.
+    """
     inmate = Inmate.query.get(inmate_id)
     if not inmate:
         return jsonify({"error": "Inmate not found"}), 404
-        
-    recent_answers = SurveyAnswer.query.filter_by(inmate_id=inmate_id).order_by(SurveyAnswer.timestamp.asc()).all()
-    recent_emotions = EmotionLog.query.filter_by(inmate_id=inmate_id).order_by(EmotionLog.timestamp.desc()).limit(5).all()
-    
-    answers_list = []
-    for a in recent_answers:
-        answers_list.append({
-            "question": a.question_text,
-            "answer": a.answer_text,
-            "voice_emotion": a.voice_emotion,
-            "timestamp": a.timestamp.isoformat() if a.timestamp else None
-        })
-        
-    emotion_str = ", ".join([e.predicted_emotion for e in recent_emotions])
-    survey_summary = "; ".join([f"Q: {a.question_text} A: {a.answer_text} (Voice: {a.voice_emotion})" for a in recent_answers])
-    
-    from app.model import HealthProfileLog
     
-    # Query all historical health profiles
-    health_logs = HealthProfileLog.query.filter_by(inmate_id=inmate_id).order_by(HealthProfileLog.timestamp.asc()).all()
+    try:
+        params = parse_history_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
-    reports_list = []
-    for log in health_logs:
-        reports_list.append({
-            "risk_level": log.risk_level,
-            "suspected_conditions": json.loads(log.suspected_conditions) if log.suspected_conditions else [],
-            "recommended_actions": json.loads(log.recommended_actions) if log.recommended_actions else [],
-            "urgent_alert": log.urgent_alert,
-            "reasoning": log.reasoning,
-            "progress_indicator": log.progress_indicator,
-            "timestamp": log.timestamp.strftime("%Y-%m-%d %H:%M:%S") if log.timestamp else None
-        })
-    
-    return jsonify({
+    header = {
         "id": inmate.id,
         "name": inmate.name,
         "age": inmate.age,
         "gender": inmate.gender,
         "initial_visual_emotion": inmate.visual_emotion,
-        "ocr_prescription": inmate.ocr_prescription,
-        "qa_history": answers_list,
-        "reports": reports_list
-    }), 200
+        "ocr_prescription": inmate.ocr_prescription
+    }
+    
+    stream = request.args.get('stream', '').lower() in ('1', 'true', 'yes') or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+    if stream:
+        def ndjson():
+            yield json.dumps({"type": "inmate", **header}) + "\n"
+            for section in params.sections:
+                count, last = 0, None
+                for item, row in iter_section(inmate_id, section, params):
+                    count, last = count + 1, row
+                    yield json.dumps({"type": "row", "section": section, **item}) + "\n"
+                # A full page may have more rows after it
+                more = params.limit is not None and count == params.limit
+                yield json.dumps({
+                    "type": "page",
+                    "section": section,
+                    "count": count,
+                    "next_cursor": encode_cursor(last.timestamp, last.id) if more else None
+                }) + "\n"
+        return Response(stream_with_context(ndjson()), mimetype='application/x-ndjson')
+    
+    result = dict(header)
+    next_cursors = {}
+    for section in params.sections:
+        result[section], next_cursors[section] = section_page(inmate_id, section, params)
+    if params.paginated:
+        result["next_cursors"] = next_cursors
+        result["limit"] = params.limit
+    return jsonify(result), 200
@@ -1,8 +1,18 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from sqlalchemy.exc import IntegrityError
 from app.model import db, Inmate, SurveyAnswer, EmotionLog
 from app.services.emotion_service import analyze_video_emotions
-from app.services.analysis_pipeline import analyze_gender, analyze_image_emotion, extract_prescription_ocr, analyze_voice_emotion
+from app.services.analysis_pipeline import analyze_gender, analyze_image_emotion, extract_prescription_ocr, stream_prescription_ocr, analyze_voice_emotion, analyze_voice_emotions_batch, OCR_FAILED, OCR_UNREACHABLE
+from app.services.ocr_client import OCRUnavailable, OCRError
+from app.services.job_service import register_handler, submit_job, wants_async, job_upload_path
+from app.services.inmate_listing import parse_list_args, list_inmates
+from app.services.inmate_import import detect_format, iter_records, import_inmates
 from app.utils.constants import MEDICAL_QUESTIONS
+from app.utils.http_cache import conditional_json
+from app.utils import uploads
+from app.utils.uploads import UploadError
+from contextlib import ExitStack
+import json
 import os
 
 inmate_bp = Blueprint('inmate', __name__)
@@ -13,9 +23,16 @@ def get_questions():
 
 @inmate_bp.route('/all', methods=['GET'])
 def get_all_inmates():
-    inmates = Inmate.query.all()
+    # Filters / sort: see parse_list_args. With limit or cursor the response is
+    # a page {"inmates": [...], "next_cursor": ...}, otherwise the plain array.
+    try:
+        params = parse_list_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    rows, next_cursor = list_inmates(params)
     result = []
-    for i in inmates:
+    for i, profile_count, last_assessed_at, latest_risk, latest_urgent in rows:
         result.append({
             "id": i.id,
             "name": i.name,
@@ -25,14 +42,20 @@ def get_all_inmates():
             "crime_details": i.crime_details,
             "age": i.age,
             "gender": i.gender,
-            "diagnosis_done": len(i.health_profiles) > 0
+            "diagnosis_done": profile_count > 0,
+            "profile_count": profile_count,
+            "latest_risk_level": latest_risk,
+            "latest_urgent_alert": latest_urgent,
+            "last_assessment_at": last_assessed_at.isoformat() if last_assessed_at else None
         })
-    return jsonify(result), 200
+    if params.paginated:
+        return conditional_json({"inmates": result, "next_cursor": next_cursor, "limit": params.limit})
+    return conditional_json(result)
 
 @inmate_bp.route('/lookup', methods=['GET'])
 def lookup_inmate():
     name = request.args.get('name')
-    nic = request.args.get('nic')
+    nic = (request.args.get('nic') or '').strip()
     
     inmate = None
     if nic:
@@ -60,7 +83,9 @@ def lookup_inmate():
 def register_inmate():
     data = request.json
     name = data.get('name')
+    # Stored as NULL when missing: inmates.nic is unique. Clients may send it as a number
     nic = data.get('nic')
+    nic = (str(nic).strip() or None) if nic is not None else None
     address = data.get('address')
     tel_no = data.get('tel_no')
     crime_details = data.get('crime_details')
@@ -82,15 +107,43 @@ def register_inmate():
         existing_inmate.address = address
         existing_inmate.tel_no = tel_no
         existing_inmate.crime_details = crime_details
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({"error": f"NIC {nic} is already registered to another inmate"}), 409
         return jsonify({"message": "Inmate updated successfully", "id": existing_inmate.id}), 200
         
-    # incremental inmate id
-    inmate_id = max([i.id for i in Inmate.query.all()]) + 1 if Inmate.query.all() else 1
-    new_inmate = Inmate(id=inmate_id, name=name, nic=nic, address=address, tel_no=tel_no, crime_details=crime_details, age=age, gender=gender)
+    # id is assigned by the database, safe under concurrent registrations
+    new_inmate = Inmate(name=name, nic=nic, address=address, tel_no=tel_no, crime_details=crime_details, age=age, gender=gender)
     db.session.add(new_inmate)
-    db.session.commit()
-    return jsonify({"message": "Inmate registered successfully"}), 201
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": f"NIC {nic} is already registered to another inmate"}), 409
+    return jsonify({"message": "Inmate registered successfully", "id": new_inmate.id}), 201
+
+@inmate_bp.route('/import', methods=['POST'])
+def bulk_import_inmates():
+    """
+    Bulk create/update from a CSV (header row) or JSONL body with the fields
+    of /register. Rows match existing inmates on NIC, then name.
+    Returns a summary and one {"row", "status", "id"|"error"} per row. If the
+    body becomes unreadable part-way, the rows before it stay imported and
+    the response is a 400 with that summary plus "error" and "stopped_at_row".
+    """
+    try:
+        fmt = detect_format(request.content_type, request.args.get('format'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 415
+    
+    chunk_size = request.args.get('chunk_size', type=int)
+    result = import_inmates(iter_records(request.stream, fmt), chunk_size=chunk_size)
+    if "error" in result:
+        result["error"] = f"Could not read the {fmt} body: {result['error']}"
+        return jsonify(result), 400
+    return jsonify(result), 200
 
 
 @inmate_bp.route('/submit_survey', methods=['POST'])
@@ -114,6 +167,32 @@ def submit_survey():
     db.session.commit()
     return jsonify({"message": "Survey saved successfully"}), 201
 
+def _process_detect_emotion(inmate_id, video_path, stride=None, target_fps=None, max_frames=None):
+    """Runs the video pipeline, stores the EmotionLog and removes the clip."""
+    try:
+        # Predict using YOLO service
+        stats = {}
+        emotion, conf = analyze_video_emotions(video_path, stride=stride, target_fps=target_fps, max_frames=max_frames, stats=stats)
+        
+        # Store in SQL
+        log = EmotionLog(inmate_id=inmate_id, predicted_emotion=emotion, confidence_score=conf)
+        db.session.add(log)
+        db.session.commit()
+    finally:
+        # Cleanup
+        if os.path.exists(video_path):
+            os.remove(video_path)
+    
+    timings = {k: round(v, 4) for k, v in stats.items() if k.endswith('_s')}
+    return {
+        "predicted_emotion": emotion,
+        "confidence": conf,
+        "frames_sampled": stats.get("frames_sampled", 0),
+        "timings": timings
+    }
+
+register_handler('detect_emotion', _process_detect_emotion)
+
 @inmate_bp.route('/detect_emotion', methods=['POST'])
 def detect_emotion():
     if 'video' not in request.files:
@@ -126,22 +205,27 @@ def detect_emotion():
     if not inmate_id:
         return jsonify({"error": "Inmate not found"}), 404
     
-    # Save temp file
-    temp_path = os.path.join("uploads", video.filename)
-    video.save(temp_path)
+    # Optional per-request sampling overrides (defaults come from env config)
+    sampling = {
+        "stride": request.form.get('stride', type=int),
+        "target_fps": request.form.get('target_fps', type=float),
+        "max_frames": request.form.get('max_frames', type=int)
+    }
     
-    # Predict using YOLO service
-    emotion, conf = analyze_video_emotions(temp_path)
-    
-    # Store in SQL
-    log = EmotionLog(inmate_id=inmate_id, predicted_emotion=emotion, confidence_score=conf)
-    db.session.add(log)
-    db.session.commit()
-    
-    # Cleanup
-    os.remove(temp_path)
-    
-    return jsonify({"predicted_emotion": emotion, "confidence": conf}), 200
+    try:
+        if wants_async(request):
+            # The clip must outlive this request, so give it a unique name
+            job_path = job_upload_path(video.filename)
+            uploads.save_upload(video, job_path, 'video')
+            job_id = submit_job(current_app._get_current_object(), 'detect_emotion',
+                                {"inmate_id": inmate_id, "video_path": job_path, **sampling})
+            return jsonify({"job_id": job_id, "status": "queued"}), 202
+        
+        # OpenCV needs a path: spool to a unique temp file, removed on exit
+        with uploads.spooled(video, 'video') as temp_path:
+            return jsonify(_process_detect_emotion(inmate_id, temp_path, **sampling)), 200
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
 
 @inmate_bp.route('/analyze_initial_image', methods=['POST'])
 def analyze_initial_image():
@@ -153,11 +237,13 @@ def analyze_initial_image():
     if not inmate:
         return jsonify({"error": "Inmate not found"}), 404
         
-    temp_path = os.path.join("uploads", image.filename)
-    image.save(temp_path)
-    
-    gender_label, gender_conf = analyze_gender(temp_path)
-    emotion_label, emotion_conf = analyze_image_emotion(temp_path)
+    try:
+        with uploads.in_memory(image, 'image') as upload:
+            frame = upload.bgr()
+            gender_label, gender_conf = analyze_gender(frame[..., ::-1])
+            emotion_label, emotion_conf = analyze_image_emotion(frame)
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
     
     # Validation against registered gender
     registered_gender = inmate.gender.lower().strip() if inmate.gender else ""
@@ -182,7 +268,6 @@ def analyze_initial_image():
     inmate.visual_emotion = emotion_label
     db.session.commit()
     
-    os.remove(temp_path)
     return jsonify({
         "gender": gender_label, 
         "emotion": emotion_label, 
@@ -190,8 +275,30 @@ def analyze_initial_image():
         "mismatch_warning": f"Warning: Detected gender ({gender_label}) does not match registered gender ({inmate.gender})" if gender_mismatch else None
     }), 200
 
+def _stream_prescription(inmate_id, fragments):
+    """NDJSON: a `text` event per OCR fragment, then `done` (text saved) or `error`."""
+    parts = []
+    try:
+        for fragment in fragments:
+            parts.append(fragment)
+            yield json.dumps({"type": "text", "text": fragment}) + "\n"
+    except (OCRUnavailable, OCRError) as e:
+        print(f"OCR stream error: {e}")
+        message = OCR_UNREACHABLE if isinstance(e, OCRUnavailable) else OCR_FAILED
+        yield json.dumps({"type": "error", "error": message, "partial_text": "".join(parts)}) + "\n"
+        return
+    extracted_text = "".join(parts)
+    inmate = Inmate.query.get(inmate_id)
+    inmate.ocr_prescription = extracted_text
+    db.session.commit()
+    yield json.dumps({"type": "done", "extracted_text": extracted_text}) + "\n"
+
 @inmate_bp.route('/extract_prescription', methods=['POST'])
 def extract_prescription():
+    """
+    OCR of a prescription photo. stream=1 (or Accept: application/x-ndjson)
+    returns the text as NDJSON events while Ollama generates it.
+    """
     if 'image' not in request.files:
         return jsonify({"error": "No image file provided"}), 400
     image = request.files['image']
@@ -200,14 +307,23 @@ def extract_prescription():
     if not inmate:
         return jsonify({"error": "Inmate not found"}), 404
         
-    temp_path = os.path.join("uploads", image.filename)
-    image.save(temp_path)
-    
-    extracted_text = extract_prescription_ocr(temp_path)
+    stream = request.values.get('stream', '').lower() in ('1', 'true', 'yes') or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+    try:
+        with uploads.in_memory(image, 'image') as upload:
+            if stream:
+                fragments = stream_prescription_ocr(upload.data)
+            else:
+                extracted_text = extract_prescription_ocr(upload.data)
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if stream:
+        return Response(stream_with_context(_stream_prescription(inmate.id, fragments)), mimetype='application/x-ndjson')
     inmate.ocr_prescription = extracted_text
     db.session.commit()
     
-    os.remove(temp_path)
     return jsonify({"extracted_text": extracted_text}), 200
 
 @inmate_bp.route('/analyze_voice', methods=['POST'])
@@ -223,12 +339,9 @@ def analyze_voice():
             
         emotion_label = "neutral"
         if 'audio' in request.files:
-            audio = request.files['audio']
-            temp_path = os.path.join("uploads", audio.filename)
-            audio.save(temp_path)
-            emotion_label, conf = analyze_voice_emotion(temp_path)
+            with uploads.in_memory(request.files['audio'], 'audio') as upload:
+                emotion_label, conf = analyze_voice_emotion(upload.data)
             print("Voice emotion detected:", emotion_label)
-            os.remove(temp_path)
             
         new_answer = SurveyAnswer(
             inmate_id=inmate.id,
@@ -240,6 +353,65 @@ def analyze_voice():
         db.session.commit()
         
         return jsonify({"message": "Answer saved", "voice_emotion": emotion_label}), 200
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         print(f"Error analyzing voice: {e}")
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+@inmate_bp.route('/analyze_voice_batch', methods=['POST'])
+def analyze_voice_batch():
+    """
+    Whole-survey submission: repeated `question` / `answer` form fields (in
+    order) plus an optional `audio_<i>` file for the i-th answer. All clips are
+    classified in batched forward passes and every answer is saved in one commit.
+    """
+    try:
+        username = request.form.get('Username')
+        questions = request.form.getlist('question')
+        answers = request.form.getlist('answer')
+        
+        inmate = Inmate.query.filter_by(name=username).first()
+        if not inmate:
+            return jsonify({"error": "Inmate not found"}), 404
+        if not questions or len(questions) != len(answers):
+            return jsonify({"error": "question and answer must be given once per answer"}), 400
+        
+        audio_indices = []
+        with ExitStack() as held:
+            clips = []
+            for i in range(len(questions)):
+                audio = request.files.get(f'audio_{i}')
+                if audio is None or audio.filename == '':
+                    continue
+                clips.append(held.enter_context(uploads.in_memory(audio, 'audio')).data)
+                audio_indices.append(i)
+            
+            predictions = analyze_voice_emotions_batch(clips)
+        voice_results = {i: prediction for i, prediction in zip(audio_indices, predictions)}
+        
+        results = []
+        for i, (question, answer) in enumerate(zip(questions, answers)):
+            emotion_label, conf = voice_results.get(i, ("neutral", 0.0))
+            db.session.add(SurveyAnswer(
+                inmate_id=inmate.id,
+                question_text=question,
+                answer_text=answer,
+                voice_emotion=emotion_label
+            ))
+            results.append({
+                "question": question,
+                "answer": answer,
+                "voice_emotion": emotion_label,
+                "confidence": conf,
+                "has_audio": i in voice_results
+            })
+        db.session.commit()
+        
+        return jsonify({"message": f"Saved {len(results)} answers", "results": results}), 200
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error analyzing voice batch: {e}")
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,39 @@
+from flask import Blueprint, request, jsonify
+from app.model import Job
+from app.services.job_service import job_to_dict, queue_depths
+
+job_bp = Blueprint('jobs', __name__)
+
+@job_bp.route('/', methods=['GET'])
+def list_jobs():
+    query = Job.query
+    job_type = request.args.get('type')
+    status = request.args.get('status')
+    if job_type:
+        query = query.filter_by(job_type=job_type)
+    if status:
+        query = query.filter_by(status=status)
+    limit = min(request.args.get('limit', 50, type=int), 500)
+
+    jobs = query.order_by(Job.created_at.desc()).limit(limit).all()
+    return jsonify({"jobs": [job_to_dict(j) for j in jobs], "queue_depths": queue_depths()}), 200
+
+@job_bp.route('/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    job = Job.query.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job_to_dict(job)), 200
+
+@job_bp.route('/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = Job.query.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    if job.status in ('queued', 'running'):
+        # Not done yet, poll again later
+        return jsonify(job_to_dict(job)), 202
+    if job.status == 'failed':
+        return jsonify(job_to_dict(job)), 500
+    return jsonify(job_to_dict(job, include_result=True)), 200
@@ -0,0 +1,9 @@
+from flask import Blueprint, Response
+from app.utils import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Prometheus text exposition format, scraped per process
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
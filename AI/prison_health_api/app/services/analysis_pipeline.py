@@ -1,55 +1,59 @@
-from transformers import pipeline, AutoConfig, Wav2Vec2ForSequenceClassification, Wav2Vec2FeatureExtractor
-import torch
-import librosa
-import torch.quantization
-import cv2
-import requests
-import json
-import base64
 import os
+import numpy as np
+from app.utils import metrics
+from . import model_registry, inference_client, ocr_client
+from .ocr_client import OCR_REQUESTS
 from .emotion_service import analyze_image_emotions
+from .audio_frontend import prepare_voice_windows
 
-# 1. Initialize HuggingFace/PyTorch Models (Lazy Load to save startup time)
-_gender_pipe = None
-_voice_model = None
-_voice_feature_extractor = None
+VOICE_SAMPLE_RATE = 16000
+# Batched voice inference: audio windows per forward pass, and the
+# longest/shortest length ratio allowed inside one zero-padded batch. The
+# padding shifts GroupNorm statistics, so the logits drift roughly with the
+# padded share of a batch (benchmarks/onnx_parity.py --models voice_batch)
+VOICE_BATCH_SIZE = int(os.getenv("VOICE_BATCH_SIZE", "10"))
+VOICE_BUCKET_RATIO = float(os.getenv("VOICE_BUCKET_RATIO", "1.25"))
 
+VOICE_WINDOWS = metrics.counter("voice_windows_total", "Audio windows run through the voice emotion model.")
+VOICE_AUDIO_SECONDS = metrics.counter("voice_audio_seconds_total", "Seconds of audio run through the voice emotion model.")
+
+# 1. HuggingFace/PyTorch Models are lazily loaded once per process by the model registry
 def get_gender_pipeline():
-    global _gender_pipe
-    if _gender_pipe is None:
-        print("Loading Realistic-Gender-Classification model...")
-        _gender_pipe = pipeline("image-classification", model="prithivMLmods/Realistic-Gender-Classification")
-    return _gender_pipe
+    return model_registry.get("gender_pipeline")
 
 def get_voice_model():
-    global _voice_model, _voice_feature_extractor
-    if _voice_model is None:
-        print("Loading Quantized Voice Emotion Classification model...")
-        try:
-            model_dir = os.path.join(os.path.dirname(__file__), '..', 'models', 'best_wav2vec_model')
-            weights_path = os.path.join(os.path.dirname(__file__), '..', 'models', 'quantized_emotion_model.pth')
-            
-            config = AutoConfig.from_pretrained(model_dir)
-            _voice_feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(model_dir)
-            
-            model = Wav2Vec2ForSequenceClassification(config)
-            model = torch.quantization.quantize_dynamic(
-                model, {torch.nn.Linear}, dtype=torch.qint8
-            )
-            model.load_state_dict(torch.load(weights_path, map_location='cpu'))
-            model.eval()
-            _voice_model = model
-            print("Successfully loaded quantized_emotion_model.")
-        except Exception as e:
-            print(f"Failed to load Voice Model: {e}")
-            raise e
-    return _voice_model, _voice_feature_extractor
+    return model_registry.get("voice_model")
 
 # 2. Gender from Initial Image
-def analyze_gender(image_path):
-    pipe = get_gender_pipeline()
+def classify_gender_local(image, top_k=5):
+    """Gender pipeline in this process; `image` is a path or an RGB uint8 array."""
+    if isinstance(image, np.ndarray):
+        from PIL import Image
+        image = Image.fromarray(image)
+    return get_gender_pipeline()(image, top_k=top_k)
+
+def _classify_gender(image):
+    if inference_client.enabled():
+        rgb = image
+        if not isinstance(image, np.ndarray):
+            import cv2
+            bgr = cv2.imread(image)
+            if bgr is None:
+                raise ValueError(f"Could not read image {image}")
+            rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        try:
+            return inference_client.classify_gender(rgb)
+        except inference_client.InferenceUnavailable as e:
+            if not inference_client.should_fall_back(e):
+                raise
+            print(f"{e}; running the gender model in-process")
+    return classify_gender_local(image)
+
+def analyze_gender(image):
+    """`image` is a path or a decoded RGB uint8 array."""
     try:
-        results = pipe(image_path)
+        with metrics.stage("gender.classify"):
+            results = _classify_gender(image)
         if results:
             # e.g., [{'label': 'male', 'score': 0.99}, ...]
             best = max(results, key=lambda x: x['score'])
@@ -58,62 +62,173 @@ def analyze_gender(image_path):
         print(f"Gender analysis error: {e}")
     return "Unknown", 0.0
 
-# 3. OCR using glm-ocr:latest via local Ollama
-def extract_prescription_ocr(image_path):
-    # Convert image to base64
-    with open(image_path, "rb") as image_file:
-        base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-    
-    # Connect to Ollama (respecting Docker configurations if present)
-    base_url = os.getenv("LLM_BASE_URL", "http://localhost:11434")
-    # Clean up any trailing /v1 if reused from OpenAI-style configs
-    if base_url.endswith("/v1"):
-        base_url = base_url[:-3]
-    
-    url = f"{base_url}/api/generate"
-    
-    payload = {
-        "model": "glm-ocr:latest",
-        "prompt": "Extract all the text from this medical prescription. Output only the extracted text.",
-        "stream": False,
-        "images": [base64_image]
-    }
-    
+# 3. OCR using glm-ocr:latest via local Ollama (pooled, retried client in ocr_client.py)
+OCR_FAILED = "Failed to extract text using OCR."
+OCR_UNREACHABLE = "Failed to connect to local Ollama instance for OCR."
+
+def _unavailable_status(error):
+    return "circuit_open" if isinstance(error, ocr_client.CircuitOpen) else "unreachable"
+
+def extract_prescription_ocr(image):
+    """OCR text of a prescription (a path or the uploaded bytes), or a failure message."""
     try:
         print("Calling Ollama glm-ocr:latest...")
-        response = requests.post(url, json=payload, timeout=60)
-        if response.status_code == 200:
-            result = response.json()
-            return result.get('response', '')
-        else:
-            print(f"Ollama OCR Error: {response.text}")
-            return "Failed to extract text using OCR."
-    except Exception as e:
+        text = ocr_client.get_client().extract(image)
+        OCR_REQUESTS.inc(status="ok")
+        return text
+    except ocr_client.OCRUnavailable as e:
+        OCR_REQUESTS.inc(status=_unavailable_status(e))
         print(f"OCR Connection Error: {e}")
-        return "Failed to connect to local Ollama instance for OCR."
+        return OCR_UNREACHABLE
+    except (ocr_client.OCRError, ValueError) as e:
+        OCR_REQUESTS.inc(status="error")
+        print(f"Ollama OCR Error: {e}")
+        return OCR_FAILED
+
+def stream_prescription_ocr(image):
+    """
+    Prepares the image right away (so the upload can be released) and
+    returns an iterator of OCR text fragments. Iterating raises
+    ocr_client.OCRUnavailable / OCRError.
+    """
+    client = ocr_client.get_client()
+    encoded = client.prepare(image)
+
+    def fragments():
+        try:
+            yield from client.stream_encoded(encoded)
+        except ocr_client.OCRUnavailable as e:
+            OCR_REQUESTS.inc(status=_unavailable_status(e))
+            raise
+        except ocr_client.OCRError:
+            OCR_REQUESTS.inc(status="error")
+            raise
+        OCR_REQUESTS.inc(status="ok")
+    return fragments()
 
 # 4. Voice emotion analysis from recorded answer audio
-def analyze_voice_emotion(audio_path):
-    try:
-        model, feature_extractor = get_voice_model()
-        speech, sr = librosa.load(audio_path, sr=16000)
-        
-        inputs = feature_extractor(speech, sampling_rate=16000, return_tensors="pt", padding=True)
-        
-        with torch.no_grad():
-            logits = model(**inputs).logits
-            
-        pred_id = torch.argmax(logits, dim=-1).item()
-        confidence = torch.nn.functional.softmax(logits, dim=-1).max().item()
-        
-        config = model.config
-        label = config.id2label[pred_id]
+def _length_buckets(lengths, max_batch_size, max_ratio):
+    """
+    Groups sample indices into batches of similar length (sorted, at most
+    max_batch_size each, longest <= max_ratio * shortest) so padding stays small.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    buckets = []
+    current = []
+    for i in order:
+        if current and (len(current) >= max_batch_size or lengths[i] > max_ratio * max(1, lengths[current[0]])):
+            buckets.append(current)
+            current = []
+        current.append(i)
+    if current:
+        buckets.append(current)
+    return buckets
+
+def _padding_is_masked(model):
+    """
+    Whether the model takes an attention mask for padded batches. Only
+    LayerNorm feature encoders ("layer") do; GroupNorm ones ("group",
+    wav2vec2-base style, like the shipped model) must get zero-padded input
+    without a mask, and neither can an ONNX graph exported without one.
+    """
+    if getattr(model.config, "feat_extract_norm", "group") != "layer":
+        return False
+    input_names = getattr(model, "input_names", None)
+    return input_names is None or "attention_mask" in input_names
+
+def voice_logits_local(windows):
+    """
+    One batched forward pass over 16 kHz windows in this process. Shorter
+    windows are zero-padded (after per-window normalization); the padding
+    is masked out where the model supports it (see _padding_is_masked) and
+    otherwise left as silence, which callers keep small by batching windows
+    of similar length (_length_buckets).
+    Returns (logits [n, classes] as numpy, labels by class id).
+    """
+    import torch
+    model, feature_extractor = get_voice_model()
+    with metrics.stage("voice.features"):
+        # The mask keeps the padding out of the normalization statistics
+        inputs = feature_extractor(windows, sampling_rate=VOICE_SAMPLE_RATE, return_tensors="pt",
+                                   padding=True, return_attention_mask=True)
+    if not _padding_is_masked(model):
+        del inputs["attention_mask"]
+    with torch.no_grad(), metrics.stage("voice.forward"):
+        logits = model(**inputs).logits.detach().cpu().numpy()
+    id2label = model.config.id2label
+    return logits, [id2label[i] for i in range(len(id2label))]
+
+def _voice_logits(windows):
+    if inference_client.enabled():
+        try:
+            with metrics.stage("voice.forward"):
+                return inference_client.voice_logits(windows)
+        except inference_client.InferenceUnavailable as e:
+            if not inference_client.should_fall_back(e):
+                raise
+            print(f"{e}; running the voice model in-process")
+    return voice_logits_local(windows)
+
+def analyze_voice_emotions_batch(audio_clips):
+    """
+    Voice emotion for several recordings. Each clip goes through the audio
+    front-end (chunked decode, silence trimming, fixed windows with a hard
+    sample cap); all windows are grouped into length buckets and each bucket
+    goes through the model in one zero-padded forward pass. Window logits are
+    averaged per clip, weighted by window length. Returns
+    [(label, confidence), ...] in input order; unreadable clips get ("neutral", 0.0).
+    Clips are paths or encoded audio bytes.
+    """
+    results = [("neutral", 0.0)] * len(audio_clips)
+    if not audio_clips:
+        return results
+    if not inference_client.enabled():
+        try:
+            get_voice_model()
+        except Exception as e:
+            print(f"Voice emotion error: {e}")
+            return results
+    
+    windows, owners = [], []
+    for i, audio in enumerate(audio_clips):
+        try:
+            with metrics.stage("voice.frontend"):
+                clip_windows = prepare_voice_windows(audio, VOICE_SAMPLE_RATE)
+            for window in clip_windows:
+                windows.append(window)
+                owners.append(i)
+        except Exception as e:
+            print(f"Voice emotion error: {e}")
+    
+    logit_sums = {}
+    weights = {}
+    labels = None
+    for bucket in _length_buckets([len(w) for w in windows], VOICE_BATCH_SIZE, VOICE_BUCKET_RATIO):
+        try:
+            logits, labels = _voice_logits([windows[b] for b in bucket])
+        except Exception as e:
+            print(f"Voice emotion error: {e}")
+            continue
         
-        return label, float(confidence)
-    except Exception as e:
-        print(f"Voice emotion error: {e}")
-    return "neutral", 0.0
+        VOICE_WINDOWS.inc(len(bucket))
+        VOICE_AUDIO_SECONDS.inc(sum(len(windows[b]) for b in bucket) / VOICE_SAMPLE_RATE)
+        for row, b in enumerate(bucket):
+            owner = owners[b]
+            weight = float(len(windows[b]))
+            logit_sums[owner] = logit_sums.get(owner, 0) + logits[row] * weight
+            weights[owner] = weights.get(owner, 0.0) + weight
+    
+    for owner, logit_sum in logit_sums.items():
+        mean_logits = logit_sum / weights[owner]
+        probs = np.exp(mean_logits - mean_logits.max())
+        probs /= probs.sum()
+        pred_id = int(probs.argmax())
+        results[owner] = (labels[pred_id], float(probs[pred_id]))
+    return results
+
+def analyze_voice_emotion(audio):
+    return analyze_voice_emotions_batch([audio])[0]
 
 # 5. Reusing YOLO Emotion Model for Single Image
-def analyze_image_emotion(image_path):
-    return analyze_image_emotions(image_path)
+def analyze_image_emotion(image):
+    return analyze_image_emotions(image)
@@ -0,0 +1,155 @@
+import io
+import os
+import tempfile
+import numpy as np
+
+# Audio front-end for voice emotion: decodes a recording in blocks, trims
+# leading/trailing/internal silence with an energy VAD and cuts what is left
+# into fixed windows, so the samples fed to wav2vec2 per recording are
+# bounded no matter how long the recording is.
+
+SAMPLE_RATE = 16000
+
+AUDIO_MAX_DECODE_SECONDS = float(os.getenv("AUDIO_MAX_DECODE_SECONDS", "300")) # raw audio decoded at most
+AUDIO_VAD_THRESHOLD_DB = float(os.getenv("AUDIO_VAD_THRESHOLD_DB", "-45")) # absolute floor (dBFS)
+AUDIO_VAD_DYNAMIC_RANGE_DB = float(os.getenv("AUDIO_VAD_DYNAMIC_RANGE_DB", "35")) # below peak = silence
+AUDIO_VAD_PAD_MS = float(os.getenv("AUDIO_VAD_PAD_MS", "150")) # kept around each voiced region
+AUDIO_VAD_MIN_SILENCE_MS = float(os.getenv("AUDIO_VAD_MIN_SILENCE_MS", "400")) # shorter pauses are kept
+AUDIO_WINDOW_SECONDS = float(os.getenv("AUDIO_WINDOW_SECONDS", "8"))
+AUDIO_MIN_WINDOW_SECONDS = float(os.getenv("AUDIO_MIN_WINDOW_SECONDS", "1"))
+AUDIO_MAX_INFERENCE_SECONDS = float(os.getenv("AUDIO_MAX_INFERENCE_SECONDS", "32")) # hard cap per recording
+if AUDIO_MAX_INFERENCE_SECONDS <= 0 or AUDIO_WINDOW_SECONDS <= 0:
+    raise ValueError("AUDIO_MAX_INFERENCE_SECONDS and AUDIO_WINDOW_SECONDS must be positive")
+
+_FRAME_MS = 25
+_HOP_MS = 10
+_STREAM_FRAME = 4096
+_STREAM_BLOCK = 64 # frames per block (~6s at 44.1kHz)
+
+def _is_encoded_bytes(audio):
+    return isinstance(audio, (bytes, bytearray, memoryview))
+
+def _load_bounded(audio_path, sr, max_seconds):
+    import librosa
+    speech, _ = librosa.load(audio_path, sr=sr, mono=True, duration=max_seconds or None)
+    return speech.astype(np.float32, copy=False)
+
+def decode_audio(audio, sr=SAMPLE_RATE, max_seconds=None):
+    """
+    Decodes mono audio at `sr`, block by block, stopping after `max_seconds`.
+    `audio` is a path or the encoded file's bytes; bytes are decoded from
+    memory. Containers soundfile cannot stream (e.g. browser webm/opus) fall
+    back to librosa.load, which is still bounded by `duration` and needs a
+    file, so in-memory audio is written to a temp file for that case only.
+    """
+    import librosa
+    max_seconds = AUDIO_MAX_DECODE_SECONDS if max_seconds is None else max_seconds
+    source = io.BytesIO(audio) if _is_encoded_bytes(audio) else audio
+    try:
+        native_sr = librosa.get_samplerate(source)
+        if hasattr(source, "seek"):
+            source.seek(0)
+        blocks = []
+        decoded = 0
+        limit = int(max_seconds * native_sr) if max_seconds else None
+        for block in librosa.stream(source, block_length=_STREAM_BLOCK, frame_length=_STREAM_FRAME,
+                                    hop_length=_STREAM_FRAME, mono=True):
+            if limit is not None and decoded + len(block) > limit:
+                block = block[:limit - decoded]
+            decoded += len(block)
+            if native_sr != sr:
+                block = librosa.resample(block, orig_sr=native_sr, target_sr=sr)
+            blocks.append(block.astype(np.float32, copy=False))
+            if limit is not None and decoded >= limit:
+                break
+        if blocks:
+            return np.concatenate(blocks)
+        return np.zeros(0, dtype=np.float32)
+    except Exception:
+        if not _is_encoded_bytes(audio):
+            return _load_bounded(audio, sr, max_seconds)
+        # audioread / ffmpeg only read from files
+        fd, path = tempfile.mkstemp(prefix="audio_", suffix=".bin")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(audio)
+            return _load_bounded(path, sr, max_seconds)
+        finally:
+            os.remove(path)
+
+def trim_silence(speech, sr=SAMPLE_RATE):
+    """
+    Energy VAD: drops leading/trailing silence and internal pauses longer than
+    AUDIO_VAD_MIN_SILENCE_MS. Returns an empty array if nothing is voiced.
+    """
+    import librosa
+    if len(speech) == 0:
+        return speech
+    frame_length = int(sr * _FRAME_MS / 1000)
+    hop_length = int(sr * _HOP_MS / 1000)
+    if len(speech) < frame_length:
+        return speech
+
+    rms = librosa.feature.rms(y=speech, frame_length=frame_length, hop_length=hop_length, center=False)[0]
+    rms_db = 20 * np.log10(np.maximum(rms, 1e-10))
+    threshold = max(AUDIO_VAD_THRESHOLD_DB, rms_db.max() - AUDIO_VAD_DYNAMIC_RANGE_DB)
+    voiced = rms_db > threshold
+    if not voiced.any():
+        return np.zeros(0, dtype=speech.dtype)
+
+    # Close pauses shorter than the minimum silence, then pad each voiced run
+    min_gap = int(AUDIO_VAD_MIN_SILENCE_MS / _HOP_MS)
+    idx = np.flatnonzero(voiced)
+    gaps = np.flatnonzero(np.diff(idx) > 1)
+    for g in gaps:
+        start, end = idx[g] + 1, idx[g + 1]
+        if end - start < min_gap:
+            voiced[start:end] = True
+    pad = int(AUDIO_VAD_PAD_MS / _HOP_MS)
+    if pad:
+        voiced = np.convolve(voiced.astype(np.int8), np.ones(2 * pad + 1, dtype=np.int8), mode="same") > 0
+
+    # Frame mask -> sample mask (a sample is kept if any voiced frame covers it)
+    frames = np.flatnonzero(voiced)
+    delta = np.zeros(len(speech) + 1, dtype=np.int32)
+    np.add.at(delta, frames * hop_length, 1)
+    np.add.at(delta, np.minimum(frames * hop_length + frame_length, len(speech)), -1)
+    keep = np.cumsum(delta[:-1]) > 0
+    return speech[keep]
+
+def split_windows(speech, sr=SAMPLE_RATE):
+    """
+    Cuts speech into AUDIO_WINDOW_SECONDS windows. When more windows than
+    AUDIO_MAX_INFERENCE_SECONDS allows, evenly spaced ones are kept. A cap
+    shorter than one window shortens the window, so the cap always holds.
+    """
+    cap = int(AUDIO_MAX_INFERENCE_SECONDS * sr)
+    window = min(int(AUDIO_WINDOW_SECONDS * sr), cap)
+    min_window = int(AUDIO_MIN_WINDOW_SECONDS * sr)
+    if len(speech) == 0:
+        return []
+    if len(speech) <= window:
+        return [speech]
+
+    windows = [speech[start:start + window] for start in range(0, len(speech), window)]
+    # A short tail carries little signal, drop it
+    if len(windows) > 1 and len(windows[-1]) < min_window:
+        windows.pop()
+
+    max_windows = cap // window
+    if len(windows) > max_windows:
+        picks = np.linspace(0, len(windows) - 1, max_windows).round().astype(int)
+        windows = [windows[i] for i in picks]
+    return windows
+
+def prepare_voice_windows(audio, sr=SAMPLE_RATE):
+    """
+    decode -> VAD trim -> windows for a path or encoded bytes. Falls back to
+    the untrimmed audio if the VAD finds nothing.
+    """
+    speech = decode_audio(audio, sr)
+    trimmed = trim_silence(speech, sr)
+    if len(trimmed) < int(AUDIO_MIN_WINDOW_SECONDS * sr / 2):
+        # Very quiet recordings: let the model decide rather than returning nothing
+        trimmed = speech
+    return split_windows(trimmed, sr)
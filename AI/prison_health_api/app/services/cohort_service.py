@@ -0,0 +1,189 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from app.model import db, Inmate, HealthProfileLog
+from . import profile_cache
+from .profile_service import collect_profile_inputs, run_profile, make_profile_log
+
+# Re-profiles many inmates at once: DB reads/writes stay on the calling
+# thread, generate_health_profile fans out over a bounded thread pool
+# (LLM calls are additionally throttled by LLM_RATE_LIMIT_PER_MIN).
+
+COHORT_CONCURRENCY = int(os.getenv("COHORT_CONCURRENCY", "4"))
+COHORT_MAX_CONCURRENCY = int(os.getenv("COHORT_MAX_CONCURRENCY", "16"))
+COHORT_BATCH_SIZE = int(os.getenv("COHORT_BATCH_SIZE", "25")) # HealthProfileLog rows per transaction
+
+def _latest_profiles_subquery():
+    return db.session.query(
+        HealthProfileLog.inmate_id.label("inmate_id"),
+        db.func.max(HealthProfileLog.timestamp).label("last_ts")
+    ).group_by(HealthProfileLog.inmate_id).subquery()
+
+def select_cohort(usernames=None, inmate_ids=None, no_profile_days=None, urgent_alert=None, limit=None):
+    """
+    Resolves the inmate ids to analyze. Explicit usernames / ids are combined;
+    without them the filters pick from the whole population:
+      no_profile_days - no profile at all, or none in the last N days
+      urgent_alert    - the newest profile raised an urgent alert
+    """
+    if usernames or inmate_ids:
+        ids = set(inmate_ids or [])
+        if usernames:
+            rows = db.session.query(Inmate.id).filter(Inmate.name.in_(usernames)).all()
+            ids.update(r.id for r in rows)
+        query = db.session.query(Inmate.id).filter(Inmate.id.in_(ids))
+    else:
+        query = db.session.query(Inmate.id)
+
+    if no_profile_days is not None:
+        latest = _latest_profiles_subquery()
+        cutoff = datetime.utcnow() - timedelta(days=int(no_profile_days))
+        query = query.outerjoin(latest, latest.c.inmate_id == Inmate.id) \
+            .filter(db.or_(latest.c.last_ts.is_(None), latest.c.last_ts < cutoff))
+    if urgent_alert:
+        latest = _latest_profiles_subquery()
+        query = query.join(latest, latest.c.inmate_id == Inmate.id) \
+            .join(HealthProfileLog, db.and_(HealthProfileLog.inmate_id == Inmate.id,
+                                            HealthProfileLog.timestamp == latest.c.last_ts)) \
+            .filter(HealthProfileLog.urgent_alert.is_(True))
+
+    query = query.distinct().order_by(Inmate.id.asc())
+    if limit:
+        query = query.limit(int(limit))
+    return [row.id for row in query.all()]
+
+def _run_option(value, name, default, maximum=None):
+    if value is None:
+        return default
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"{name} must be a whole number")
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a whole number")
+    if number < 1 or (maximum is not None and number > maximum):
+        bounds = f"between 1 and {maximum}" if maximum is not None else "at least 1"
+        raise ValueError(f"{name} must be {bounds}")
+    return number
+
+def cohort_run_options(concurrency=None, batch_size=None):
+    """(concurrency, batch_size) with defaults applied; ValueError for bad values."""
+    return (_run_option(concurrency, "concurrency", COHORT_CONCURRENCY, COHORT_MAX_CONCURRENCY),
+            _run_option(batch_size, "batch_size", COHORT_BATCH_SIZE))
+
+def _profile_worker(app, inputs, force_refresh):
+    with app.app_context():
+        started = time.perf_counter()
+        analysis_json, cache_info, reused_latest = run_profile(inputs, force_refresh)
+        return analysis_json, cache_info, reused_latest, time.perf_counter() - started
+
+def _write_batch(results):
+    """Writes one transaction of HealthProfileLog rows. results: [(inmate_id, analysis_json, cache_key)]"""
+    inmates = {i.id: i for i in Inmate.query.filter(Inmate.id.in_([r[0] for r in results])).all()}
+    new_logs = []
+    for inmate_id, analysis_json, cache_key in results:
+        inmate = inmates.get(inmate_id)
+        if inmate is not None:
+            inmate.final_llm_report = json.dumps(analysis_json)
+        log = make_profile_log(inmate_id, analysis_json)
+        db.session.add(log)
+        new_logs.append((cache_key, log))
+    db.session.commit()
+    profile_cache.link_profile_logs([(key, log.id) for key, log in new_logs])
+
+def run_cohort(app, inmate_ids, concurrency=None, force_refresh=False, batch_size=None):
+    """
+    Generator of progress events (dicts) while analyzing `inmate_ids`.
+    Profiles whose generation failed are reported but not written, so a bad
+    night does not fill the history with error rows.
+    """
+    concurrency, batch_size = cohort_run_options(concurrency, batch_size)
+    total = len(inmate_ids)
+    started = time.perf_counter()
+    counts = {"done": 0, "written": 0, "unchanged": 0, "cached": 0, "failed": 0}
+
+    yield {"event": "started", "total": total, "concurrency": concurrency, "batch_size": batch_size}
+
+    remaining = iter(inmate_ids)
+    in_flight = {}
+    to_write = []
+
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="cohort")
+    try:
+        def fill():
+            # Inputs are collected lazily so the first LLM calls start right away
+            events = []
+            if len(in_flight) >= concurrency * 2:
+                return events
+            for inmate_id in remaining:
+                inmate = Inmate.query.get(inmate_id)
+                if inmate is None:
+                    counts["done"] += 1
+                    counts["failed"] += 1
+                    events.append({"event": "progress", "inmate_id": inmate_id, "status": "not_found", **counts, "total": total})
+                    continue
+                inputs = collect_profile_inputs(inmate)
+                in_flight[executor.submit(_profile_worker, app, inputs, force_refresh)] = inmate_id
+                if len(in_flight) >= concurrency * 2:
+                    break
+            return events
+
+        for event in fill():
+            yield event
+
+        while in_flight:
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                inmate_id = in_flight.pop(future)
+                counts["done"] += 1
+                try:
+                    analysis_json, cache_info, reused_latest, seconds = future.result()
+                except Exception as e:
+                    counts["failed"] += 1
+                    yield {"event": "progress", "inmate_id": inmate_id, "status": "failed", "error": str(e), **counts, "total": total}
+                    continue
+
+                if cache_info.get("hit"):
+                    counts["cached"] += 1
+                if reused_latest:
+                    status = "unchanged"
+                    counts["unchanged"] += 1
+                elif analysis_json.get("progress_indicator") == "Error":
+                    status = "failed"
+                    counts["failed"] += 1
+                else:
+                    status = "analyzed"
+                    to_write.append((inmate_id, analysis_json, cache_info.get("key")))
+
+                yield {
+                    "event": "progress",
+                    "inmate_id": inmate_id,
+                    "status": status,
+                    "risk_level": analysis_json.get("risk_level"),
+                    "urgent_alert": analysis_json.get("urgent_alert"),
+                    "cached": bool(cache_info.get("hit")),
+                    "seconds": round(seconds, 3),
+                    **counts,
+                    "total": total
+                }
+
+            if len(to_write) >= batch_size:
+                _write_batch(to_write)
+                counts["written"] += len(to_write)
+                yield {"event": "batch_committed", "rows": len(to_write), **counts, "total": total}
+                to_write = []
+
+            for event in fill():
+                yield event
+
+        if to_write:
+            _write_batch(to_write)
+            counts["written"] += len(to_write)
+            yield {"event": "batch_committed", "rows": len(to_write), **counts, "total": total}
+    finally:
+        # If the client disconnects we stop submitting; running calls finish in the background
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    yield {"event": "finished", **counts, "total": total, "seconds": round(time.perf_counter() - started, 3)}
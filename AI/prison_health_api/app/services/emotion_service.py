@@ -1,124 +1,400 @@
-from ultralytics import YOLO
-import cv2
 import collections
 import os
+import queue
+import threading
+import time
 import numpy as np
+from app.utils import metrics, profiling
+from . import model_registry, inference_client
+from .micro_batcher import MicroBatcher, MICROBATCH_ENABLED
 
 # 1. Define the Mapping for best_new.pt
 EMOTION_CLASS_NAMES = ['Angry', 'Boring', 'Disgust', 'Fear', 'Happy', 'Neutral', 'Sad', 'Stress', 'Suprise']
 
-# Load Models
-try:
-    person_model = YOLO("yolo11n.pt")
-    # To reduce output 
-    print("YOLOv11n person model loaded successfully.")
-    
-    emotion_model = YOLO("app/models/best_new.pt") 
-    print("YOLO best_new.pt emotion model loaded successfully.")
-except Exception as e:
-    print(f"Warning: YOLO models not found. Using placeholder. Error: {e}")
-    person_model = None
-    emotion_model = None
-
-def analyze_video_emotions(video_path):
+# 2. Frame sampling / batching defaults for video analysis (overridable via env)
+# Only one of stride / target fps is used (stride wins); the max-frames budget
+# is applied on top of either so long clips cost a bounded amount of inference.
+VIDEO_SAMPLE_STRIDE = int(os.getenv("VIDEO_SAMPLE_STRIDE", "0"))
+VIDEO_TARGET_FPS = float(os.getenv("VIDEO_TARGET_FPS", "5"))
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", "150"))
+VIDEO_BATCH_SIZE = int(os.getenv("VIDEO_BATCH_SIZE", "16"))
+# Decode -> inference pipeline: queue depth is counted in batches
+VIDEO_QUEUE_SIZE = int(os.getenv("VIDEO_QUEUE_SIZE", "4"))
+VIDEO_INFERENCE_WORKERS = int(os.getenv("VIDEO_INFERENCE_WORKERS", "1"))
+# Cross-request batching (see micro_batcher.py): items per forward pass
+MICROBATCH_PERSON_MAX_SIZE = int(os.getenv("MICROBATCH_PERSON_MAX_SIZE", "16"))
+MICROBATCH_EMOTION_MAX_SIZE = int(os.getenv("MICROBATCH_EMOTION_MAX_SIZE", "64"))
+
+FRAMES_READ = metrics.counter("video_frames_read_total", "Video frames read from uploaded clips.")
+FRAMES_SAMPLED = metrics.counter("video_frames_sampled_total", "Video frames decoded and sent to person detection.")
+CROPS_CLASSIFIED = metrics.counter("emotion_crops_classified_total", "Person crops run through the emotion classifier.", ("source",))
+
+_END_OF_STREAM = object()
+# Ultralytics predictors are not re-entrant, so model calls are serialized
+# (by the batchers' dispatcher threads, or this lock with MICROBATCH_ENABLED=0)
+_model_lock = threading.Lock()
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+def get_yolo_models():
+    """Shared (person_model, emotion_model) from the registry, or (None, None) if unavailable."""
+    try:
+        return model_registry.get("person_model"), model_registry.get("emotion_model")
+    except Exception as e:
+        print(f"Warning: YOLO models not found. Using placeholder. Error: {e}")
+        return None, None
+
+def resolve_frame_budget(max_frames=None):
     """
-    Analyzes a video clip using YOLO Detection -> Emotion Classification pipeline.
+    Per-request max-frames override clamped to [1, VIDEO_MAX_FRAMES], so a
+    request can lower the server's budget but never lift or disable it
+    (VIDEO_MAX_FRAMES=0 leaves only the lower bound).
     """
+    if max_frames is None:
+        return VIDEO_MAX_FRAMES
+    max_frames = max(1, int(max_frames))
+    if VIDEO_MAX_FRAMES > 0:
+        max_frames = min(max_frames, VIDEO_MAX_FRAMES)
+    return max_frames
+
+def resolve_frame_stride(source_fps, total_frames, stride=None, target_fps=None, max_frames=None):
+    """
+    Works out how many decoded frames to advance between two sampled frames.
+    Fixed stride takes precedence over target fps; the max-frames budget then
+    widens the stride further if the clip would still exceed it.
+    """
+    stride = VIDEO_SAMPLE_STRIDE if stride is None else stride
+    target_fps = VIDEO_TARGET_FPS if target_fps is None else target_fps
+    max_frames = resolve_frame_budget(max_frames)
+
+    if stride and stride > 0:
+        step = int(stride)
+    elif target_fps and target_fps > 0 and source_fps and source_fps > 0:
+        step = max(1, int(round(source_fps / target_fps)))
+    else:
+        step = 1
+
+    if max_frames and max_frames > 0 and total_frames and total_frames > 0:
+        budget_step = int(np.ceil(total_frames / float(max_frames)))
+        step = max(step, budget_step)
+
+    return max(1, step)
+
+def _best_person_crop(frame, p_result):
+    """Returns the crop of the most confident person box, or None."""
+    boxes = p_result.boxes
+    if boxes is None or len(boxes) == 0:
+        return None
+
+    # Take the most confident person box
+    best_box = max(boxes, key=lambda b: b.conf[0].item())
+    x1, y1, x2, y2 = map(int, best_box.xyxy[0].tolist())
+
+    person_crop = frame[max(0, y1):min(frame.shape[0], y2), max(0, x1):min(frame.shape[1], x2)]
+    if person_crop.size == 0:
+        return None
+    return person_crop
+
+def _person_crop_per_frame(person_model, frames):
+    """Runs the person detector once over a batch of frames; one crop (or None) per frame."""
+    person_results = person_model(frames, classes=[0], verbose=False) # class 0 is person
+    return [_best_person_crop(frame, p_result) for frame, p_result in zip(frames, person_results)]
+
+def _detect_person_crops(person_model, frames):
+    """Runs the person detector once over a batch of frames."""
+    return [crop for crop in _person_crop_per_frame(person_model, frames) if crop is not None]
+
+def _prediction_per_crop(emotion_model, crops):
+    """Runs the emotion classifier once over a batch of crops; one (label, conf) or None per crop."""
+    if not crops:
+        return []
+    predictions = []
+    e_results = emotion_model(crops, verbose=False)
+    for e_res in e_results:
+        prediction = None
+        if hasattr(e_res, 'probs') and e_res.probs is not None:
+            class_id = e_res.probs.top1
+            conf = e_res.probs.top1conf.item()
+            raw_label = emotion_model.names[class_id].capitalize()
+
+            if raw_label in EMOTION_CLASS_NAMES:
+                prediction = (raw_label, float(conf))
+        predictions.append(prediction)
+    return predictions
+
+def _classify_crops(emotion_model, crops):
+    """Runs the emotion classifier once over a batch of person crops."""
+    return [p for p in _prediction_per_crop(emotion_model, crops) if p is not None]
+
+def _registry_models():
+    person_model, emotion_model = get_yolo_models()
     if not person_model or not emotion_model:
-        return "Neutral", 0.0
+        raise RuntimeError("YOLO models are not available")
+    return person_model, emotion_model
 
-    cap = cv2.VideoCapture(video_path)
-    emotions_list = []
-    
-    frame_count = 0
-    
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-        
-        frame_count += 1            
-        
-        # 1. Detect person
-        person_results = person_model(frame, classes=[0], verbose=False) # class 0 is person
-        
-        for p_result in person_results:
-            boxes = p_result.boxes
-            if len(boxes) == 0:
-                continue
-                
-            # Take the most confident person box
-            best_box = max(boxes, key=lambda b: b.conf[0].item())
-            x1, y1, x2, y2 = map(int, best_box.xyxy[0].tolist())
-            
-            # Crop frame
-            person_crop = frame[max(0, y1):min(frame.shape[0], y2), max(0, x1):min(frame.shape[1], x2)]
-            if person_crop.size == 0:
-                continue
-                
-            # 2. Run emotion classification on crop
-            e_results = emotion_model(person_crop, verbose=False)
-            
-            for e_res in e_results:
-                if hasattr(e_res, 'probs') and e_res.probs is not None:
-                    class_id = e_res.probs.top1
-                    conf = e_res.probs.top1conf.item()
-                    raw_label = emotion_model.names[class_id].capitalize()
-                    
-                    if raw_label in EMOTION_CLASS_NAMES:
-                        print(f"Detected emotion: {raw_label} with confidence {conf}")
-                        emotions_list.append((raw_label, conf))
-    cap.release()
+def _batcher(name):
+    """The shared person / emotion MicroBatcher, created on first use."""
+    batcher = _batchers.get(name)
+    if batcher is None:
+        with _batchers_lock:
+            batcher = _batchers.get(name)
+            if batcher is None:
+                if name == "person":
+                    batcher = MicroBatcher("person_model", lambda frames: _person_crop_per_frame(_registry_models()[0], frames),
+                                           MICROBATCH_PERSON_MAX_SIZE)
+                else:
+                    batcher = MicroBatcher("emotion_model", lambda crops: _prediction_per_crop(_registry_models()[1], crops),
+                                           MICROBATCH_EMOTION_MAX_SIZE)
+                _batchers[name] = batcher
+    return batcher
+
+def classify_frames_local(frames, person_model=None, emotion_model=None):
+    """
+    Detection + classification of a frame batch with this process's models.
+    Returns (predictions, crops, detect_s, classify_s); also what the
+    inference server runs for the "emotions" op.
+    """
+    if person_model is None or emotion_model is None:
+        person_model, emotion_model = _registry_models()
+    if MICROBATCH_ENABLED:
+        # Merged with whatever other requests are detecting / classifying right now
+        t0 = time.perf_counter()
+        crops = [crop for crop in _batcher("person").submit(frames) if crop is not None]
+        t1 = time.perf_counter()
+        predictions = [p for p in _batcher("emotion").submit(crops) if p is not None]
+        t2 = time.perf_counter()
+        return predictions, len(crops), t1 - t0, t2 - t1
+    with _model_lock:
+        t0 = time.perf_counter()
+        crops = _detect_person_crops(person_model, frames)
+        t1 = time.perf_counter()
+        predictions = _classify_crops(emotion_model, crops)
+        t2 = time.perf_counter()
+    return predictions, len(crops), t1 - t0, t2 - t1
+
+def classify_frames(frames, person_model=None, emotion_model=None):
+    """classify_frames_local, on the inference server when INFERENCE_SERVER is set."""
+    if inference_client.enabled():
+        try:
+            return inference_client.classify_emotions(frames)
+        except inference_client.InferenceUnavailable as e:
+            if not inference_client.should_fall_back(e):
+                raise
+            print(f"{e}; running emotion models in-process")
+    return classify_frames_local(frames, person_model, emotion_model)
 
+def _summarize_emotions(emotions_list):
+    """Reduces per-crop predictions to (dominant_emotion, avg_conf)."""
     if not emotions_list:
         return "Neutral", 0.0
 
     # Get most common emotion
     emotion_counts = collections.Counter([e[0] for e in emotions_list])
-    if not emotion_counts:
-        return "Neutral", 0.0
-        
     dominant_emotion = emotion_counts.most_common(1)[0][0]
-    
+
     # Calculate average confidence
     total_conf = sum([e[1] for e in emotions_list if e[0] == dominant_emotion])
     count = emotion_counts[dominant_emotion]
     avg_conf = total_conf / count if count > 0 else 0.0
-    
+
     return dominant_emotion, avg_conf
 
-def analyze_image_emotions(image_path):
+def _decode_worker(cap, step, frame_budget, batch_size, frame_queue, stop_event, stats, errors):
     """
-    Analyzes a single image using YOLO Detection -> Emotion Classification pipeline.
+    Producer: decodes sampled frames and puts them on the bounded queue in
+    batches. Blocks (backpressure) while the queue is full.
     """
-    if not person_model or not emotion_model:
-        return "No Model", 0.0
+    batch = []
+    frame_index = 0
+
+    def put(item):
+        wait_start = time.perf_counter()
+        while not stop_event.is_set():
+            try:
+                frame_queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        stats["decode_blocked_s"] += time.perf_counter() - wait_start
 
-    frame = cv2.imread(image_path)
+    try:
+        while cap.isOpened() and not stop_event.is_set():
+            t0 = time.perf_counter()
+            # grab() skips the expensive decode for frames we don't sample
+            if not cap.grab():
+                break
+            frame_index += 1
+            stats["frames_read"] = frame_index
+            if (frame_index - 1) % step != 0:
+                stats["decode_s"] += time.perf_counter() - t0
+                continue
+
+            ret, frame = cap.retrieve()
+            stats["decode_s"] += time.perf_counter() - t0
+            if not ret:
+                break
+            batch.append(frame)
+            stats["frames_sampled"] += 1
+
+            if len(batch) >= batch_size:
+                put(batch)
+                batch = []
+
+            # Container frame counts can be wrong, so enforce the budget here too
+            if frame_budget and frame_budget > 0 and stats["frames_sampled"] >= frame_budget:
+                break
+
+        if batch:
+            put(batch)
+    except Exception as e:
+        errors.append(e)
+        stop_event.set()
+    finally:
+        cap.release()
+        put(_END_OF_STREAM)
+
+def _inference_worker(person_model, emotion_model, frame_queue, stop_event, worker_stats, emotions_list, errors):
+    """
+    Consumer: drains frame batches, runs detection + classification and
+    re-posts the end-of-stream marker so sibling workers stop too.
+    """
+    while not stop_event.is_set():
+        wait_start = time.perf_counter()
+        try:
+            batch = frame_queue.get(timeout=0.1)
+        except queue.Empty:
+            worker_stats["queue_wait_s"] += time.perf_counter() - wait_start
+            continue
+        worker_stats["queue_wait_s"] += time.perf_counter() - wait_start
+
+        if batch is _END_OF_STREAM:
+            frame_queue.put(_END_OF_STREAM)
+            return
+
+        try:
+            predictions, crops, detect_s, classify_s = classify_frames(batch, person_model, emotion_model)
+        except Exception as e:
+            errors.append(e)
+            stop_event.set()
+            return
+
+        worker_stats["detect_s"] += detect_s
+        worker_stats["classify_s"] += classify_s
+        metrics.observe_stage("video.detect", detect_s)
+        metrics.observe_stage("video.classify", classify_s)
+        worker_stats["crops_classified"] += crops
+        emotions_list.extend(predictions)
+
+def analyze_video_emotions(video_path, stride=None, target_fps=None, max_frames=None, batch_size=None, stats=None):
+    """
+    Analyzes a video clip using YOLO Detection -> Emotion Classification pipeline.
+
+    Frames are sampled (see resolve_frame_stride) by a decode thread and fed in
+    batches of `batch_size` through a bounded queue to the inference workers, so
+    decoding overlaps with detection/classification. If a `stats` dict is given
+    it is filled with frame counts and per-stage timings (seconds).
+    """
+    if stats is None:
+        stats = {}
+    stats.update({
+        "frames_read": 0, "frames_sampled": 0, "crops_classified": 0,
+        "decode_s": 0.0, "decode_blocked_s": 0.0, "queue_wait_s": 0.0,
+        "detect_s": 0.0, "classify_s": 0.0, "wall_s": 0.0,
+    })
+
+    # With an inference server the models live there (loaded here only on fallback)
+    person_model = emotion_model = None
+    if not inference_client.enabled():
+        person_model, emotion_model = get_yolo_models()
+        if not person_model or not emotion_model:
+            return "Neutral", 0.0
+
+    started = time.perf_counter()
+    batch_size = max(1, batch_size or VIDEO_BATCH_SIZE)
+
+    import cv2
+    cap = cv2.VideoCapture(video_path)
+    source_fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    step = resolve_frame_stride(source_fps, total_frames, stride, target_fps, max_frames)
+    frame_budget = resolve_frame_budget(max_frames)
+
+    frame_queue = queue.Queue(maxsize=max(1, VIDEO_QUEUE_SIZE))
+    stop_event = threading.Event()
+    errors = []
+    emotions_list = []
+
+    decoder = threading.Thread(
+        target=profiling.wrap_thread_target(_decode_worker),
+        args=(cap, step, frame_budget, batch_size, frame_queue, stop_event, stats, errors),
+        name="video-decode",
+        daemon=True,
+    )
+    workers = []
+    worker_stats = []
+    for i in range(max(1, VIDEO_INFERENCE_WORKERS)):
+        w_stats = {"queue_wait_s": 0.0, "detect_s": 0.0, "classify_s": 0.0, "crops_classified": 0}
+        worker_stats.append(w_stats)
+        workers.append(threading.Thread(
+            target=profiling.wrap_thread_target(_inference_worker),
+            args=(person_model, emotion_model, frame_queue, stop_event, w_stats, emotions_list, errors),
+            name=f"video-inference-{i}",
+            daemon=True,
+        ))
+
+    decoder.start()
+    for w in workers:
+        w.start()
+    try:
+        for w in workers:
+            w.join()
+    finally:
+        # Unblocks the decoder if the workers bailed out early
+        stop_event.set()
+        decoder.join()
+
+    for w_stats in worker_stats:
+        for key, value in w_stats.items():
+            stats[key] += value
+    stats["wall_s"] = time.perf_counter() - started
+    FRAMES_READ.inc(stats["frames_read"])
+    FRAMES_SAMPLED.inc(stats["frames_sampled"])
+    CROPS_CLASSIFIED.inc(stats["crops_classified"], source="video")
+    metrics.observe_stage("video.decode", stats["decode_s"])
+    metrics.observe_stage("video.total", stats["wall_s"])
+
+    if errors:
+        raise errors[0]
+
+    dominant_emotion, avg_conf = _summarize_emotions(emotions_list)
+    print(f"Video emotion: {dominant_emotion} ({avg_conf:.2f}) from {stats['frames_sampled']} sampled frames "
+          f"[decode {stats['decode_s']:.2f}s, detect {stats['detect_s']:.2f}s, classify {stats['classify_s']:.2f}s, "
+          f"wall {stats['wall_s']:.2f}s]")
+    return dominant_emotion, avg_conf
+
+def analyze_image_emotions(image):
+    """
+    Analyzes a single image (a path or a decoded BGR array) using YOLO
+    Detection -> Emotion Classification pipeline.
+    """
+    person_model = emotion_model = None
+    if not inference_client.enabled():
+        person_model, emotion_model = get_yolo_models()
+        if not person_model or not emotion_model:
+            return "No Model", 0.0
+
+    frame = image
+    if not isinstance(image, np.ndarray):
+        import cv2
+        frame = cv2.imread(image)
     if frame is None:
         return "No Frame", 0.0
 
-    person_results = person_model(frame, classes=[0], verbose=False)
-    for p_result in person_results:
-        boxes = p_result.boxes
-        if len(boxes) == 0:
-            continue
-            
-        best_box = max(boxes, key=lambda b: b.conf[0].item())
-        x1, y1, x2, y2 = map(int, best_box.xyxy[0].tolist())
-        
-        person_crop = frame[max(0, y1):min(frame.shape[0], y2), max(0, x1):min(frame.shape[1], x2)]
-        if person_crop.size == 0:
-            continue
-            
-        e_results = emotion_model(person_crop, verbose=False)
-        for e_res in e_results:
-            if hasattr(e_res, 'probs') and e_res.probs is not None:
-                class_id = e_res.probs.top1
-                conf = e_res.probs.top1conf.item()
-                raw_label = emotion_model.names[class_id].capitalize()
-                
-                if raw_label in EMOTION_CLASS_NAMES:
-                    return raw_label, float(conf)
-                    
-    return "Neutral", 0.0
\ No newline at end of file
+    predictions, crops, detect_s, classify_s = classify_frames([frame], person_model, emotion_model)
+    metrics.observe_stage("image.detect", detect_s)
+    metrics.observe_stage("image.classify", classify_s)
+    CROPS_CLASSIFIED.inc(crops, source="image")
+    if predictions:
+        return predictions[0]
+
+    return "Neutral", 0.0
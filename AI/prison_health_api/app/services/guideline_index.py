@@ -0,0 +1,192 @@
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from app.utils.constants import MEDICAL_QUESTIONS, ANSWER_OPTIONS
+from . import model_registry
+
+# The survey is always the fixed MEDICAL_QUESTIONS answered with one of the
+# ANSWER_OPTIONS, so guideline retrieval can be done once per
+# (question, severity) pair offline. At analysis time the context is then
+# assembled by lookup, without embedding a query or searching Chroma.
+
+GUIDELINE_INDEX_PATH = os.getenv("GUIDELINE_INDEX_PATH", "./guideline_index.json")
+GUIDELINE_INDEX_K = int(os.getenv("GUIDELINE_INDEX_K", "3")) # chunks stored per pair
+GUIDELINE_CONTEXT_K = int(os.getenv("GUIDELINE_CONTEXT_K", "3")) # chunks put in the prompt
+
+_cache = {"mtime": None, "index": None}
+_cache_lock = threading.Lock()
+
+_rebuild_lock = threading.Lock()
+_rebuild_state = {"running": False, "pending": False}
+
+def _pair_key(question_idx, severity):
+    return f"{question_idx}|{severity}"
+
+def _pair_query(question, answer_option):
+    return f"treatment guidelines for {question} answered '{answer_option}' and mental health interventions"
+
+def question_index(question_text):
+    """Maps stored question text to its MEDICAL_QUESTIONS index (or None)."""
+    if not question_text:
+        return None
+    text = question_text.strip()
+    if text in MEDICAL_QUESTIONS:
+        return MEDICAL_QUESTIONS.index(text)
+    # Fall back to the leading "N." numbering
+    match = re.match(r"\s*(\d+)\.", text)
+    if match:
+        idx = int(match.group(1)) - 1
+        if 0 <= idx < len(MEDICAL_QUESTIONS):
+            return idx
+    return None
+
+def answer_severity(answer_text):
+    """Maps an answer to its ANSWER_OPTIONS severity (or None for free text)."""
+    if not answer_text:
+        return None
+    normalized = answer_text.strip().lower()
+    for severity, option in enumerate(ANSWER_OPTIONS):
+        if normalized == option.lower():
+            return severity
+    # The UI shortens "More than half the days" to "More than half"
+    for severity, option in enumerate(ANSWER_OPTIONS):
+        if len(normalized) >= 8 and option.lower().startswith(normalized):
+            return severity
+    return None
+
+def build_guideline_index(path=None):
+    """
+    Retrieves the top chunks for every (question, answer-severity) pair from
+    the general guideline store and writes them to the index file.
+    """
+    path = path or GUIDELINE_INDEX_PATH
+    started = time.perf_counter()
+    vector_db = model_registry.get("chroma_general")
+    embeddings = model_registry.get(model_registry.embeddings_entry())
+
+    pairs = [(q_idx, severity) for q_idx in range(len(MEDICAL_QUESTIONS)) for severity in range(len(ANSWER_OPTIONS))]
+    queries = [_pair_query(MEDICAL_QUESTIONS[q], ANSWER_OPTIONS[s]) for q, s in pairs]
+
+    # One batched embedding call for all pairs
+    vectors = embeddings.embed_documents(queries)
+
+    chunks = []
+    chunk_ids = {}
+    entries = {}
+    for (q_idx, severity), vector in zip(pairs, vectors):
+        docs = vector_db.similarity_search_by_vector(vector, k=GUIDELINE_INDEX_K)
+        refs = []
+        for doc in docs:
+            content = doc.page_content
+            if content not in chunk_ids:
+                chunk_ids[content] = len(chunks)
+                chunks.append(content)
+            refs.append(chunk_ids[content])
+        entries[_pair_key(q_idx, severity)] = refs
+
+    index = {
+        "built_at": datetime.utcnow().isoformat(),
+        "questions": MEDICAL_QUESTIONS,
+        "answer_options": ANSWER_OPTIONS,
+        "k": GUIDELINE_INDEX_K,
+        "chunks": chunks,
+        "entries": entries
+    }
+
+    # Write atomically so readers never see a half written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, path)
+
+    print(f"Guideline index built: {len(entries)} pairs, {len(chunks)} unique chunks in {time.perf_counter() - started:.2f}s")
+    return index
+
+def load_guideline_index(path=None):
+    """Returns the index, re-reading the file only when it changed on disk."""
+    path = path or GUIDELINE_INDEX_PATH
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    with _cache_lock:
+        if _cache["mtime"] != mtime:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    index = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Warning: Could not read guideline index: {e}")
+                return None
+            # An index built for another questionnaire is unusable
+            if index.get("questions") != MEDICAL_QUESTIONS or index.get("answer_options") != ANSWER_OPTIONS:
+                print("Warning: Guideline index is stale (questionnaire changed), ignoring it.")
+                index = None
+            _cache["mtime"] = mtime
+            _cache["index"] = index
+        return _cache["index"]
+
+def lookup_guideline_context(survey_answers, k=None):
+    """
+    Assembles guideline context for [(question_text, answer_text), ...] from the
+    precomputed index. Returns None when the index is missing or no answer maps
+    to a known (question, severity) pair, so the caller can fall back to search.
+    """
+    index = load_guideline_index()
+    if not index or not survey_answers:
+        return None
+    k = k or GUIDELINE_CONTEXT_K
+
+    # Chunks retrieved for more severe answers and at a better rank win
+    scores = {}
+    matched = 0
+    for question_text, answer_text in survey_answers:
+        q_idx = question_index(question_text)
+        severity = answer_severity(answer_text)
+        if q_idx is None or severity is None:
+            continue
+        refs = index["entries"].get(_pair_key(q_idx, severity))
+        if refs is None:
+            continue
+        matched += 1
+        for rank, ref in enumerate(refs):
+            scores[ref] = scores.get(ref, 0.0) + (severity + 1) / (rank + 1)
+
+    if not matched or not scores:
+        return None
+
+    best = sorted(scores, key=lambda ref: (-scores[ref], ref))[:k]
+    return "\n\n".join(index["chunks"][ref] for ref in best)
+
+def _rebuild_loop():
+    while True:
+        try:
+            build_guideline_index()
+        except Exception as e:
+            print(f"Guideline index rebuild failed: {e}")
+        with _rebuild_lock:
+            if not _rebuild_state["pending"]:
+                _rebuild_state["running"] = False
+                return
+            _rebuild_state["pending"] = False
+
+def schedule_rebuild():
+    """
+    Rebuilds the index in the background. Calls made while a rebuild is running
+    collapse into a single follow-up rebuild.
+    """
+    with _rebuild_lock:
+        if _rebuild_state["running"]:
+            _rebuild_state["pending"] = True
+            return
+        _rebuild_state["running"] = True
+    threading.Thread(target=_rebuild_loop, name="guideline-index-rebuild", daemon=True).start()
+
+if __name__ == "__main__":
+    # Offline precomputation: python -m app.services.guideline_index
+    from dotenv import load_dotenv
+    load_dotenv()
+    build_guideline_index()
@@ -0,0 +1,301 @@
+import json
+import os
+import select
+import socket
+import struct
+import threading
+import time
+import numpy as np
+from app.utils import metrics
+
+# Thin client for the optional out-of-process inference server
+# (app/services/inference_server.py). With INFERENCE_SERVER set, the web
+# workers keep no YOLO / wav2vec2 / gender / MiniLM weights of their own:
+# frames and audio windows are copied once into a shared-memory block that
+# the server reads in place (no serialization of pixel data), and only a
+# small JSON header and the predictions cross the socket.
+#
+#   INFERENCE_SERVER=unix:/tmp/prison-inference.sock   or   tcp://127.0.0.1:5011
+#
+# Each thread keeps one connection and one reusable shared-memory block. If
+# the server cannot be reached the call falls back to in-process inference
+# (INFERENCE_FALLBACK=0 turns that into an error instead). Once a request
+# has been sent there is no fallback: a timeout or a dropped connection
+# raises InferenceError, since running the work again in-process would
+# double it and load every model into the web worker.
+
+INFERENCE_SERVER = os.getenv("INFERENCE_SERVER", "")
+INFERENCE_FALLBACK = os.getenv("INFERENCE_FALLBACK", "1").lower() in ("1", "true", "yes")
+INFERENCE_TIMEOUT_S = float(os.getenv("INFERENCE_TIMEOUT_S", "120"))
+# After a failed connect, skip the server for this long before trying again
+INFERENCE_RETRY_S = float(os.getenv("INFERENCE_RETRY_S", "5"))
+
+REQUESTS = metrics.counter("inference_client_requests_total", "Calls to the inference server by outcome.", ("op", "status"))
+REQUEST_SECONDS = metrics.histogram("inference_client_request_duration_seconds", "Round trip to the inference server.", ("op",))
+
+_HEADER = struct.Struct(">I")
+_MIN_BLOCK_BYTES = 4 * 1024 * 1024
+
+_local = threading.local()
+_down_until = 0.0
+_server_process = False
+
+class InferenceUnavailable(ConnectionError):
+    """The server could not be reached; callers may run the model in-process."""
+
+class InferenceError(RuntimeError):
+    """The request reached the server but failed, timed out or lost its connection."""
+
+def mark_server_process():
+    """Called by the inference server itself, whose model calls must stay local."""
+    global _server_process
+    _server_process = True
+
+def enabled():
+    return bool(INFERENCE_SERVER) and not _server_process
+
+def should_fall_back(error):
+    return INFERENCE_FALLBACK and isinstance(error, InferenceUnavailable)
+
+def parse_address(address):
+    """('unix', path) or ('tcp', (host, port)) from unix:/path or tcp://host:port."""
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    if address.startswith("tcp://"):
+        host, _, port = address[len("tcp://"):].rpartition(":")
+        return "tcp", (host or "127.0.0.1", int(port))
+    raise ValueError(f"INFERENCE_SERVER must be unix:/path or tcp://host:port, got {address!r}")
+
+# --- Framing (shared with the server) ---
+
+def send_message(sock, message):
+    body = json.dumps(message, separators=(",", ":")).encode()
+    sock.sendall(_HEADER.pack(len(body)) + body)
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def recv_message(sock):
+    (size,) = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    return json.loads(_recv_exact(sock, size))
+
+def attach_shared_memory(name):
+    """Maps an existing block without letting this process's resource tracker unlink it later."""
+    from multiprocessing import shared_memory
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers every attachment with the resource tracker
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+def arrays_from_block(buf, specs):
+    """Zero-copy numpy views of the arrays described by `specs` inside `buf`."""
+    return [np.ndarray(tuple(spec["shape"]), dtype=np.dtype(spec["dtype"]), buffer=buf, offset=spec["offset"])
+            for spec in specs]
+
+# --- Client side ---
+
+class _Channel:
+    """One thread's connection plus its reusable shared-memory block."""
+
+    def __init__(self):
+        kind, target = parse_address(INFERENCE_SERVER)
+        family = socket.AF_UNIX if kind == "unix" else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(INFERENCE_TIMEOUT_S)
+        self.sock.connect(target)
+        self.shm = None
+        # Set after the first round trip; only a reused connection can be stale
+        self.used = False
+
+    def block(self, size):
+        from multiprocessing import shared_memory
+        if self.shm is None or self.shm.size < size:
+            # Grow geometrically so a thread settles on one block
+            size = max(size, _MIN_BLOCK_BYTES, 2 * self.shm.size if self.shm else 0)
+            self._release_block()
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        return self.shm
+
+    def _release_block(self):
+        if self.shm is None:
+            return
+        # The server keeps its own mapping until it moves on, so unlinking is safe
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            self.shm.close()
+        except BufferError:
+            pass
+        self.shm = None
+
+    def close(self):
+        try:
+            self.sock.close()
+        finally:
+            self._release_block()
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+def _peer_closed(sock):
+    """True when the server already closed this kept-alive connection (EOF is waiting)."""
+    readable, _, _ = select.select([sock], [], [], 0)
+    if not readable:
+        return False
+    try:
+        return not sock.recv(1, socket.MSG_PEEK)
+    except OSError:
+        return True
+
+def _channel():
+    global _down_until
+    channel = getattr(_local, "channel", None)
+    if channel is not None and channel.used and _peer_closed(channel.sock):
+        _drop_channel()
+        channel = None
+    if channel is not None:
+        return channel
+    if time.time() < _down_until:
+        raise InferenceUnavailable(f"inference server {INFERENCE_SERVER} marked down")
+    try:
+        channel = _local.channel = _Channel()
+    except OSError as e:
+        _down_until = time.time() + INFERENCE_RETRY_S
+        raise InferenceUnavailable(f"cannot connect to inference server {INFERENCE_SERVER}: {e}")
+    return channel
+
+def _drop_channel():
+    channel = getattr(_local, "channel", None)
+    _local.channel = None
+    if channel is not None:
+        channel.close()
+
+def _send(channel, op, arrays, params):
+    specs, offset = [], 0
+    for a in arrays:
+        # 64-byte alignment keeps every view SIMD friendly
+        offset = (offset + 63) & ~63
+        specs.append({"shape": list(a.shape), "dtype": a.dtype.str, "offset": offset})
+        offset += a.nbytes
+    message = {"op": op, "params": params, "arrays": specs}
+    if arrays:
+        shm = channel.block(offset)
+        for a, view in zip(arrays, arrays_from_block(shm.buf, specs)):
+            view[...] = a
+        del view
+        message["shm"] = shm.name
+    send_message(channel.sock, message)
+
+def call(op, arrays=(), **params):
+    """
+    Runs `op` on the server with `arrays` passed through shared memory.
+    Returns the response dict. Raises InferenceUnavailable (could not
+    connect, safe to fall back) / InferenceError (anything after that).
+    """
+    arrays = [np.ascontiguousarray(a) for a in arrays]
+    started = time.perf_counter()
+    try:
+        channel = _channel()
+    except InferenceUnavailable:
+        REQUESTS.inc(op=op, status="unavailable")
+        raise
+    try:
+        try:
+            _send(channel, op, arrays, params)
+        except (BrokenPipeError, ConnectionResetError):
+            if not channel.used:
+                raise
+            # A kept-alive connection the server closed (e.g. it restarted)
+            # never saw this request: reconnect once and send it again
+            _drop_channel()
+            try:
+                channel = _channel()
+            except InferenceUnavailable:
+                REQUESTS.inc(op=op, status="unavailable")
+                raise
+            _send(channel, op, arrays, params)
+        response = recv_message(channel.sock)
+        channel.used = True
+    except socket.timeout as e:
+        _drop_channel()
+        REQUESTS.inc(op=op, status="timeout")
+        raise InferenceError(f"{op}: no answer from {INFERENCE_SERVER} within {INFERENCE_TIMEOUT_S}s ({e})")
+    except (OSError, ValueError) as e:
+        _drop_channel()
+        REQUESTS.inc(op=op, status="disconnected")
+        raise InferenceError(f"{op}: connection to {INFERENCE_SERVER} lost: {e}")
+    REQUEST_SECONDS.observe(time.perf_counter() - started, op=op)
+    if "error" in response:
+        REQUESTS.inc(op=op, status="error")
+        raise InferenceError(f"{op}: {response['error']}")
+    REQUESTS.inc(op=op, status="ok")
+    return response
+
+# --- Operations ---
+
+def classify_emotions(frames):
+    """Person detection + emotion classification over BGR frames: ([(label, conf)], crops, detect_s, classify_s)."""
+    response = call("emotions", frames)
+    return ([tuple(p) for p in response["predictions"]], response["crops"],
+            response["detect_s"], response["classify_s"])
+
+def classify_gender(rgb_image, top_k=5):
+    """HF image-classification output ([{'label', 'score'}, ...]) for an RGB uint8 image."""
+    return call("gender", [rgb_image], top_k=top_k)["results"]
+
+def voice_logits(windows):
+    """(logits [n, classes] float32, labels) for 16 kHz float32 windows, one padded forward pass."""
+    response = call("voice_logits", [np.asarray(w, dtype=np.float32) for w in windows])
+    return np.asarray(response["logits"], dtype=np.float32), response["labels"]
+
+def embed(texts):
+    return call("embed", texts=list(texts))["vectors"]
+
+def server_status():
+    return call("status")
+
+class RemoteEmbeddings:
+    """
+    LangChain Embeddings interface (embed_documents / embed_query) backed by
+    the server's MiniLM. Falls back to the registry's local "embeddings"
+    entry when the server is unreachable.
+    """
+
+    def __init__(self, batch_size=256):
+        self.batch_size = batch_size
+
+    def _local(self):
+        from . import model_registry
+        return model_registry.get("embeddings")
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        try:
+            vectors = []
+            for start in range(0, len(texts), self.batch_size):
+                vectors.extend(embed(texts[start:start + self.batch_size]))
+            return vectors
+        except InferenceUnavailable as e:
+            if not should_fall_back(e):
+                raise
+            print(f"{e}; embedding in-process")
+            return self._local().embed_documents(texts)
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
@@ -0,0 +1,138 @@
+import os
+import socketserver
+import time
+from dotenv import load_dotenv
+from . import model_registry, inference_client
+from .inference_client import send_message, recv_message, attach_shared_memory, arrays_from_block, parse_address
+
+# Out-of-process inference: one process owns the YOLO, wav2vec2, gender and
+# MiniLM models and serves every web worker over a Unix socket or localhost
+# TCP (protocol in inference_client.py). Requests run on one thread per
+# connection; the models keep their own locks, so concurrent callers share
+# the weights but not a forward pass.
+#
+#   python -m app.services.inference_server [unix:/tmp/prison-inference.sock | tcp://127.0.0.1:5011]
+#
+# Then start the web tier with the same INFERENCE_SERVER value.
+
+load_dotenv()
+
+DEFAULT_ADDRESS = "unix:/tmp/prison-inference.sock"
+# Loaded before the socket opens, so the first request never pays for it
+INFERENCE_SERVER_MODELS = os.getenv("INFERENCE_SERVER_MODELS", "embeddings,gender_pipeline,voice_model,person_model,emotion_model")
+
+def _op_emotions(arrays, params):
+    from .emotion_service import classify_frames_local
+    predictions, crops, detect_s, classify_s = classify_frames_local(arrays)
+    return {"predictions": predictions, "crops": crops, "detect_s": detect_s, "classify_s": classify_s}
+
+def _op_gender(arrays, params):
+    from .analysis_pipeline import classify_gender_local
+    return {"results": classify_gender_local(arrays[0], top_k=params.get("top_k", 5))}
+
+def _op_voice_logits(arrays, params):
+    from .analysis_pipeline import voice_logits_local
+    logits, labels = voice_logits_local(arrays)
+    return {"logits": logits.tolist(), "labels": labels}
+
+def _op_embed(arrays, params):
+    return {"vectors": model_registry.get("embeddings").embed_documents(params.get("texts") or [])}
+
+def _op_status(arrays, params):
+    ready, details = model_registry.readiness()
+    return {"ready": ready, "pid": os.getpid(), **details}
+
+OPERATIONS = {
+    "emotions": _op_emotions,
+    "gender": _op_gender,
+    "voice_logits": _op_voice_logits,
+    "embed": _op_embed,
+    "status": _op_status,
+}
+
+class InferenceHandler(socketserver.BaseRequestHandler):
+    """One client connection: request / response messages until it disconnects."""
+
+    def setup(self):
+        # The client reuses one block per thread; keep it mapped between requests
+        self.shm = None
+
+    def _block(self, name):
+        if self.shm is None or self.shm.name.lstrip("/") != name.lstrip("/"):
+            self._release()
+            self.shm = attach_shared_memory(name)
+        return self.shm
+
+    def _release(self):
+        if self.shm is not None:
+            try:
+                self.shm.close()
+            except BufferError:
+                pass
+            self.shm = None
+
+    def handle(self):
+        while True:
+            try:
+                message = recv_message(self.request)
+            except (ConnectionError, OSError, ValueError):
+                return
+            started = time.perf_counter()
+            arrays = []
+            try:
+                operation = OPERATIONS.get(message.get("op"))
+                if operation is None:
+                    raise ValueError(f"unknown op {message.get('op')!r}")
+                if message.get("arrays"):
+                    arrays = arrays_from_block(self._block(message["shm"]).buf, message["arrays"])
+                response = operation(arrays, message.get("params") or {})
+                response["server_s"] = time.perf_counter() - started
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            # Views into the block must be gone before it can be remapped
+            del arrays
+            try:
+                send_message(self.request, response)
+            except OSError:
+                return
+
+    def finish(self):
+        self._release()
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def create_server(address):
+    kind, target = parse_address(address)
+    if kind == "unix":
+        if os.path.exists(target):
+            os.remove(target)
+        server = ThreadingUnixServer(target, InferenceHandler)
+        # Only this user's web workers may connect
+        os.chmod(target, 0o600)
+        return server
+    return ThreadingTCPServer(target, InferenceHandler)
+
+def serve(address=None, models=None):
+    address = address or inference_client.INFERENCE_SERVER or DEFAULT_ADDRESS
+    inference_client.mark_server_process()
+    model_registry.warm_up(INFERENCE_SERVER_MODELS if models is None else models, background=False)
+    server = create_server(address)
+    print(f"Inference server listening on {address} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        kind, target = parse_address(address)
+        if kind == "unix" and os.path.exists(target):
+            os.remove(target)
+
+if __name__ == "__main__":
+    import sys
+    serve(sys.argv[1] if len(sys.argv) > 1 else None)
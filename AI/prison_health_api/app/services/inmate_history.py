@@ -0,0 +1,146 @@
+import base64
+import json
+from datetime import datetime
+from app.model import db, SurveyAnswer, HealthProfileLog
+
+# Sections of /api/history/inmate/<id>. Each one is read oldest first on
+# the raw (timestamp, id) columns, which ix_<table>_inmate_id_timestamp
+# already holds in that order (id is the rowid), so a page ends at a cursor
+# that the next page resumes from with an indexed range scan and no sort,
+# and the streaming mode can walk the whole section with yield_per in
+# constant memory. Rows without a timestamp (only possible for rows written
+# before it had a default) sort first, as NULLs do in SQLite.
+
+STREAM_BATCH_SIZE = 500
+MAX_SECTION_PAGE_SIZE = 1000
+
+def answer_to_dict(a):
+    return {
+        "question": a.question_text,
+        "answer": a.answer_text,
+        "voice_emotion": a.voice_emotion,
+        "timestamp": a.timestamp.isoformat() if a.timestamp else None
+    }
+
+def report_to_dict(log):
+    return {
+        "risk_level": log.risk_level,
+        "suspected_conditions": json.loads(log.suspected_conditions) if log.suspected_conditions else [],
+        "recommended_actions": json.loads(log.recommended_actions) if log.recommended_actions else [],
+        "urgent_alert": log.urgent_alert,
+        "reasoning": log.reasoning,
+        "progress_indicator": log.progress_indicator,
+        "timestamp": log.timestamp.strftime("%Y-%m-%d %H:%M:%S") if log.timestamp else None
+    }
+
+# section name -> (model, serializer)
+SECTIONS = {
+    "qa_history": (SurveyAnswer, answer_to_dict),
+    "reports": (HealthProfileLog, report_to_dict),
+}
+
+class HistoryParams:
+    """Validated date range / section / paging of a history request."""
+
+    def __init__(self, since=None, until=None, sections=None, limit=None, cursors=None):
+        self.since = since
+        self.until = until
+        self.sections = sections or list(SECTIONS)
+        self.limit = limit
+        self.cursors = cursors or {}
+
+    @property
+    def paginated(self):
+        return self.limit is not None or bool(self.cursors)
+
+def _parse_datetime(value, name):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO date or datetime, got {value!r}")
+
+def encode_cursor(timestamp, row_id):
+    raw = json.dumps({"t": timestamp.isoformat() if timestamp else None, "id": row_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        data = json.loads(base64.urlsafe_b64decode((cursor + "=" * (-len(cursor) % 4)).encode()))
+        timestamp = datetime.fromisoformat(data["t"]) if data["t"] else None
+        return timestamp, int(data["id"])
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+def parse_history_args(args):
+    """
+    HistoryParams from request args: from / to (ISO, inclusive; a bare date
+    `to` covers the whole day), section (qa_history|reports, comma separated),
+    limit (rows per section) and <section>_cursor. Raises ValueError.
+    """
+    since = _parse_datetime(args.get("from"), "from")
+    until = _parse_datetime(args.get("to"), "to")
+    if until is not None and len(args.get("to")) == 10:
+        until = until.replace(hour=23, minute=59, second=59, microsecond=999999)
+
+    sections = [s.strip() for s in (args.get("section") or "").split(",") if s.strip()] or list(SECTIONS)
+    unknown = [s for s in sections if s not in SECTIONS]
+    if unknown:
+        raise ValueError(f"Unknown section(s): {', '.join(unknown)}; use {', '.join(SECTIONS)}")
+
+    limit = args.get("limit")
+    if limit:
+        try:
+            limit = max(1, min(int(limit), MAX_SECTION_PAGE_SIZE))
+        except ValueError:
+            raise ValueError("limit must be an integer")
+    else:
+        limit = None
+
+    cursors = {s: decode_cursor(args[f"{s}_cursor"]) for s in sections if args.get(f"{s}_cursor")}
+    return HistoryParams(since=since, until=until, sections=sections, limit=limit, cursors=cursors)
+
+def _section_query(inmate_id, section, params):
+    model, _ = SECTIONS[section]
+    query = model.query.filter(model.inmate_id == inmate_id)
+    if params.since is not None:
+        query = query.filter(model.timestamp >= params.since)
+    if params.until is not None:
+        query = query.filter(model.timestamp <= params.until)
+    cursor = params.cursors.get(section)
+    if cursor is not None:
+        timestamp, last_id = cursor
+        if timestamp is None:
+            # Still inside the leading NULL-timestamp rows
+            query = query.filter(db.or_(model.timestamp.isnot(None),
+                                        db.and_(model.timestamp.is_(None), model.id > last_id)))
+        else:
+            # Row-value comparison: one index range, NULL timestamps excluded
+            query = query.filter(db.tuple_(model.timestamp, model.id) > (timestamp, last_id))
+    return query.order_by(model.timestamp.asc(), model.id.asc())
+
+def section_page(inmate_id, section, params):
+    """(items, next_cursor) of one section; the whole section when not paginated."""
+    _, serialize = SECTIONS[section]
+    query = _section_query(inmate_id, section, params)
+    if not params.paginated:
+        return [serialize(row) for row in query.all()], None
+    rows = query.limit(params.limit + 1).all() if params.limit else query.all()
+    next_cursor = None
+    if params.limit and len(rows) > params.limit:
+        rows = rows[:params.limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return [serialize(row) for row in rows], next_cursor
+
+def iter_section(inmate_id, section, params):
+    """
+    Yields (item, row) through one section in batches of STREAM_BATCH_SIZE,
+    stopping after params.limit rows when set.
+    """
+    _, serialize = SECTIONS[section]
+    query = _section_query(inmate_id, section, params)
+    if params.limit:
+        query = query.limit(params.limit)
+    for row in query.yield_per(STREAM_BATCH_SIZE):
+        yield serialize(row), row
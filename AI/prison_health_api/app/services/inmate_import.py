@@ -0,0 +1,220 @@
+import csv
+import io
+import json
+import os
+from sqlalchemy.exc import IntegrityError
+from app.model import db, Inmate
+from app.utils import metrics
+
+# Bulk onboarding of inmates from CSV or JSONL. The body is parsed as it is
+# read and applied in chunks: each chunk matches its rows against existing
+# inmates with two set-based queries (NIC, then name, the same precedence as
+# /register), updates only the rows that changed, inserts the rest with
+# database-generated ids and commits once. A chunk that loses a race with a
+# concurrent import or registration (IntegrityError on inmates.nic) is rolled
+# back and re-matched, so the other writer's rows become updates.
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "500"))
+IMPORT_MAX_RETRIES = int(os.getenv("IMPORT_MAX_RETRIES", "3"))
+
+FIELDS = ("name", "nic", "address", "tel_no", "crime_details", "age", "gender")
+
+ROWS_IMPORTED = metrics.counter("inmate_import_rows_total", "Bulk-imported inmate rows by outcome.", ("status",))
+
+class RowError(ValueError):
+    pass
+
+def detect_format(content_type, requested=None):
+    """'csv' or 'jsonl' from ?format= or the Content-Type header."""
+    fmt = (requested or "").lower()
+    if not fmt:
+        content_type = (content_type or "").lower()
+        if "csv" in content_type:
+            fmt = "csv"
+        elif "ndjson" in content_type or "jsonl" in content_type or "json" in content_type:
+            fmt = "jsonl"
+    if fmt in ("ndjson", "json"):
+        fmt = "jsonl"
+    if fmt not in ("csv", "jsonl"):
+        raise ValueError("Send text/csv or application/x-ndjson (or pass ?format=csv|jsonl)")
+    return fmt
+
+def iter_records(stream, fmt):
+    """
+    Yields (row_number, record or RowError) from a binary stream without
+    reading it into memory. Row numbers are 1-based data rows.
+    """
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        for number, record in enumerate(csv.DictReader(text), start=1):
+            yield number, record
+        return
+    number = 0
+    for line in text:
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+            yield number, record
+        except ValueError as e:
+            yield number, RowError(f"Invalid JSON: {e}")
+
+def clean_record(record):
+    """
+    Known fields of `record`, normalized. Missing or empty values are left
+    out so they never overwrite stored data. Raises RowError.
+    """
+    cleaned = {}
+    for field in FIELDS:
+        value = record.get(field)
+        if isinstance(value, str):
+            value = value.strip()
+        if value is None or value == "":
+            continue
+        # Objects, lists, floats and booleans from JSON would reach the DB driver as is
+        if isinstance(value, bool) or not isinstance(value, (str, int)):
+            raise RowError(f"{field} must be text or a whole number, got {type(value).__name__}")
+        cleaned[field] = value
+    if "age" in cleaned:
+        try:
+            cleaned["age"] = int(cleaned["age"])
+        except (TypeError, ValueError):
+            raise RowError(f"age must be an integer, got {cleaned['age']!r}")
+    if "nic" in cleaned:
+        cleaned["nic"] = str(cleaned["nic"])
+    if "nic" not in cleaned and "name" not in cleaned:
+        raise RowError("Either nic or name is required")
+    return cleaned
+
+def _match_existing(rows):
+    """{nic: Inmate} and {name: Inmate} for the chunk, two queries in total."""
+    nics = {fields["nic"] for _, fields in rows if "nic" in fields}
+    by_nic = {i.nic: i for i in Inmate.query.filter(Inmate.nic.in_(nics))} if nics else {}
+
+    names = {fields["name"] for _, fields in rows if "name" in fields and fields.get("nic") not in by_nic}
+    by_name = {}
+    if names:
+        # Lowest id wins for duplicate names, like .first() in /register
+        for inmate in Inmate.query.filter(Inmate.name.in_(names)).order_by(Inmate.id.desc()):
+            by_name[inmate.name] = inmate
+    return by_nic, by_name
+
+def _apply_chunk(rows):
+    """
+    Applies [(row_number, fields), ...] in the current transaction and
+    returns one result dict per row. Ids are read after the flush.
+    """
+    by_nic, by_name = _match_existing(rows)
+    applied = []
+    for number, fields in rows:
+        inmate = by_nic.get(fields.get("nic")) or by_name.get(fields.get("name"))
+        if inmate is None:
+            if "name" not in fields:
+                applied.append((number, None, "error", "name is required for new inmates"))
+                continue
+            inmate = Inmate(**fields)
+            db.session.add(inmate)
+            status = "created"
+        else:
+            changed = {k: v for k, v in fields.items() if getattr(inmate, k) != v}
+            if "nic" in changed and inmate.nic is not None:
+                by_nic.pop(inmate.nic, None)
+            for key, value in changed.items():
+                setattr(inmate, key, value)
+            status = "updated" if changed else "unchanged"
+        # Later rows of the same chunk see this one
+        if inmate.nic:
+            by_nic[inmate.nic] = inmate
+        by_name.setdefault(inmate.name, inmate)
+        applied.append((number, inmate, status, None))
+
+    db.session.flush()
+    results = []
+    for number, inmate, status, error in applied:
+        result = {"row": number, "status": status}
+        if inmate is not None:
+            result["id"] = inmate.id
+        if error:
+            result["error"] = error
+        results.append(result)
+    return results
+
+def _commit_chunk(rows):
+    """Commits the chunk, re-matching it after IntegrityErrors; row-by-row as a last resort."""
+    for _attempt in range(IMPORT_MAX_RETRIES):
+        try:
+            results = _apply_chunk(rows)
+            db.session.commit()
+            return results
+        except IntegrityError:
+            db.session.rollback()
+    # Still conflicting: isolate the offending rows
+    results = []
+    for number, fields in rows:
+        try:
+            results.extend(_apply_chunk([(number, fields)]))
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            results.append({"row": number, "status": "error", "error": f"Conflicts with an existing inmate: {e.orig}"})
+    return results
+
+def import_inmates(records, chunk_size=None):
+    """
+    Imports (row_number, record) pairs as produced by iter_records.
+    Returns {"summary": {status: count}, "rows": [per-row result]}.
+
+    Chunks are committed as they fill up. If the body stops being readable
+    part-way (bad encoding, broken CSV), the rows read before that point
+    are still imported and the result also carries "error" and
+    "stopped_at_row" (the first row that was not imported).
+    """
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    summary = {"created": 0, "updated": 0, "unchanged": 0, "error": 0}
+    results = []
+    chunk = []
+
+    def flush():
+        chunk_results = _commit_chunk(chunk)
+        # Keep the identity map bounded on large files
+        db.session.expunge_all()
+        chunk.clear()
+        return chunk_results
+
+    records = iter(records)
+    last_number = 0
+    stopped = None
+    while True:
+        try:
+            number, record = next(records)
+        except StopIteration:
+            break
+        except (UnicodeDecodeError, ValueError, csv.Error) as e:
+            stopped = {"error": f"{type(e).__name__}: {e}", "stopped_at_row": last_number + 1}
+            break
+        last_number = number
+        try:
+            if isinstance(record, RowError):
+                raise record
+            chunk.append((number, clean_record(record)))
+        except RowError as e:
+            results.append({"row": number, "status": "error", "error": str(e)})
+            continue
+        if len(chunk) >= chunk_size:
+            results.extend(flush())
+    if chunk:
+        results.extend(flush())
+
+    results.sort(key=lambda r: r["row"])
+    for result in results:
+        summary[result["status"]] += 1
+    for status, count in summary.items():
+        if count:
+            ROWS_IMPORTED.inc(count, status=status)
+    result = {"summary": summary, "rows": results}
+    if stopped:
+        result.update(stopped)
+    return result
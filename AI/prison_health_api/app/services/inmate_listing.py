@@ -0,0 +1,188 @@
+import base64
+import json
+from sqlalchemy.orm import aliased
+from app.model import db, Inmate, HealthProfileLog
+
+# Inmate lists for the dashboard tables. One query joins every inmate with an
+# aggregate of its health profiles (count, last assessment, newest log id) and
+# the newest log itself, so diagnosis status and latest risk cost no extra
+# queries. Pages are keyset-paginated on (sort value, id).
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+RISK_ORDER = {"Low": 1, "Medium": 2, "High": 3}
+
+class ListParams:
+    """Validated filters / sort / page of a list request."""
+
+    SORTS = ("id", "name", "age", "last_assessed", "risk")
+
+    def __init__(self, q=None, gender=None, risk_levels=None, diagnosed=None, min_age=None, max_age=None,
+                 urgent=None, sort="id", descending=False, limit=None, cursor=None):
+        self.q = q
+        self.gender = gender
+        self.risk_levels = risk_levels
+        self.diagnosed = diagnosed
+        self.min_age = min_age
+        self.max_age = max_age
+        self.urgent = urgent
+        self.sort = sort
+        self.descending = descending
+        self.limit = limit
+        self.cursor = cursor
+
+    @property
+    def paginated(self):
+        return self.limit is not None or self.cursor is not None
+
+def _flag(value, name):
+    if value is None or value == "":
+        return None
+    lowered = value.lower()
+    if lowered in ("1", "true", "yes"):
+        return True
+    if lowered in ("0", "false", "no"):
+        return False
+    raise ValueError(f"{name} must be true or false")
+
+def _int(value, name):
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+def parse_list_args(args):
+    """
+    ListParams from request args: q, gender, risk_level (comma separated),
+    diagnosed, urgent, min_age, max_age, sort (id|name|age|last_assessed|risk,
+    '-' prefix for descending), limit, cursor. Raises ValueError on bad input.
+    """
+    sort = args.get("sort", "id") or "id"
+    descending = sort.startswith("-")
+    sort = sort.lstrip("-")
+    if sort not in ListParams.SORTS:
+        raise ValueError(f"sort must be one of {', '.join(ListParams.SORTS)}")
+
+    limit = _int(args.get("limit"), "limit")
+    cursor = args.get("cursor") or None
+    if cursor is not None and limit is None:
+        limit = DEFAULT_PAGE_SIZE
+    if limit is not None:
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    risk_levels = [r.strip() for r in (args.get("risk_level") or "").split(",") if r.strip()] or None
+    return ListParams(
+        q=(args.get("q") or "").strip() or None,
+        gender=args.get("gender") or None,
+        risk_levels=risk_levels,
+        diagnosed=_flag(args.get("diagnosed"), "diagnosed"),
+        urgent=_flag(args.get("urgent"), "urgent"),
+        min_age=_int(args.get("min_age"), "min_age"),
+        max_age=_int(args.get("max_age"), "max_age"),
+        sort=sort,
+        descending=descending,
+        limit=limit,
+        cursor=decode_cursor(cursor, sort, descending) if cursor else None
+    )
+
+def encode_cursor(sort, descending, value, last_id):
+    raw = json.dumps({"s": sort, "d": descending, "v": value, "id": last_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, sort, descending):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if data["s"] != sort or bool(data["d"]) != descending:
+            raise ValueError("cursor was issued for a different sort order")
+        return data["v"], int(data["id"])
+    except (KeyError, TypeError, ValueError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+
+def _profile_summary():
+    # Covered by ix_health_profile_logs_inmate_id_timestamp
+    return db.session.query(
+        HealthProfileLog.inmate_id.label("inmate_id"),
+        db.func.count(HealthProfileLog.id).label("profile_count"),
+        db.func.max(HealthProfileLog.timestamp).label("last_assessed_at"),
+        db.func.max(HealthProfileLog.id).label("latest_log_id")
+    ).group_by(HealthProfileLog.inmate_id).subquery()
+
+def _sort_expression(sort, summary, latest):
+    # Nulls are folded to a value below every real one so the keyset comparison stays total
+    if sort == "name":
+        return db.func.coalesce(Inmate.name, "")
+    if sort == "age":
+        return db.func.coalesce(Inmate.age, -1)
+    if sort == "last_assessed":
+        return db.func.coalesce(db.func.strftime("%Y-%m-%d %H:%M:%f", summary.c.last_assessed_at), "")
+    if sort == "risk":
+        return db.case({level: rank for level, rank in RISK_ORDER.items()}, value=latest.risk_level, else_=0)
+    return Inmate.id
+
+def list_inmates(params):
+    """
+    Returns (rows, next_cursor). Each row is (Inmate, profile_count,
+    last_assessed_at, latest_risk_level, latest_urgent_alert). next_cursor is
+    None on the last page or when params are not paginated.
+    """
+    summary = _profile_summary()
+    latest = aliased(HealthProfileLog)
+    sort_expr = _sort_expression(params.sort, summary, latest)
+
+    query = db.session.query(
+        Inmate,
+        db.func.coalesce(summary.c.profile_count, 0),
+        summary.c.last_assessed_at,
+        latest.risk_level,
+        latest.urgent_alert,
+        sort_expr.label("sort_value")
+    ).outerjoin(summary, summary.c.inmate_id == Inmate.id) \
+     .outerjoin(latest, latest.id == summary.c.latest_log_id)
+
+    if params.q:
+        pattern = f"%{params.q}%"
+        query = query.filter(db.or_(Inmate.name.ilike(pattern), Inmate.nic.like(f"{params.q}%")))
+    if params.gender:
+        query = query.filter(db.func.lower(Inmate.gender) == params.gender.lower())
+    if params.risk_levels:
+        query = query.filter(latest.risk_level.in_(params.risk_levels))
+    if params.diagnosed is True:
+        query = query.filter(summary.c.inmate_id.isnot(None))
+    elif params.diagnosed is False:
+        query = query.filter(summary.c.inmate_id.is_(None))
+    if params.urgent is not None:
+        query = query.filter(latest.urgent_alert.is_(params.urgent))
+    if params.min_age is not None:
+        query = query.filter(Inmate.age >= params.min_age)
+    if params.max_age is not None:
+        query = query.filter(Inmate.age <= params.max_age)
+
+    if params.cursor is not None:
+        value, last_id = params.cursor
+        if params.sort == "id":
+            query = query.filter(Inmate.id < last_id if params.descending else Inmate.id > last_id)
+        elif params.descending:
+            query = query.filter(db.or_(sort_expr < value, db.and_(sort_expr == value, Inmate.id < last_id)))
+        else:
+            query = query.filter(db.or_(sort_expr > value, db.and_(sort_expr == value, Inmate.id > last_id)))
+
+    if params.descending:
+        query = query.order_by(sort_expr.desc(), Inmate.id.desc())
+    else:
+        query = query.order_by(sort_expr.asc(), Inmate.id.asc())
+
+    if not params.paginated:
+        return [row[:5] for row in query.all()], None
+
+    # One extra row tells whether there is a next page
+    rows = query.limit(params.limit + 1).all()
+    next_cursor = None
+    if len(rows) > params.limit:
+        rows = rows[:params.limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(params.sort, params.descending, last[5], last[0].id)
+    return [row[:5] for row in rows], next_cursor
@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from app.model import db, Job
+from app.utils import metrics
+
+# Heavy endpoints can run as background jobs instead of inside the request.
+# ASYNC_JOBS sets the default mode; a request can still force either mode
+# with ?async=1 / ?async=0 (or an `async` form/JSON field).
+#
+# Jobs run in in-process thread pools. Each queued/running row records the
+# pid that owns it, so when a gunicorn worker exits (recycled by
+# max_requests, killed after a timeout, crashed) the master fails its running
+# jobs and releases its queued ones, and the next worker adopts them.
+ASYNC_JOBS_DEFAULT = os.getenv("ASYNC_JOBS", "0").lower() in ("1", "true", "yes")
+
+# Worker threads per job type
+JOB_CONCURRENCY = {
+    "detect_emotion": int(os.getenv("JOB_CONCURRENCY_DETECT_EMOTION", "1")),
+    "analyze_inmate": int(os.getenv("JOB_CONCURRENCY_ANALYZE_INMATE", "2")),
+    "upload_medical_record": int(os.getenv("JOB_CONCURRENCY_UPLOAD_MEDICAL_RECORD", "1")),
+}
+DEFAULT_JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY_DEFAULT", "1"))
+
+JOB_UPLOAD_DIR = os.path.join("uploads", "jobs")
+
+_handlers = {}
+_executors = {}
+_executors_lock = threading.Lock()
+
+def register_handler(job_type, handler):
+    """
+    Registers the function that executes a job type. The handler is called
+    with the job payload as keyword arguments inside an app context and must
+    return something JSON serializable.
+    """
+    _handlers[job_type] = handler
+
+def wants_async(req):
+    """Resolves sync vs async mode for a request (query > form > JSON > default)."""
+    flag = req.args.get('async')
+    if flag is None:
+        flag = req.form.get('async')
+    if flag is None and req.is_json:
+        flag = (req.get_json(silent=True) or {}).get('async')
+    if flag is None:
+        return ASYNC_JOBS_DEFAULT
+    return str(flag).lower() in ("1", "true", "yes")
+
+def job_upload_path(filename):
+    """Unique on-disk path for an upload that must outlive its request."""
+    os.makedirs(JOB_UPLOAD_DIR, exist_ok=True)
+    return os.path.join(JOB_UPLOAD_DIR, f"{uuid.uuid4().hex}_{os.path.basename(filename)}")
+
+def _remove_job_uploads(payload):
+    """Deletes the job_upload_path files referenced anywhere in a job's JSON payload."""
+    upload_dir = os.path.join(os.path.abspath(JOB_UPLOAD_DIR), "")
+    try:
+        values = [json.loads(payload)] if payload else []
+    except ValueError:
+        return
+    while values:
+        value = values.pop()
+        if isinstance(value, dict):
+            values.extend(value.values())
+        elif isinstance(value, list):
+            values.extend(value)
+        elif isinstance(value, str) and os.path.abspath(value).startswith(upload_dir):
+            try:
+                os.remove(value)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Could not remove job upload {value}: {e}")
+
+def _get_executor(job_type):
+    # Created lazily so pools are never inherited across a fork
+    with _executors_lock:
+        executor = _executors.get(job_type)
+        if executor is None:
+            workers = JOB_CONCURRENCY.get(job_type, DEFAULT_JOB_CONCURRENCY)
+            executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f"job-{job_type}")
+            _executors[job_type] = executor
+        return executor
+
+def submit_job(app, job_type, payload):
+    """Persists a queued job and hands it to the worker pool. Returns the job id."""
+    if job_type not in _handlers:
+        raise ValueError(f"Unknown job type: {job_type}")
+
+    job = Job(id=uuid.uuid4().hex, job_type=job_type, status='queued', payload=json.dumps(payload),
+              owner_pid=os.getpid())
+    db.session.add(job)
+    db.session.commit()
+
+    _get_executor(job_type).submit(_run_job, app, job.id)
+    return job.id
+
+def _run_job(app, job_id):
+    with app.app_context():
+        # Claim the job atomically so a job is never run twice, even if it was
+        # released and adopted by another process after it entered this pool
+        claimed = Job.query.filter_by(id=job_id, status='queued', owner_pid=os.getpid()) \
+            .update({"status": 'running', "started_at": datetime.utcnow()}, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            db.session.remove()
+            return
+        job = Job.query.get(job_id)
+        payload_text = job.payload
+
+        try:
+            payload = json.loads(payload_text) if payload_text else {}
+            result = _handlers[job.job_type](**payload)
+            job = Job.query.get(job_id)
+            job.result = json.dumps(result)
+            job.status = 'succeeded'
+        except Exception as e:
+            print(f"Job {job_id} ({job.job_type}) failed: {e}")
+            traceback.print_exc()
+            db.session.rollback()
+            job = Job.query.get(job_id)
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            db.session.remove()
+            # Uploads saved for the job are not needed once it has finished
+            _remove_job_uploads(payload_text)
+
+def recover_jobs(app):
+    """
+    Called at startup: jobs that were running when the process died are marked
+    failed, jobs that never started are handed to the pool again.
+    """
+    fail_interrupted_jobs(app)
+    requeue_pending_jobs(app)
+
+def fail_interrupted_jobs(app, owner_pid=None):
+    """
+    Marks jobs still 'running' as failed: all of them (only safe while no
+    worker can be running one), or those of the exited process `owner_pid`.
+    """
+    with app.app_context():
+        query = Job.query.filter_by(status='running')
+        if owner_pid is not None:
+            query = query.filter_by(owner_pid=owner_pid)
+        error = "Interrupted by server restart" if owner_pid is None else f"Interrupted: worker {owner_pid} exited"
+        payloads = [row.payload for row in query.with_entities(Job.payload)]
+        interrupted = query.update({"status": 'failed', "error": error, "finished_at": datetime.utcnow(),
+                                    "owner_pid": None}, synchronize_session=False)
+        db.session.commit()
+        for payload in payloads:
+            _remove_job_uploads(payload)
+        return interrupted
+
+def release_queued_jobs(app, owner_pid=None):
+    """Makes queued jobs (all, or those of process `owner_pid`) adoptable by requeue_pending_jobs."""
+    with app.app_context():
+        query = Job.query.filter_by(status='queued')
+        if owner_pid is not None:
+            query = query.filter_by(owner_pid=owner_pid)
+        released = query.update({"owner_pid": None}, synchronize_session=False)
+        db.session.commit()
+        return released
+
+def requeue_pending_jobs(app, unowned_only=False):
+    """
+    Adopts queued jobs into this process's pools: every queued job, or with
+    `unowned_only` just the released ones, which is safe to run in several
+    processes at once (each row is adopted by exactly one of them).
+    """
+    pid = os.getpid()
+    with app.app_context():
+        query = Job.query.filter_by(status='queued')
+        if unowned_only:
+            query = query.filter(Job.owner_pid.is_(None))
+        query.update({"owner_pid": pid}, synchronize_session=False)
+        db.session.commit()
+        pending = Job.query.filter_by(status='queued', owner_pid=pid).order_by(Job.created_at.asc()).all()
+        for job in pending:
+            if job.job_type in _handlers:
+                _get_executor(job.job_type).submit(_run_job, app, job.id)
+        db.session.remove()
+
+def shutdown_executors(app):
+    """
+    Stops this process's pools before it exits: queued jobs are cancelled and
+    released for another process to adopt, running ones are waited for.
+    """
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=False, cancel_futures=True)
+    release_queued_jobs(app, owner_pid=os.getpid())
+    for executor in executors:
+        executor.shutdown(wait=True)
+
+def job_to_dict(job, include_result=False):
+    data = {
+        "job_id": job.id,
+        "job_type": job.job_type,
+        "status": job.status,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if include_result:
+        data["result"] = json.loads(job.result) if job.result else None
+    return data
+
+def queue_depths():
+    """Number of queued/running jobs per type (from the job table)."""
+    rows = db.session.query(Job.job_type, Job.status, db.func.count(Job.id)) \
+        .filter(Job.status.in_(['queued', 'running'])) \
+        .group_by(Job.job_type, Job.status).all()
+    depths = {}
+    for job_type, status, count in rows:
+        depths.setdefault(job_type, {"queued": 0, "running": 0})[status] = count
+    return depths
+
+@metrics.register_collector
+def _queue_metrics():
+    # Scraped from /metrics, which runs inside an app context
+    samples = []
+    for job_type, counts in queue_depths().items():
+        for status, count in counts.items():
+            samples.append(({"job_type": job_type, "status": status}, count))
+    lines = metrics.gauge_lines("job_queue_depth", "Background jobs queued/running per type (all processes).", samples)
+    with _executors_lock:
+        backlog = [({"job_type": job_type}, executor._work_queue.qsize()) for job_type, executor in _executors.items()]
+    lines += metrics.gauge_lines("job_executor_backlog", "Jobs waiting for a worker thread in this process.", backlog)
+    return lines
@@ -0,0 +1,123 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from app.utils import metrics
+
+# Cross-request dynamic batching. Concurrent callers submit their items
+# (frames, person crops) to a model's batcher; one dispatcher thread per model
+# collects them until MAX_SIZE items are waiting or the oldest request has
+# waited MAX_WAIT_MS, runs a single batched forward pass and hands every
+# caller its slice of the results. The dispatcher is the only thread calling
+# the model, so it also replaces the per-model lock.
+
+MICROBATCH_ENABLED = os.getenv("MICROBATCH_ENABLED", "1").lower() in ("1", "true", "yes")
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("MICROBATCH_MAX_WAIT_MS", "10"))
+
+BATCH_SIZE = metrics.histogram("microbatch_batch_size", "Items per batched forward pass.", ("model",),
+                               buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+BATCH_REQUESTS = metrics.histogram("microbatch_requests_per_batch", "Caller requests merged into one forward pass.", ("model",),
+                                   buckets=(1, 2, 3, 4, 6, 8, 12, 16, 32))
+QUEUE_WAIT_SECONDS = metrics.histogram("microbatch_queue_wait_seconds", "Time a request waited before its batch started.", ("model",),
+                                       buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+RUN_SECONDS = metrics.histogram("microbatch_run_seconds", "Duration of one batched forward pass.", ("model",))
+
+class _Request:
+    __slots__ = ("items", "future", "enqueued")
+
+    def __init__(self, items):
+        self.items = items
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+class MicroBatcher:
+    """
+    `run_batch(items) -> results` (one result per item) executed on batches
+    merged from concurrent submit() calls.
+    """
+
+    def __init__(self, name, run_batch, max_batch_size, max_wait_ms=None):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_s = (MICROBATCH_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._carry = None
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, items):
+        """Blocks until `items` went through the model; returns their results in order."""
+        items = list(items)
+        if not items:
+            return []
+        self._ensure_started()
+        request = _Request(items)
+        self._queue.put(request)
+        return request.future.result()
+
+    def _ensure_started(self):
+        # Threads do not survive fork: a gunicorn worker starts its own dispatcher
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._carry = None
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._dispatch_loop, name=f"microbatch-{self.name}", daemon=True)
+            self._thread.start()
+
+    def _collect(self):
+        """Blocks for the first request, then gathers more until the batch is full or its wait is up."""
+        first, self._carry = self._carry, None
+        if first is None:
+            first = self._queue.get()
+        batch, size = [first], len(first.items)
+        # Measured from the oldest request, so a backlog is dispatched immediately
+        deadline = first.enqueued + self.max_wait_s
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if size + len(request.items) > self.max_batch_size:
+                self._carry = request
+                break
+            batch.append(request)
+            size += len(request.items)
+        return batch
+
+    def _dispatch_loop(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            for request in batch:
+                QUEUE_WAIT_SECONDS.observe(started - request.enqueued, model=self.name)
+            items = [item for request in batch for item in request.items]
+            try:
+                results = []
+                # A single oversized request still runs in max-size slices
+                for start in range(0, len(items), self.max_batch_size):
+                    chunk = items[start:start + self.max_batch_size]
+                    BATCH_SIZE.observe(len(chunk), model=self.name)
+                    results.extend(self.run_batch(chunk))
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: {len(results)} results for {len(items)} items")
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            finally:
+                RUN_SECONDS.observe(time.perf_counter() - started, model=self.name)
+                BATCH_REQUESTS.observe(len(batch), model=self.name)
+
+            offset = 0
+            for request in batch:
+                request.future.set_result(results[offset:offset + len(request.items)])
+                offset += len(request.items)
@@ -0,0 +1,368 @@
+import importlib
+import os
+import sys
+import threading
+import time
+from app.utils import startup, profiling
+
+# Process-wide registry for heavy, reusable objects (model weights, embedding
+# model, Chroma clients). Each entry is built once on first use behind its own
+# lock, so concurrent requests never load the same weights twice.
+
+PERSIST_DIRECTORY_GENERAL = "./chroma_db"
+PERSIST_DIRECTORY_INMATES = "./chroma_db_inmates"
+
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+GENDER_MODEL_NAME = "prithivMLmods/Realistic-Gender-Classification"
+
+MODELS_DIR = os.path.join(os.path.dirname(__file__), '..', 'models')
+
+# Comma separated registry names to load inside create_app(), e.g.
+# "embeddings,chroma_general,person_model". "all" loads everything.
+WARMUP_MODELS = os.getenv("WARMUP_MODELS", "")
+# Load them in a background thread instead, so the server starts accepting
+# requests right away (/api/health/ready reports when they are warm)
+WARMUP_BACKGROUND = os.getenv("WARMUP_BACKGROUND", "0").lower() in ("1", "true", "yes")
+# Extra libraries to import during warm-up that no registry entry covers, e.g. "cv2,librosa"
+WARMUP_IMPORTS = os.getenv("WARMUP_IMPORTS", "")
+
+_loaders = {}
+_instances = {}
+_load_seconds = {}
+_errors = {}
+_locks = {}
+_imports = {}
+_registry_lock = threading.Lock()
+_warmup = {"state": "idle", "selection": [], "started_at": None, "finished_at": None}
+
+def register(name, loader, imports=()):
+    """
+    Registers a zero-argument loader for `name`. Nothing is loaded yet.
+    `imports` lists the heavy libraries the loader needs; they are imported
+    (and timed separately) right before the first load.
+    """
+    with _registry_lock:
+        _loaders[name] = loader
+        _imports[name] = tuple(imports)
+        _locks.setdefault(name, threading.Lock())
+
+def import_library(module_name):
+    """Imports `module_name`, recording the time in the startup report if it was not imported yet."""
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    with startup.timed("import", module_name):
+        return importlib.import_module(module_name)
+
+def get(name):
+    """Returns the shared instance for `name`, loading it on first use."""
+    instance = _instances.get(name)
+    if instance is not None:
+        return instance
+
+    if name not in _loaders:
+        raise KeyError(f"Unknown registry entry: {name}")
+
+    with _locks[name]:
+        # Another thread may have finished loading while we waited
+        instance = _instances.get(name)
+        if instance is not None:
+            return instance
+
+        print(f"Loading {name}...")
+        try:
+            with profiling.span(f"model_registry.load:{name}"):
+                for module_name in _imports.get(name, ()):
+                    with profiling.span(f"import:{module_name}"):
+                        import_library(module_name)
+                started = time.perf_counter()
+                instance = _loaders[name]()
+        except Exception as e:
+            _errors[name] = str(e)
+            print(f"Failed to load {name}: {e}")
+            raise
+        _load_seconds[name] = time.perf_counter() - started
+        startup.record("model", name, _load_seconds[name])
+        _errors.pop(name, None)
+        _instances[name] = instance
+        print(f"Loaded {name} in {_load_seconds[name]:.2f}s")
+        return instance
+
+def is_loaded(name):
+    return name in _instances
+
+def names():
+    return list(_loaders.keys())
+
+def _parse_selection(selection):
+    if isinstance(selection, str):
+        selection = [s.strip() for s in selection.split(",") if s.strip()]
+    if "all" in selection:
+        selection = names()
+    return list(selection)
+
+def _run_warm_up(selection, extra_imports):
+    _warmup.update(state="running", started_at=time.time())
+    with startup.timed("phase", "warm_up"):
+        for module_name in extra_imports:
+            try:
+                import_library(module_name)
+            except Exception as e:
+                print(f"Warm-up import of {module_name} failed: {e}")
+        for name in selection:
+            try:
+                get(name)
+            except Exception:
+                pass
+    _warmup.update(state="done", finished_at=time.time())
+
+def warm_up(selection=None, background=None, extra_imports=None):
+    """
+    Loads the given registry entries up front (default: WARMUP_MODELS), in a
+    daemon thread when `background` (default: WARMUP_BACKGROUND).
+    Failures are reported but never stop the app from starting.
+    """
+    selection = _parse_selection(WARMUP_MODELS if selection is None else selection)
+    extra_imports = _parse_selection(WARMUP_IMPORTS if extra_imports is None else extra_imports)
+    background = WARMUP_BACKGROUND if background is None else background
+    _warmup["selection"] = selection
+    if not selection and not extra_imports:
+        _warmup["state"] = "done"
+        return None
+
+    if background:
+        thread = threading.Thread(target=_run_warm_up, args=(selection, extra_imports), name="model-warmup", daemon=True)
+        _warmup["state"] = "running"
+        thread.start()
+        return thread
+    _run_warm_up(selection, extra_imports)
+    return None
+
+# Entries that must not cross a fork: Chroma holds SQLite connections and the
+# LLM client an HTTP connection pool. ONNX Runtime sessions (any instance with
+# a `model_path`) own thread pools that do not survive fork either.
+FORK_UNSAFE = ("chroma_general", "chroma_inmates", "llm")
+
+def _fork_safe(name, instance):
+    if name in FORK_UNSAFE:
+        return False
+    parts = instance if isinstance(instance, tuple) else (instance,)
+    return not any(hasattr(part, 'model_path') for part in parts)
+
+def reset_after_fork():
+    """
+    Called in a freshly forked worker: drops the inherited entries that are not
+    fork-safe (they reload lazily) and returns their names. torch / Ultralytics
+    weights stay and are shared copy-on-write with the parent.
+    """
+    dropped = []
+    with _registry_lock:
+        for name, instance in list(_instances.items()):
+            if not _fork_safe(name, instance):
+                del _instances[name]
+                dropped.append(name)
+        # Locks held by parent threads at fork time would never be released here
+        for name in _locks:
+            _locks[name] = threading.Lock()
+    return dropped
+
+def readiness():
+    """
+    (ready, details): ready once warm-up finished and every entry it was asked
+    for loaded. Entries nobody asked to warm up stay lazy and do not count.
+    """
+    components = {}
+    for name in names():
+        if is_loaded(name):
+            components[name] = "warm"
+        elif name in _errors:
+            components[name] = "error"
+        elif _locks[name].locked():
+            components[name] = "loading"
+        else:
+            components[name] = "cold"
+    failed = [name for name in _warmup["selection"] if components.get(name) != "warm"]
+    ready = _warmup["state"] == "done" and not failed
+    return ready, {
+        "warm_up": dict(_warmup),
+        "components": components,
+        "not_ready": failed if _warmup["state"] == "done" else _warmup["selection"]
+    }
+
+def _module_bytes(module):
+    """Parameter + buffer bytes of a torch module."""
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    # Dynamically quantized Linear layers keep their weights in packed params
+    for sub in module.modules():
+        packed = getattr(sub, '_packed_params', None)
+        if packed is not None and hasattr(packed, '_weight_bias'):
+            weight, bias = packed._weight_bias()
+            total += weight.numel() * weight.element_size()
+            if bias is not None:
+                total += bias.numel() * bias.element_size()
+    return total
+
+def _dir_bytes(path):
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for f in files:
+            try:
+                total += os.path.getsize(os.path.join(root, f))
+            except OSError:
+                pass
+    return total
+
+def _estimate_memory(name, instance):
+    """Best-effort size of a loaded entry. Returns (bytes, details)."""
+    try:
+        if name.startswith("chroma_"):
+            details = {"documents": instance._collection.count()}
+            persist_dir = getattr(instance, '_persist_directory', None)
+            if persist_dir:
+                details["disk_bytes"] = _dir_bytes(persist_dir)
+            # The HNSW index is memory-mapped from disk, so report that as its footprint
+            return details.get("disk_bytes"), details
+
+        target = instance
+        if isinstance(instance, tuple): # (voice_model, feature_extractor)
+            target = instance[0]
+        onnx_path = getattr(target, 'model_path', None)
+        if onnx_path: # ONNX Runtime wrapper: weights size on disk
+            return os.path.getsize(onnx_path), {"backend": "onnx", "file": os.path.basename(onnx_path)}
+        # Unwrap Ultralytics YOLO / HF pipeline / sentence-transformers wrappers
+        for attr in ('model', '_client', 'client'):
+            inner = getattr(target, attr, None)
+            if inner is not None and hasattr(inner, 'parameters'):
+                target = inner
+                break
+        if hasattr(target, 'parameters'):
+            return _module_bytes(target), {}
+    except Exception as e:
+        return None, {"error": str(e)}
+    return None, {}
+
+def describe():
+    """Status of every registry entry, for the introspection endpoint."""
+    items = []
+    for name in names():
+        entry = {"name": name, "loaded": is_loaded(name)}
+        if name in _load_seconds:
+            entry["load_seconds"] = round(_load_seconds[name], 3)
+        if name in _errors:
+            entry["error"] = _errors[name]
+        if is_loaded(name):
+            size, details = _estimate_memory(name, _instances[name])
+            entry["memory_bytes"] = size
+            entry["memory_mb"] = round(size / (1024 * 1024), 2) if size else None
+            entry.update(details)
+        items.append(entry)
+    return items
+
+# --- Loaders ---
+
+def _load_embeddings():
+    from langchain_huggingface import HuggingFaceEmbeddings
+    return HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL_NAME)
+
+def _load_remote_embeddings():
+    from .inference_client import RemoteEmbeddings
+    return RemoteEmbeddings()
+
+def embeddings_entry():
+    """Registry name of the embedding model to use: the inference server's when INFERENCE_SERVER is set."""
+    from . import inference_client
+    return "remote_embeddings" if inference_client.enabled() else "embeddings"
+
+def _load_chroma(persist_directory):
+    from langchain_chroma import Chroma
+    return Chroma(persist_directory=persist_directory, embedding_function=get(embeddings_entry()))
+
+def _onnx_or_none(kind, load):
+    """Runs an ONNX loader when INFERENCE_BACKEND selects onnx for `kind`; None means use PyTorch."""
+    from . import onnx_backend
+    if onnx_backend.backend_for(kind) != "onnx":
+        return None
+    try:
+        instance = load(onnx_backend)
+    except ImportError as e:
+        print(f"onnxruntime not available for {kind} ({e}), using PyTorch")
+        return None
+    if instance is None:
+        print(f"No exported ONNX model for {kind}, using PyTorch (run: python -m app.services.onnx_backend export)")
+    return instance
+
+def _load_gender_pipeline():
+    instance = _onnx_or_none("gender", lambda ob: ob.load_gender_pipeline(GENDER_MODEL_NAME))
+    if instance is not None:
+        return instance
+    from transformers import pipeline
+    return pipeline("image-classification", model=GENDER_MODEL_NAME)
+
+def _load_voice_model():
+    def load_onnx(ob):
+        from transformers import AutoConfig, Wav2Vec2FeatureExtractor
+        model_dir = os.path.join(MODELS_DIR, 'best_wav2vec_model')
+        if ob.voice_model_path() is None:
+            return None
+        feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(model_dir)
+        return ob.load_voice_model(feature_extractor, AutoConfig.from_pretrained(model_dir)), feature_extractor
+
+    instance = _onnx_or_none("voice", load_onnx)
+    if instance is not None:
+        return instance
+    return _load_voice_model_torch()
+
+def _load_voice_model_torch():
+    import torch
+    import torch.quantization
+    from transformers import AutoConfig, Wav2Vec2ForSequenceClassification, Wav2Vec2FeatureExtractor
+
+    model_dir = os.path.join(MODELS_DIR, 'best_wav2vec_model')
+    weights_path = os.path.join(MODELS_DIR, 'quantized_emotion_model.pth')
+
+    config = AutoConfig.from_pretrained(model_dir)
+    feature_extractor = Wav2Vec2FeatureExtractor.from_pretrained(model_dir)
+
+    model = Wav2Vec2ForSequenceClassification(config)
+    model = torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    model.load_state_dict(torch.load(weights_path, map_location='cpu'))
+    model.eval()
+    return model, feature_extractor
+
+def _load_llm():
+    from langchain_openai import ChatOpenAI
+    from .rag_service import HealthProfile, LLM_MODEL_NAME
+    llm = ChatOpenAI(
+        model=LLM_MODEL_NAME,
+        temperature=0.0,
+        api_key=os.getenv("OPENAI_API_KEY")
+    )
+    # include_raw keeps the AIMessage, whose usage_metadata carries the token counts
+    return llm.with_structured_output(HealthProfile, include_raw=True)
+
+def _load_person_model():
+    instance = _onnx_or_none("yolo", lambda ob: ob.load_yolo("person"))
+    if instance is not None:
+        return instance
+    from ultralytics import YOLO
+    return YOLO("yolo11n.pt")
+
+def _load_emotion_model():
+    instance = _onnx_or_none("yolo", lambda ob: ob.load_yolo("emotion"))
+    if instance is not None:
+        return instance
+    from ultralytics import YOLO
+    return YOLO("app/models/best_new.pt")
+
+register("embeddings", _load_embeddings, imports=("torch", "sentence_transformers", "langchain_huggingface"))
+register("remote_embeddings", _load_remote_embeddings)
+register("chroma_general", lambda: _load_chroma(PERSIST_DIRECTORY_GENERAL), imports=("chromadb", "langchain_chroma"))
+register("chroma_inmates", lambda: _load_chroma(PERSIST_DIRECTORY_INMATES), imports=("chromadb", "langchain_chroma"))
+register("gender_pipeline", _load_gender_pipeline, imports=("torch", "transformers"))
+register("voice_model", _load_voice_model, imports=("torch", "transformers"))
+register("person_model", _load_person_model, imports=("torch", "ultralytics"))
+register("emotion_model", _load_emotion_model, imports=("torch", "ultralytics"))
+register("llm", _load_llm, imports=("langchain_core", "langchain_openai"))
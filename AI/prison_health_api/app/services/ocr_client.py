@@ -0,0 +1,301 @@
+import base64
+import json
+import os
+import random
+import threading
+import time
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from app.utils import metrics
+
+# Prescription OCR through Ollama's /api/generate (glm-ocr). One client per
+# Ollama base URL keeps a pooled keep-alive session, so calls skip the TCP
+# handshake. Photos are downscaled to OCR_MAX_SIDE and re-encoded as JPEG
+# before base64, which is usually a tenth of a phone photo's size. Text can
+# be read as it is generated (stream()) or in one piece (extract()).
+#
+# Failures: connection errors, timeouts and 5xx answers are retried with
+# jittered exponential backoff. After OCR_BREAKER_FAILURES failed calls in a
+# row the circuit opens and calls fail immediately for OCR_BREAKER_RESET_S;
+# then a single trial call decides whether it closes again.
+
+OCR_MODEL = os.getenv("OCR_MODEL", "glm-ocr:latest")
+OCR_PROMPT = "Extract all the text from this medical prescription. Output only the extracted text."
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "1600"))
+OCR_JPEG_QUALITY = int(os.getenv("OCR_JPEG_QUALITY", "85"))
+OCR_CONNECT_TIMEOUT_S = float(os.getenv("OCR_CONNECT_TIMEOUT_S", "3"))
+# Per read: a streamed answer may take longer in total as long as text keeps coming
+OCR_READ_TIMEOUT_S = float(os.getenv("OCR_READ_TIMEOUT_S", "60"))
+OCR_RETRIES = int(os.getenv("OCR_RETRIES", "2"))
+OCR_BACKOFF_S = float(os.getenv("OCR_BACKOFF_S", "0.5"))
+OCR_BREAKER_FAILURES = int(os.getenv("OCR_BREAKER_FAILURES", "3"))
+OCR_BREAKER_RESET_S = float(os.getenv("OCR_BREAKER_RESET_S", "30"))
+OCR_POOL_SIZE = int(os.getenv("OCR_POOL_SIZE", "8"))
+
+OCR_REQUESTS = metrics.counter("ocr_requests_total", "Prescription OCR calls to Ollama.", ("status",))
+OCR_ATTEMPTS = metrics.counter("ocr_attempts_total", "HTTP attempts to Ollama, including retries.", ("outcome",))
+OCR_REQUEST_SECONDS = metrics.histogram("ocr_request_duration_seconds", "OCR call duration, retries included.", ("mode",))
+OCR_FIRST_TEXT_SECONDS = metrics.histogram("ocr_first_text_seconds", "Time to the first streamed OCR fragment.")
+OCR_IMAGE_BYTES = metrics.histogram("ocr_image_bytes", "Prescription image size before and after re-encoding.", ("stage",),
+                                    buckets=(32e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6))
+OCR_CIRCUIT_OPEN = metrics.gauge("ocr_circuit_open", "1 while the Ollama OCR circuit breaker is open.")
+
+class OCRUnavailable(ConnectionError):
+    """Ollama could not be reached (or the circuit is open)."""
+
+class CircuitOpen(OCRUnavailable):
+    """Recent calls failed; Ollama is not being tried right now."""
+
+class OCRError(RuntimeError):
+    """Ollama answered but the OCR call failed."""
+
+def ollama_base_url():
+    # Respects Docker configurations if present; drops a /v1 reused from OpenAI-style configs
+    base_url = os.getenv("LLM_BASE_URL", "http://localhost:11434").rstrip("/")
+    if base_url.endswith("/v1"):
+        base_url = base_url[:-3]
+    return base_url
+
+def encode_image(image, max_side=OCR_MAX_SIDE, quality=OCR_JPEG_QUALITY):
+    """
+    JPEG bytes of `image` (a path, encoded bytes or a BGR array) with its
+    longer side at most `max_side`. A JPEG that needs no resizing is sent
+    as is rather than compressed twice.
+    """
+    import cv2
+    if isinstance(image, np.ndarray):
+        data, frame = None, image
+    else:
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            data = bytes(image)
+        else:
+            with open(image, "rb") as f:
+                data = f.read()
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("Prescription image could not be decoded")
+        OCR_IMAGE_BYTES.observe(len(data), stage="original")
+
+    height, width = frame.shape[:2]
+    scale = max_side / max(height, width) if max_side else 1.0
+    if scale >= 1.0 and data is not None and data[:2] == b"\xff\xd8":
+        OCR_IMAGE_BYTES.observe(len(data), stage="sent")
+        return data
+    if scale < 1.0:
+        frame = cv2.resize(frame, (max(1, round(width * scale)), max(1, round(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError("Prescription image could not be re-encoded")
+    OCR_IMAGE_BYTES.observe(encoded.nbytes, stage="sent")
+    return encoded.tobytes()
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open for `reset_s` -> one half-open trial."""
+
+    def __init__(self, failures=OCR_BREAKER_FAILURES, reset_s=OCR_BREAKER_RESET_S):
+        self.max_failures = max(1, failures)
+        self.reset_s = reset_s
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def before_call(self):
+        """
+        Raises CircuitOpen while open; lets one trial call through once
+        `reset_s` has passed. True when this call is that trial.
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            if time.monotonic() - self._opened_at < self.reset_s or self._trial_running:
+                raise CircuitOpen("Ollama OCR circuit is open")
+            self._trial_running = True
+            return True
+
+    def release_trial(self):
+        """Ends a trial that recorded no outcome, so the next call can try again."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+        OCR_CIRCUIT_OPEN.set(0)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.max_failures:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+            opened = self._opened_at is not None
+        if opened:
+            OCR_CIRCUIT_OPEN.set(1)
+
+class _Retryable(Exception):
+    pass
+
+class OllamaOCRClient:
+    """Pooled, retrying, circuit-broken client for one Ollama instance."""
+
+    def __init__(self, base_url=None, model=OCR_MODEL, max_side=OCR_MAX_SIDE, jpeg_quality=OCR_JPEG_QUALITY,
+                 retries=OCR_RETRIES, backoff_s=OCR_BACKOFF_S, breaker=None):
+        self.base_url = (base_url or ollama_base_url()).rstrip("/")
+        self.model = model
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.retries = max(0, retries)
+        self.backoff_s = backoff_s
+        self.breaker = breaker or CircuitBreaker()
+        self.timeout = (OCR_CONNECT_TIMEOUT_S, OCR_READ_TIMEOUT_S)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OCR_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def prepare(self, image):
+        """Base64 of the downscaled JPEG; do this while the upload is still in memory."""
+        with metrics.stage("ocr.prepare"):
+            return base64.b64encode(encode_image(image, self.max_side, self.jpeg_quality)).decode("ascii")
+
+    def _payload(self, encoded, stream):
+        return {"model": self.model, "prompt": OCR_PROMPT, "stream": stream, "images": [encoded]}
+
+    def _post(self, encoded, stream):
+        """One attempt. Raises _Retryable for failures worth retrying, OCRError otherwise."""
+        try:
+            response = self.session.post(f"{self.base_url}/api/generate", json=self._payload(encoded, stream),
+                                         timeout=self.timeout, stream=stream)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            OCR_ATTEMPTS.inc(outcome="unreachable")
+            raise _Retryable(f"Ollama unreachable at {self.base_url}: {e}")
+        if response.status_code != 200:
+            detail = response.text[:500]
+            response.close()
+            OCR_ATTEMPTS.inc(outcome=f"http_{response.status_code // 100}xx")
+            # 5xx covers "model is loading"; 4xx will not get better by retrying
+            if response.status_code >= 500:
+                raise _Retryable(f"Ollama answered {response.status_code}: {detail}")
+            raise OCRError(f"Ollama answered {response.status_code}: {detail}")
+        OCR_ATTEMPTS.inc(outcome="ok")
+        return response
+
+    def _backoff(self, attempt):
+        time.sleep(self.backoff_s * (2 ** attempt) * random.uniform(0.5, 1.0))
+
+    def _call(self, encoded, stream):
+        """Connected 200 response after retries, or OCRUnavailable / OCRError."""
+        for attempt in range(self.retries + 1):
+            try:
+                return self._post(encoded, stream)
+            except _Retryable as e:
+                error = e
+            except OCRError:
+                # Ollama is up; a bad request must not open the circuit
+                self.breaker.record_success()
+                raise
+            if attempt < self.retries:
+                self._backoff(attempt)
+        self.breaker.record_failure()
+        raise OCRUnavailable(str(error))
+
+    def extract(self, image):
+        """Full OCR text for `image` (path, bytes or BGR array) in one response."""
+        return self.extract_encoded(self.prepare(image))
+
+    def extract_encoded(self, encoded):
+        started = time.perf_counter()
+        trial = self.breaker.before_call()
+        try:
+            with metrics.stage("ocr.request"):
+                response = self._call(encoded, stream=False)
+                try:
+                    result = response.json()
+                except ValueError as e:
+                    self.breaker.record_failure()
+                    raise OCRError(f"Ollama sent an unreadable response: {e}")
+            # Ollama is up even when it reports an error in the body
+            self.breaker.record_success()
+            if "error" in result:
+                raise OCRError(f"Ollama OCR error: {result['error']}")
+            return result.get("response", "")
+        finally:
+            if trial:
+                self.breaker.release_trial()
+            OCR_REQUEST_SECONDS.observe(time.perf_counter() - started, mode="full")
+
+    def stream(self, image):
+        """Iterator of text fragments as Ollama generates them."""
+        return self.stream_encoded(self.prepare(image))
+
+    def stream_encoded(self, encoded):
+        started = time.perf_counter()
+        first = True
+        trial = self.breaker.before_call()
+        try:
+            response = self._call(encoded, stream=True)
+        except BaseException:
+            if trial:
+                self.breaker.release_trial()
+            raise
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                try:
+                    chunk = json.loads(line)
+                except ValueError as e:
+                    self.breaker.record_failure()
+                    raise OCRError(f"Ollama sent an unreadable stream line: {e}")
+                if "error" in chunk:
+                    self.breaker.record_success()
+                    raise OCRError(f"Ollama OCR error: {chunk['error']}")
+                text = chunk.get("response", "")
+                if text:
+                    if first:
+                        OCR_FIRST_TEXT_SECONDS.observe(time.perf_counter() - started)
+                        first = False
+                    yield text
+                if chunk.get("done"):
+                    break
+            self.breaker.record_success()
+        except GeneratorExit:
+            # The caller went away; Ollama itself was answering
+            self.breaker.record_success()
+            raise
+        except requests.RequestException as e:
+            # Dropped connection, read timeout or a broken chunked body; text
+            # already went to the caller, so the call cannot be replayed
+            self.breaker.record_failure()
+            raise OCRUnavailable(f"Ollama stream interrupted: {e}")
+        finally:
+            if trial:
+                self.breaker.release_trial()
+            response.close()
+            OCR_REQUEST_SECONDS.observe(time.perf_counter() - started, mode="stream")
+
+    def close(self):
+        self.session.close()
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_client():
+    """Shared client for the current LLM_BASE_URL (one pool and breaker per Ollama instance)."""
+    base_url = ollama_base_url()
+    client = _clients.get(base_url)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(base_url)
+            if client is None:
+                client = _clients[base_url] = OllamaOCRClient(base_url)
+    return client
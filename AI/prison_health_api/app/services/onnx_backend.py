@@ -0,0 +1,248 @@
+import os
+import time
+from types import SimpleNamespace
+import numpy as np
+
+# Optional ONNX Runtime backend for the CPU models. Models are exported once
+# (python -m app.services.onnx_backend export) into app/models/onnx and the
+# model registry picks them up when the backend is selected:
+#   INFERENCE_BACKEND=torch|onnx            default for every model
+#   INFERENCE_BACKEND_VOICE / _YOLO / _GENDER  per-model override
+# If an exported file is missing the registry falls back to PyTorch.
+
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").lower()
+
+ONNX_MODELS_DIR = os.path.join(os.path.dirname(__file__), '..', 'models', 'onnx')
+VOICE_ONNX_FP32 = os.path.join(ONNX_MODELS_DIR, 'voice_emotion.onnx')
+VOICE_ONNX_INT8 = os.path.join(ONNX_MODELS_DIR, 'voice_emotion.int8.onnx')
+GENDER_ONNX_FP32 = os.path.join(ONNX_MODELS_DIR, 'gender.onnx')
+GENDER_ONNX_INT8 = os.path.join(ONNX_MODELS_DIR, 'gender.int8.onnx')
+PERSON_ONNX = os.path.join(ONNX_MODELS_DIR, 'yolo11n.onnx')
+EMOTION_ONNX = os.path.join(ONNX_MODELS_DIR, 'best_new.onnx')
+
+# int8 dynamic quantization suits the Linear-heavy transformers (wav2vec2, ViT)
+ONNX_USE_INT8 = os.getenv("ONNX_USE_INT8", "1").lower() in ("1", "true", "yes")
+
+# 0 lets onnxruntime pick (all physical cores), or under gunicorn this
+# worker's share of them (set_intra_op_threads from serving.configure_worker)
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", "1"))
+
+_intra_op_threads = ORT_INTRA_OP_THREADS
+
+def backend_for(model_kind):
+    """'torch' or 'onnx' for 'voice', 'yolo' or 'gender'."""
+    return os.getenv(f"INFERENCE_BACKEND_{model_kind.upper()}", INFERENCE_BACKEND).lower()
+
+def set_intra_op_threads(threads):
+    """Intra-op threads for sessions created from now on, unless ORT_INTRA_OP_THREADS is set."""
+    global _intra_op_threads
+    if ORT_INTRA_OP_THREADS <= 0:
+        _intra_op_threads = max(1, int(threads))
+
+def session_options():
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    if _intra_op_threads > 0:
+        options.intra_op_num_threads = _intra_op_threads
+    options.inter_op_num_threads = max(1, ORT_INTER_OP_THREADS)
+    return options
+
+def create_session(model_path):
+    import onnxruntime as ort
+    return ort.InferenceSession(model_path, sess_options=session_options(), providers=["CPUExecutionProvider"])
+
+def _pick(fp32_path, int8_path):
+    if ONNX_USE_INT8 and os.path.exists(int8_path):
+        return int8_path
+    if os.path.exists(fp32_path):
+        return fp32_path
+    return None
+
+def voice_model_path():
+    return _pick(VOICE_ONNX_FP32, VOICE_ONNX_INT8)
+
+def gender_model_path():
+    return _pick(GENDER_ONNX_FP32, GENDER_ONNX_INT8)
+
+def yolo_model_path(kind):
+    path = PERSON_ONNX if kind == "person" else EMOTION_ONNX
+    return path if os.path.exists(path) else None
+
+# --- Runtime wrappers (same call interface as the PyTorch objects they replace) ---
+
+class OnnxVoiceModel:
+    """Drop-in for Wav2Vec2ForSequenceClassification: model(**inputs).logits, model.config."""
+
+    def __init__(self, model_path, config):
+        self.session = create_session(model_path)
+        self.config = config
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.model_path = model_path
+
+    def __call__(self, **inputs):
+        import torch
+        feeds = {}
+        for name in self.input_names:
+            value = inputs[name]
+            feeds[name] = value.numpy() if hasattr(value, 'numpy') else np.asarray(value)
+        feeds = {k: (v.astype(np.int64) if k == "attention_mask" else v.astype(np.float32)) for k, v in feeds.items()}
+        logits = self.session.run(["logits"], feeds)[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+class OnnxImageClassifier:
+    """Drop-in for the HF image-classification pipeline: pipe(image) -> [{'label', 'score'}, ...]."""
+
+    def __init__(self, model_path, model_name):
+        from transformers import AutoConfig, AutoImageProcessor
+        self.session = create_session(model_path)
+        self.processor = AutoImageProcessor.from_pretrained(model_name)
+        self.id2label = AutoConfig.from_pretrained(model_name).id2label
+        self.model_path = model_path
+
+    def __call__(self, image, top_k=5):
+        from PIL import Image
+        if isinstance(image, str):
+            image = Image.open(image)
+        image = image.convert("RGB")
+        pixel_values = self.processor(images=image, return_tensors="np")["pixel_values"].astype(np.float32)
+        logits = self.session.run(["logits"], {"pixel_values": pixel_values})[0][0]
+        probs = np.exp(logits - logits.max())
+        probs /= probs.sum()
+        order = np.argsort(-probs)[:top_k]
+        return [{"label": self.id2label[int(i)], "score": float(probs[i])} for i in order]
+
+def load_voice_model(feature_extractor, config):
+    path = voice_model_path()
+    if path is None:
+        return None
+    print(f"Using ONNX Runtime voice model: {os.path.basename(path)}")
+    return OnnxVoiceModel(path, config)
+
+def load_gender_pipeline(model_name):
+    path = gender_model_path()
+    if path is None:
+        return None
+    print(f"Using ONNX Runtime gender model: {os.path.basename(path)}")
+    return OnnxImageClassifier(path, model_name)
+
+def load_yolo(kind):
+    """Ultralytics runs exported .onnx files through onnxruntime itself."""
+    path = yolo_model_path(kind)
+    if path is None:
+        return None
+    from ultralytics import YOLO
+    print(f"Using ONNX Runtime YOLO model: {os.path.basename(path)}")
+    return YOLO(path, task="detect" if kind == "person" else "classify")
+
+# --- Export ---
+
+def _dequantize_voice_model(quantized_model):
+    """Rebuilds a float wav2vec2 from the dynamically quantized one (qint8 Linear layers can't be exported)."""
+    import torch
+    from transformers import Wav2Vec2ForSequenceClassification
+
+    float_model = Wav2Vec2ForSequenceClassification(quantized_model.config)
+    float_state = float_model.state_dict()
+    # Everything that is not a quantized Linear keeps its key and dtype
+    compatible = {k: v for k, v in quantized_model.state_dict().items()
+                  if k in float_state and hasattr(v, 'shape') and v.shape == float_state[k].shape and not v.is_quantized}
+    float_model.load_state_dict(compatible, strict=False)
+
+    for name, module in quantized_model.named_modules():
+        if isinstance(module, torch.ao.nn.quantized.dynamic.Linear):
+            target = float_model.get_submodule(name)
+            target.weight.data = module.weight().dequantize()
+            bias = module.bias()
+            if bias is not None:
+                target.bias.data = bias.detach().clone()
+    float_model.eval()
+    return float_model
+
+def export_voice_model(quantize=True, opset=17):
+    import torch
+    from . import model_registry
+
+    quantized_model, _ = model_registry._load_voice_model_torch()
+    float_model = _dequantize_voice_model(quantized_model)
+
+    os.makedirs(ONNX_MODELS_DIR, exist_ok=True)
+    dummy = torch.zeros(1, 16000, dtype=torch.float32)
+    input_names = ["input_values"]
+    args = (dummy,)
+    dynamic_axes = {"input_values": {0: "batch", 1: "samples"}, "logits": {0: "batch"}}
+    # The mask lets batched inference ignore padding; GroupNorm models must not get one (see voice_logits_local)
+    if quantized_model.config.feat_extract_norm == "layer":
+        input_names.append("attention_mask")
+        args = (dummy, torch.ones(1, 16000, dtype=torch.int64))
+        dynamic_axes["attention_mask"] = {0: "batch", 1: "samples"}
+
+    torch.onnx.export(float_model, args, VOICE_ONNX_FP32, input_names=input_names, output_names=["logits"],
+                      dynamic_axes=dynamic_axes, opset_version=opset)
+    print(f"Exported {VOICE_ONNX_FP32}")
+    if quantize:
+        _quantize_int8(VOICE_ONNX_FP32, VOICE_ONNX_INT8)
+
+def export_gender_model(quantize=True, opset=17):
+    import torch
+    from transformers import AutoModelForImageClassification
+    from .model_registry import GENDER_MODEL_NAME
+
+    model = AutoModelForImageClassification.from_pretrained(GENDER_MODEL_NAME)
+    model.eval()
+    size = getattr(model.config, 'image_size', 224)
+
+    os.makedirs(ONNX_MODELS_DIR, exist_ok=True)
+    dummy = torch.zeros(1, 3, size, size, dtype=torch.float32)
+    torch.onnx.export(model, (dummy,), GENDER_ONNX_FP32, input_names=["pixel_values"], output_names=["logits"],
+                      dynamic_axes={"pixel_values": {0: "batch"}, "logits": {0: "batch"}}, opset_version=opset)
+    print(f"Exported {GENDER_ONNX_FP32}")
+    if quantize:
+        _quantize_int8(GENDER_ONNX_FP32, GENDER_ONNX_INT8)
+
+def export_yolo_models():
+    """
+    Exports both YOLO models with a dynamic batch axis (needed for batched
+    video inference). They stay fp32: dynamic int8 does little for conv nets.
+    """
+    import shutil
+    from ultralytics import YOLO
+
+    os.makedirs(ONNX_MODELS_DIR, exist_ok=True)
+    for weights, target in (("yolo11n.pt", PERSON_ONNX), ("app/models/best_new.pt", EMOTION_ONNX)):
+        exported = YOLO(weights).export(format="onnx", dynamic=True, simplify=True)
+        shutil.move(exported, target)
+        print(f"Exported {target}")
+
+def _quantize_int8(source, target):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+    print(f"Quantized {target}")
+
+def export_all(quantize=True):
+    started = time.perf_counter()
+    export_voice_model(quantize)
+    export_gender_model(quantize)
+    export_yolo_models()
+    print(f"ONNX export finished in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    # python -m app.services.onnx_backend export [voice|gender|yolo] [--no-int8]
+    import sys
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    quantize = "--no-int8" not in sys.argv
+    if not args or args[0] != "export":
+        print("Usage: python -m app.services.onnx_backend export [voice|gender|yolo] [--no-int8]")
+        sys.exit(1)
+    targets = args[1:] or ["all"]
+    for target in targets:
+        if target == "voice":
+            export_voice_model(quantize)
+        elif target == "gender":
+            export_gender_model(quantize)
+        elif target == "yolo":
+            export_yolo_models()
+        else:
+            export_all(quantize)
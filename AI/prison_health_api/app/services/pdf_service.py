@@ -1,56 +1,359 @@
+import hashlib
+import multiprocessing
 import os
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings 
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
+from app.utils import metrics
+from . import model_registry
 
 load_dotenv()
 
-PERSIST_DIRECTORY_GENERAL = "./chroma_db"
-PERSIST_DIRECTORY_INMATES = "./chroma_db_inmates"
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 150
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))
+
+CHUNKS_EMBEDDED = metrics.counter("pdf_chunks_embedded_total", "PDF chunks embedded and stored in Chroma.", ("store",))
+FILES_INGESTED = metrics.counter("pdf_files_ingested_total", "Uploaded PDFs by ingestion outcome.", ("store", "status"))
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
 
 def get_embeddings():
     """
-    Returns a locally running Hugging Face embedding model.
+    Returns the shared Hugging Face embedding model (running on the inference
+    server when INFERENCE_SERVER is set).
     'all-MiniLM-L6-v2' is a standard, efficient model for RAG.
     Embedding Models should be chosen based on the vector DB's capabilities.
     """
-    return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+    return model_registry.get(model_registry.embeddings_entry())
 
-def store_pdf_in_vector_db(file_path, inmate_id=None):
-    try:
-        # 1. Load the PDF
-        loader = PyPDFLoader(file_path)
-        pages = loader.load_and_split()
-        
-        # 2. Split text into chunks
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=150)
-        texts = text_splitter.split_documents(pages)
-        
-        # Add metadata
-        if inmate_id:
-            for doc in texts:
-                doc.metadata['inmate_id'] = str(inmate_id)
-                
-        print(f"Total chunks created: {len(texts)}")
-        
-        # 3. Initialize Embeddings and Vector DB
-        embeddings = get_embeddings()
-        persist_dir = PERSIST_DIRECTORY_INMATES if inmate_id else PERSIST_DIRECTORY_GENERAL
-        vector_db = Chroma(
-            persist_directory=persist_dir, 
-            embedding_function=embeddings
-        )
+def get_vector_db(inmate_id=None):
+    """Shared Chroma store: per-inmate records or the general guidelines."""
+    return model_registry.get("chroma_inmates" if inmate_id else "chroma_general")
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _parse_pdf(file_path):
+    """
+    Loads and splits one PDF into (page_content, metadata) chunks. Runs in the
+    parse process pool, so it only returns plain, picklable values.
+    """
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    
+    started = time.perf_counter()
+    # 1. Load the PDF
+    loader = PyPDFLoader(file_path)
+    pages = loader.load()
+    
+    # 2. Split text into chunks
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    texts = text_splitter.split_documents(pages)
+    chunks = [(doc.page_content, dict(doc.metadata)) for doc in texts]
+    return chunks, time.perf_counter() - started
+
+def _get_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # spawn: never fork a process that already holds torch/Chroma threads
+            _parse_pool = ProcessPoolExecutor(max_workers=max(1, INGEST_PARSE_WORKERS),
+                                              mp_context=multiprocessing.get_context("spawn"))
+        return _parse_pool
+
+def stable_chunk_id(inmate_id, source, content):
+    """Deterministic chunk id from (inmate scope, source file, chunk text)."""
+    chunk_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    scope = str(inmate_id) if inmate_id else "general"
+    return hashlib.sha256(f"{scope}|{source}|{chunk_hash}".encode("utf-8")).hexdigest()
+
+def _source_chunk_ids(vector_db, source, inmate_id=None):
+    if inmate_id:
+        where = {"$and": [{"source": source}, {"inmate_id": str(inmate_id)}]}
+    else:
+        where = {"source": source}
+    return vector_db.get(where=where, include=[])["ids"]
+
+def _chunk_metadata(metadata, content_hash):
+    metadata = dict(metadata or {})
+    metadata["content_hash"] = content_hash
+    return metadata
+
+def _is_already_stored(vector_db, content_hash, inmate_id=None):
+    if inmate_id:
+        where = {"$and": [{"content_hash": content_hash}, {"inmate_id": str(inmate_id)}]}
+    else:
+        where = {"content_hash": content_hash}
+    existing = vector_db.get(where=where, limit=1, include=[])
+    return bool(existing.get("ids"))
+
+def ingest_pdfs(files, inmate_id=None, mode="diff"):
+    """
+    Parses (in a process pool), splits and embeds several PDFs.
+    files: [(path, filename), ...]
+
+    Files whose content hash is already stored are skipped. A file is tagged
+    with its hash only once all its chunks are stored, so a failed file is
+    ingested again on retry. Chunks get stable ids (see stable_chunk_id) and
+    only new ones are embedded, in batches of EMBED_BATCH_SIZE. "diff" mode
+    deletes chunks no longer in a re-uploaded file; "add" mode only adds.
+    Returns one status dict per file (status, chunks, added/unchanged/removed
+    counts, timings).
+    """
+    vector_db = get_vector_db(inmate_id)
+    store_label = "inmates" if inmate_id else "general"
+    results = []
+    to_parse = []
+    seen_hashes = {}
+    repeats = [] # (result, file_path, first result with the same content)
+    
+    for file_path, filename in files:
+        result = {"filename": filename, "status": "pending", "chunks": 0, "timings": {}}
+        results.append(result)
+        try:
+            started = time.perf_counter()
+            content_hash = file_sha256(file_path)
+            result["content_hash"] = content_hash
+            result["timings"]["hash_s"] = round(time.perf_counter() - started, 4)
+            metrics.observe_stage("pdf.hash", time.perf_counter() - started)
+            
+            # Already ingested earlier: costs nothing
+            if _is_already_stored(vector_db, content_hash, inmate_id):
+                result["status"] = "skipped_duplicate"
+                continue
+            # Same file twice in one upload: decided once the first copy is stored (or not)
+            if content_hash in seen_hashes:
+                repeats.append((result, file_path, seen_hashes[content_hash]))
+                continue
+            seen_hashes[content_hash] = result
+            to_parse.append((result, file_path))
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = str(e)
+    
+    # 1. Parse + split (in parallel when there is more than one file)
+    parsed = []
+    if len(to_parse) == 1:
+        result, file_path = to_parse[0]
+        try:
+            parsed.append((result, _parse_pdf(file_path)))
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = str(e)
+    elif to_parse:
+        pool = _get_parse_pool()
+        futures = [(result, pool.submit(_parse_pdf, file_path)) for result, file_path in to_parse]
+        for result, future in futures:
+            try:
+                parsed.append((result, future.result()))
+            except Exception as e:
+                result["status"] = "failed"
+                result["error"] = str(e)
+    
+    # 2. Diff every file against what is already stored for the same source
+    texts, metadatas, ids, owners = [], [], [], []
+    for result, (chunks, parse_seconds) in parsed:
+        result["timings"]["parse_s"] = round(parse_seconds, 4)
+        metrics.observe_stage("pdf.parse", parse_seconds)
+        result["chunks"] = len(chunks)
+        try:
+            existing_ids = set(_source_chunk_ids(vector_db, result["filename"], inmate_id))
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = str(e)
+            continue
         
-        # 4. Add to DB
-        # No batching/sleep needed for local execution
-        print("Embedding and storing documents locally...")
-        vector_db.add_documents(texts)
+        file_ids = set()
+        for content, metadata in chunks:
+            chunk_id = stable_chunk_id(inmate_id, result["filename"], content)
+            if chunk_id in file_ids:
+                continue # Same text twice in one file
+            file_ids.add(chunk_id)
+            if chunk_id in existing_ids:
+                continue # Unchanged chunk: keep the stored vector
+            metadata["source"] = result["filename"]
+            if inmate_id:
+                metadata["inmate_id"] = str(inmate_id)
+            texts.append(content)
+            metadatas.append(metadata)
+            ids.append(chunk_id)
+            owners.append(result)
         
+        unchanged = file_ids & existing_ids
+        result["added"] = len(file_ids - existing_ids)
+        result["unchanged"] = len(unchanged)
+        result["_unchanged_ids"] = sorted(unchanged)
+        result["_new_chunks"] = [(chunk_id, metadata) for chunk_id, metadata, owner
+                                 in zip(ids, metadatas, owners) if owner is result]
+        result["_removed_ids"] = sorted(existing_ids - file_ids) if mode == "diff" else []
+    print(f"Chunks to embed: {len(texts)} from {len(parsed)} files")
+    
+    # 3. Embed + store only new/changed chunks, in large batches through the shared model
+    failed = set()
+    embed_seconds = {}
+    for start in range(0, len(texts), EMBED_BATCH_SIZE):
+        batch_owners = owners[start:start + EMBED_BATCH_SIZE]
+        started = time.perf_counter()
+        try:
+            vector_db.add_texts(texts[start:start + EMBED_BATCH_SIZE],
+                                metadatas=metadatas[start:start + EMBED_BATCH_SIZE],
+                                ids=ids[start:start + EMBED_BATCH_SIZE])
+        except Exception as e:
+            print(f"Error embedding chunks: {e}")
+            for owner in batch_owners:
+                owner["status"] = "failed"
+                owner["error"] = str(e)
+                failed.add(id(owner))
+            continue
+        metrics.observe_stage("pdf.embed", time.perf_counter() - started)
+        CHUNKS_EMBEDDED.inc(len(batch_owners), store=store_label)
+        # Attribute batch time to files by their share of the batch
+        per_chunk = (time.perf_counter() - started) / len(batch_owners)
+        for owner in batch_owners:
+            embed_seconds[id(owner)] = embed_seconds.get(id(owner), 0.0) + per_chunk
+    
+    # 4. Drop chunks that disappeared from a file, then tag all of its chunks
+    #    with the file hash. Only complete files are tagged: chunks of a file
+    #    that failed part-way stay stored under their stable ids (a retry
+    #    re-uses them) but never make the retry look like a duplicate.
+    for result, _ in parsed:
+        unchanged_ids = result.pop("_unchanged_ids", [])
+        removed_ids = result.pop("_removed_ids", [])
+        new_chunks = result.pop("_new_chunks", [])
+        if result["status"] == "failed" or id(result) in failed:
+            continue
+        try:
+            if removed_ids:
+                vector_db.delete(ids=removed_ids)
+            tag_ids = [chunk_id for chunk_id, _ in new_chunks]
+            tag_metadatas = [_chunk_metadata(meta, result["content_hash"]) for _, meta in new_chunks]
+            if unchanged_ids:
+                tag_ids += unchanged_ids
+                tag_metadatas += [
+                    _chunk_metadata(meta, result["content_hash"])
+                    for meta in vector_db.get(ids=unchanged_ids, include=["metadatas"])["metadatas"]
+                ]
+            if tag_ids:
+                vector_db._collection.update(ids=tag_ids, metadatas=tag_metadatas)
+        except Exception as e:
+            result["status"] = "failed"
+            result["error"] = str(e)
+            continue
+        result["removed"] = len(removed_ids)
+        result["timings"]["embed_s"] = round(embed_seconds.get(id(result), 0.0), 4)
+        result["status"] = "stored"
+    
+    # 5. Repeated copies are duplicates of a stored first copy; otherwise they get their own attempt
+    retry = []
+    for result, file_path, first in repeats:
+        if first["status"] == "stored":
+            result["status"] = "skipped_duplicate"
+        else:
+            retry.append((result, file_path))
+    if retry:
+        outcomes = ingest_pdfs([(file_path, result["filename"]) for result, file_path in retry], inmate_id, mode)
+        for (result, _), outcome in zip(retry, outcomes):
+            result.update(outcome)
+    
+    retried = {id(result) for result, _ in retry}
+    for result in results:
+        if id(result) in retried:
+            continue # Counted by the nested call
+        FILES_INGESTED.inc(store=store_label, status=result["status"])
+    failed = sum(1 for result in results if result["status"] == "failed")
+    if failed:
+        print(f"{failed} of {len(results)} documents failed to process.")
+    else:
         print("All documents processed successfully.")
+    return results
+
+def store_pdf_in_vector_db(file_path, inmate_id=None):
+    try:
+        result = ingest_pdfs([(file_path, os.path.basename(file_path))], inmate_id)[0]
+        if result["status"] == "failed":
+            print(f"Error processing PDF: {result.get('error')}")
+            return False
         return True
     
     except Exception as e:
         print(f"Error processing PDF: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def compact_vector_db(inmate_store=True, page_size=1000):
+    """
+    Dedupes a store written before chunks had stable ids: keeps one chunk per
+    stable id, i.e. per (inmate scope, source file, chunk text), moves it to its stable id with its existing
+    embedding (nothing is re-embedded) and deletes every other copy.
+    """
+    vector_db = model_registry.get("chroma_inmates" if inmate_store else "chroma_general")
+    collection = vector_db._collection
+    started = time.perf_counter()
+    
+    keep = {} # stable id -> record
+    old_ids = []
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas", "embeddings"], limit=page_size, offset=offset)
+        if not page["ids"]:
+            break
+        offset += len(page["ids"])
+        for i, chunk_id in enumerate(page["ids"]):
+            old_ids.append(chunk_id)
+            content = page["documents"][i] or ""
+            metadata = dict(page["metadatas"][i] or {})
+            inmate_id = metadata.get("inmate_id")
+            # Older chunks stored the full upload path as source
+            source = os.path.basename(str(metadata.get("source", "unknown")))
+            metadata["source"] = source
+            # The same text in two documents stays: diff-mode re-uploads expect it under each source
+            key = stable_chunk_id(inmate_id, source, content)
+            if key not in keep:
+                keep[key] = {
+                    "id": key,
+                    "document": content,
+                    "metadata": metadata,
+                    "embedding": page["embeddings"][i],
+                }
+    
+    records = list(keep.values())
+    for start in range(0, len(records), page_size):
+        batch = records[start:start + page_size]
+        collection.upsert(
+            ids=[r["id"] for r in batch],
+            documents=[r["document"] for r in batch],
+            metadatas=[r["metadata"] for r in batch],
+            embeddings=[r["embedding"] for r in batch],
+        )
+    
+    kept_ids = {r["id"] for r in records}
+    stale_ids = [chunk_id for chunk_id in old_ids if chunk_id not in kept_ids]
+    for start in range(0, len(stale_ids), page_size):
+        collection.delete(ids=stale_ids[start:start + page_size])
+    
+    summary = {
+        "store": "inmates" if inmate_store else "general",
+        "chunks_before": len(old_ids),
+        "chunks_after": len(records),
+        "duplicates_removed": len(old_ids) - len(records),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    print(f"Compacted {summary['store']} store: {summary['chunks_before']} -> {summary['chunks_after']} chunks")
+    return summary
+
+if __name__ == "__main__":
+    # Dedupe existing stores: python -m app.services.pdf_service compact [general|inmates]
+    import sys
+    if len(sys.argv) < 2 or sys.argv[1] != "compact":
+        print("Usage: python -m app.services.pdf_service compact [general|inmates]")
+        sys.exit(1)
+    targets = sys.argv[2:] or ["general", "inmates"]
+    for target in targets:
+        compact_vector_db(inmate_store=(target == "inmates"))
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from app.model import db, HealthProfileCache
+
+# Generated health profiles are cached under a hash of the fully assembled
+# prompt inputs, so re-analyzing an inmate whose data did not change skips
+# the LLM call entirely.
+
+PROFILE_CACHE_ENABLED = os.getenv("PROFILE_CACHE_ENABLED", "1").lower() in ("1", "true", "yes")
+PROFILE_CACHE_TTL_SECONDS = int(os.getenv("PROFILE_CACHE_TTL_SECONDS", str(7 * 24 * 3600))) # 0 = never expire
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "5000"))
+
+# Per-process counters, reported by the stats endpoint
+_stats_lock = threading.Lock()
+_stats = {
+    "hits": 0,
+    "misses": 0,
+    "stores": 0,
+    "expired": 0,
+    "evicted": 0,
+    "llm_calls": 0,
+    "llm_seconds": 0.0,
+}
+
+def _bump(name, amount=1):
+    with _stats_lock:
+        _stats[name] += amount
+
+def cache_key(input_data, model_name, template):
+    """Canonical sha256 over the prompt template, model and every prompt input."""
+    canonical = json.dumps(
+        {
+            "model": model_name,
+            "template": template,
+            "inputs": {k: "" if v is None else str(v) for k, v in input_data.items()},
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def _is_expired(entry, now):
+    if PROFILE_CACHE_TTL_SECONDS <= 0 or entry.created_at is None:
+        return False
+    return entry.created_at < now - timedelta(seconds=PROFILE_CACHE_TTL_SECONDS)
+
+def get_profile(key, count_miss=True):
+    """Returns the cached profile dict for `key`, or None (expired entries are dropped)."""
+    if not PROFILE_CACHE_ENABLED:
+        return None
+    try:
+        entry = HealthProfileCache.query.get(key)
+        now = datetime.utcnow()
+        if entry is not None and _is_expired(entry, now):
+            db.session.delete(entry)
+            db.session.commit()
+            _bump("expired")
+            entry = None
+
+        if entry is None:
+            if count_miss:
+                _bump("misses")
+            return None
+
+        entry.hit_count = (entry.hit_count or 0) + 1
+        entry.last_hit_at = now
+        db.session.commit()
+        _bump("hits")
+        return json.loads(entry.profile)
+    except Exception as e:
+        # The cache must never break profile generation
+        db.session.rollback()
+        print(f"Warning: Profile cache lookup failed: {e}")
+        return None
+
+def store_profile(key, profile, inmate_id=None):
+    if not PROFILE_CACHE_ENABLED:
+        return
+    try:
+        entry = HealthProfileCache.query.get(key)
+        if entry is None:
+            entry = HealthProfileCache(key=key, hit_count=0)
+            db.session.add(entry)
+        entry.inmate_id = inmate_id
+        entry.profile = json.dumps(profile)
+        entry.created_at = datetime.utcnow()
+        entry.last_hit_at = entry.created_at
+        db.session.commit()
+        _bump("stores")
+        evict()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Warning: Profile cache store failed: {e}")
+
+def link_profile_logs(pairs):
+    """Remembers which HealthProfileLog row was written from which cache entry: [(key, log_id), ...]"""
+    pairs = [(key, log_id) for key, log_id in pairs if key]
+    if not PROFILE_CACHE_ENABLED or not pairs:
+        return
+    try:
+        for key, profile_log_id in pairs:
+            HealthProfileCache.query.filter_by(key=key).update({"profile_log_id": profile_log_id})
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Warning: Profile cache link failed: {e}")
+
+def entry_for_profile_log(profile_log_id):
+    if not PROFILE_CACHE_ENABLED or profile_log_id is None:
+        return None
+    return HealthProfileCache.query.filter_by(profile_log_id=profile_log_id).first()
+
+def evict():
+    """Drops expired entries, then the least recently used ones above the size cap."""
+    now = datetime.utcnow()
+    if PROFILE_CACHE_TTL_SECONDS > 0:
+        cutoff = now - timedelta(seconds=PROFILE_CACHE_TTL_SECONDS)
+        expired = HealthProfileCache.query.filter(HealthProfileCache.created_at < cutoff).delete(synchronize_session=False)
+        if expired:
+            _bump("expired", expired)
+
+    if PROFILE_CACHE_MAX_ENTRIES > 0:
+        overflow = HealthProfileCache.query.count() - PROFILE_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            stale_keys = [row.key for row in HealthProfileCache.query
+                          .with_entities(HealthProfileCache.key)
+                          .order_by(HealthProfileCache.last_hit_at.asc())
+                          .limit(overflow).all()]
+            HealthProfileCache.query.filter(HealthProfileCache.key.in_(stale_keys)).delete(synchronize_session=False)
+            _bump("evicted", len(stale_keys))
+    db.session.commit()
+
+def record_llm_call(seconds):
+    _bump("llm_calls")
+    _bump("llm_seconds", seconds)
+
+def cache_stats():
+    with _stats_lock:
+        data = dict(_stats)
+    lookups = data["hits"] + data["misses"]
+    avg_llm_seconds = data["llm_seconds"] / data["llm_calls"] if data["llm_calls"] else None
+    data["hit_rate"] = round(data["hits"] / lookups, 4) if lookups else None
+    data["avg_llm_seconds"] = round(avg_llm_seconds, 3) if avg_llm_seconds is not None else None
+    # Every hit is one LLM round trip we did not pay for
+    data["estimated_llm_seconds_saved"] = round(data["hits"] * avg_llm_seconds, 3) if avg_llm_seconds is not None else None
+    data["llm_seconds"] = round(data["llm_seconds"], 3)
+    data["entries"] = HealthProfileCache.query.count()
+    data["enabled"] = PROFILE_CACHE_ENABLED
+    data["ttl_seconds"] = PROFILE_CACHE_TTL_SECONDS
+    data["max_entries"] = PROFILE_CACHE_MAX_ENTRIES
+    return data
+
+def clear():
+    deleted = HealthProfileCache.query.delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
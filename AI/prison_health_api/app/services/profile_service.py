@@ -0,0 +1,132 @@
+import json
+from types import SimpleNamespace
+from app.model import db, Inmate, SurveyAnswer, EmotionLog, HealthProfileLog
+from . import profile_cache
+from .rag_service import generate_health_profile
+
+# Health profile generation for one inmate, split into the DB side
+# (collect_profile_inputs / save) and the LLM side (run_profile) so batch
+# callers can run the slow part concurrently and write rows in bulk.
+
+def summarize_profile_logs(logs):
+    """Chronological prompt summary of profile logs (given newest first)."""
+    if not logs:
+        return "None"
+    summaries = []
+    for log in reversed(logs): # chronological order
+        summaries.append(f"Date: {log.timestamp.strftime('%Y-%m-%d %H:%M')}, Risk: {log.risk_level}, "
+                         f"Conditions: {log.suspected_conditions}, Progress: {log.progress_indicator}")
+    return "\n".join(summaries)
+
+def collect_profile_inputs(inmate):
+    """
+    Reads everything the profile prompt needs from SQL. The result holds only
+    plain values, so it can be handed to a worker thread.
+    """
+    inmate_id = inmate.id
+
+    # Fetch recent data from SQL
+    recent_emotions = EmotionLog.query.filter_by(inmate_id=inmate_id).order_by(EmotionLog.timestamp.desc()).limit(5).all()
+    emotion_str = ", ".join([e.predicted_emotion for e in recent_emotions])
+
+    recent_answers = SurveyAnswer.query.filter_by(inmate_id=inmate_id).limit(10).all()
+    survey_summary = "; ".join([f"Q: {a.question_text} A: {a.answer_text} (Voice: {a.voice_emotion})" for a in recent_answers])
+    survey_answers = [(a.question_text, a.answer_text) for a in recent_answers]
+
+    # Fetch historical health profiles (one extra, see the cache check in run_profile)
+    history_logs = HealthProfileLog.query.filter_by(inmate_id=inmate_id).order_by(HealthProfileLog.timestamp.desc()).limit(4).all()
+    history = [SimpleNamespace(
+        id=log.id,
+        timestamp=log.timestamp,
+        risk_level=log.risk_level,
+        suspected_conditions=log.suspected_conditions,
+        progress_indicator=log.progress_indicator
+    ) for log in history_logs]
+
+    latest_entry = profile_cache.entry_for_profile_log(history[0].id) if history else None
+
+    return {
+        "inmate_id": inmate_id,
+        "inmate": SimpleNamespace(
+            id=inmate_id,
+            age=inmate.age,
+            gender=inmate.gender,
+            crime_details=inmate.crime_details,
+            visual_emotion=inmate.visual_emotion,
+            ocr_prescription=inmate.ocr_prescription
+        ),
+        "emotion_str": emotion_str,
+        "survey_summary": survey_summary,
+        "survey_answers": survey_answers,
+        "history": history,
+        "latest_cache_key": latest_entry.key if latest_entry is not None else None
+    }
+
+def run_profile(inputs, force_refresh=False):
+    """
+    LLM side of an analysis; needs an app context (for the profile cache) but
+    no request. Returns (analysis_json, cache_info, reused_latest) where
+    reused_latest means the newest stored profile is still current.
+    """
+    history = inputs["history"]
+
+    if history and inputs["latest_cache_key"] and not force_refresh:
+        # If the newest profile was generated from exactly the current data (with
+        # the older history), nothing changed since then: reuse it, write no new log
+        cache_info = {}
+        analysis_json = generate_health_profile(inputs["inmate"], inputs["emotion_str"], inputs["survey_summary"],
+                                                summarize_profile_logs(history[1:4]), survey_answers=inputs["survey_answers"],
+                                                cache_only=True, cache_info=cache_info)
+        if analysis_json is not None and cache_info.get("key") == inputs["latest_cache_key"]:
+            return analysis_json, cache_info, True
+
+    # Call RAG Service
+    cache_info = {}
+    analysis_json = generate_health_profile(inputs["inmate"], inputs["emotion_str"], inputs["survey_summary"],
+                                            summarize_profile_logs(history[:3]), survey_answers=inputs["survey_answers"],
+                                            force_refresh=force_refresh, cache_info=cache_info)
+    return analysis_json, cache_info, False
+
+def make_profile_log(inmate_id, analysis_json):
+    return HealthProfileLog(
+        inmate_id=inmate_id,
+        risk_level=analysis_json.get("risk_level", "Unknown"),
+        suspected_conditions=json.dumps(analysis_json.get("suspected_conditions", [])),
+        recommended_actions=json.dumps(analysis_json.get("recommended_actions", [])),
+        urgent_alert=analysis_json.get("urgent_alert", False),
+        reasoning=analysis_json.get("reasoning", ""),
+        progress_indicator=analysis_json.get("progress_indicator", "Initial")
+    )
+
+def history_summary(logs):
+    return [{
+        "date": log.timestamp.strftime('%Y-%m-%d %H:%M'),
+        "risk_level": log.risk_level,
+        "progress_indicator": log.progress_indicator
+    } for log in logs]
+
+def analyze_inmate_profile(inmate_id, force_refresh=False):
+    """Builds the RAG inputs for an inmate, generates and stores a new health profile."""
+    # Fetch the inmate object securely
+    inmate = Inmate.query.get(inmate_id)
+    if not inmate:
+        raise ValueError(f"Inmate {inmate_id} not found")
+
+    inputs = collect_profile_inputs(inmate)
+    analysis_json, cache_info, reused_latest = run_profile(inputs, force_refresh)
+
+    if reused_latest:
+        past_logs = inputs["history"][1:4]
+    else:
+        past_logs = inputs["history"][:3]
+
+        # Save the report string to DB, so we don't have to keep querying the LLM
+        inmate.final_llm_report = json.dumps(analysis_json)
+
+        # Create a new HealthProfileLog entry
+        new_log = make_profile_log(inmate.id, analysis_json)
+        db.session.add(new_log)
+        db.session.commit()
+        profile_cache.link_profile_logs([(cache_info.get("key"), new_log.id)])
+
+    return {"analysis": analysis_json, "history": history_summary(past_logs), "cached": bool(cache_info.get("hit"))}
@@ -1,11 +1,13 @@
 import os
+import time
 from typing import List
 from pydantic import BaseModel, Field
-from langchain_chroma import Chroma
-from langchain_core.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
-from langchain_huggingface import HuggingFaceEmbeddings
 from dotenv import load_dotenv
+from app.utils.rate_limit import RateLimiter
+from app.utils import metrics
+from . import model_registry
+from . import profile_cache
+from .guideline_index import lookup_guideline_context
 
 load_dotenv()
 
@@ -18,44 +20,24 @@ class HealthProfile(BaseModel):
     progress_indicator: str = Field(description="Tracking value comparing with previous profile: Improved, Stable, or Regressed. Use 'Initial' if no previous history.")
 
 
-llm = ChatOpenAI(
-    model="gpt-4o",  
-    temperature=0.0, 
-    api_key=os.getenv("OPENAI_API_KEY")
-)
+LLM_MODEL_NAME = "gpt-4o"
 
-structured_llm = llm.with_structured_output(HealthProfile)
+# The ChatOpenAI client (structured to HealthProfile) is built on first use by
+# the model registry, see model_registry._load_llm. It returns
+# {"raw": AIMessage, "parsed": HealthProfile, "parsing_error": ...}
+def get_structured_llm():
+    return model_registry.get("llm")
 
-PERSIST_DIRECTORY_GENERAL = "./chroma_db"
-PERSIST_DIRECTORY_INMATES = "./chroma_db_inmates"
+DOCUMENTS_RETRIEVED = metrics.counter("rag_documents_retrieved_total", "Chunks retrieved into profile prompts.", ("store",))
+LLM_REQUESTS = metrics.counter("llm_requests_total", "Health profile LLM calls.", ("model", "status"))
+LLM_TOKENS = metrics.counter("llm_tokens_total", "LLM tokens used by health profile calls.", ("model", "type"))
+LLM_SECONDS = metrics.histogram("llm_request_duration_seconds", "Health profile LLM call latency.", ("model",))
 
-def generate_health_profile(inmate_data, emotion_history, survey_summary, previous_profiles_str="None"):
-    try:
-        embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        
-        # General guidelines from main Chroma DB
-        general_vector_db = Chroma(persist_directory=PERSIST_DIRECTORY_GENERAL, embedding_function=embeddings)
-        general_retriever = general_vector_db.as_retriever(search_kwargs={"k": 3})
-        query = f"treatment guidelines for {survey_summary} and mental health interventions"
-        general_docs = general_retriever.invoke(query)
-        general_context = "\n\n".join([doc.page_content for doc in general_docs])
+# Shared across every caller (single analyses, cohorts, jobs) so concurrent
+# batches cannot exceed the provider quota. 0 = unlimited.
+llm_rate_limiter = RateLimiter(int(os.getenv("LLM_RATE_LIMIT_PER_MIN", "0")), burst=int(os.getenv("LLM_RATE_LIMIT_BURST", "0")) or None)
 
-        # Inmate specific history from inmate Chroma DB
-        inmate_context = "No specific medical records found."
-        inmate_id = getattr(inmate_data, 'id', None)
-        if inmate_id:
-            try:
-                inmate_vector_db = Chroma(persist_directory=PERSIST_DIRECTORY_INMATES, embedding_function=embeddings)
-                inmate_retriever = inmate_vector_db.as_retriever(search_kwargs={"k": 3, "filter": {"inmate_id": str(inmate_id)}})
-                inmate_query = "medical history conditions interventions records"
-                inmate_docs = inmate_retriever.invoke(inmate_query)
-                if inmate_docs:
-                    inmate_context = "\n\n".join([doc.page_content for doc in inmate_docs])
-            except Exception as inner_e:
-                print(f"Warning: Could not fetch inmate records: {inner_e}")
-
-        context = f"--- GENERIC MEDICAL GUIDELINES ---\n{general_context}\n\n--- INMATE MEDICAL RECORDS ---\n{inmate_context}"
-        template = """
+PROFILE_TEMPLATE = """
         You are an AI Prison Health Assistant. Analyze the inmate's profile based on the data provided.
         
         INMATE INFO:
@@ -85,31 +67,111 @@ def generate_health_profile(inmate_data, emotion_history, survey_summary, previo
         Compare current status against `PREVIOUS HEALTH PROFILES` to determine the `progress_indicator`.
         Provide output based strictly on the schema provided.
         """
-        
+
+def build_profile_inputs(inmate_data, emotion_history, survey_summary, previous_profiles_str="None", survey_answers=None):
+    """Retrieves the RAG context and assembles every input of the profile prompt."""
+    # General guidelines: precomputed per (question, answer) when possible,
+    # otherwise a vector search over the main Chroma DB
+    with metrics.stage("rag.guideline_lookup"):
+        general_context = lookup_guideline_context(survey_answers) if survey_answers else None
+    if general_context is None:
+        general_vector_db = model_registry.get("chroma_general")
+        general_retriever = general_vector_db.as_retriever(search_kwargs={"k": 3})
+        query = f"treatment guidelines for {survey_summary} and mental health interventions"
+        with metrics.stage("rag.retrieve_general"):
+            general_docs = general_retriever.invoke(query)
+        DOCUMENTS_RETRIEVED.inc(len(general_docs), store="general")
+        general_context = "\n\n".join([doc.page_content for doc in general_docs])
+
+    # Inmate specific history from inmate Chroma DB
+    inmate_context = "No specific medical records found."
+    inmate_id = getattr(inmate_data, 'id', None)
+    if inmate_id:
+        try:
+            inmate_vector_db = model_registry.get("chroma_inmates")
+            inmate_retriever = inmate_vector_db.as_retriever(search_kwargs={"k": 3, "filter": {"inmate_id": str(inmate_id)}})
+            inmate_query = "medical history conditions interventions records"
+            with metrics.stage("rag.retrieve_inmate"):
+                inmate_docs = inmate_retriever.invoke(inmate_query)
+            DOCUMENTS_RETRIEVED.inc(len(inmate_docs), store="inmates")
+            if inmate_docs:
+                inmate_context = "\n\n".join([doc.page_content for doc in inmate_docs])
+        except Exception as inner_e:
+            print(f"Warning: Could not fetch inmate records: {inner_e}")
+
+    context = f"--- GENERIC MEDICAL GUIDELINES ---\n{general_context}\n\n--- INMATE MEDICAL RECORDS ---\n{inmate_context}"
+    return {
+        "age": getattr(inmate_data, 'age', 'N/A'),
+        "gender": getattr(inmate_data, 'gender', 'Unknown'),
+        "crime": getattr(inmate_data, 'crime_details', 'N/A'),
+        "visual_emotion": getattr(inmate_data, 'visual_emotion', 'N/A'),
+        "ocr_prescription": getattr(inmate_data, 'ocr_prescription', 'None'),
+        "emotions": emotion_history,
+        "survey": survey_summary,
+        "previous_profiles": previous_profiles_str,
+        "context": context
+    }
+
+def generate_health_profile(inmate_data, emotion_history, survey_summary, previous_profiles_str="None", survey_answers=None,
+                            force_refresh=False, cache_only=False, cache_info=None):
+    """
+    Generates a health profile, reusing a cached one when the assembled prompt
+    inputs are identical. `force_refresh` skips the cache lookup; with
+    `cache_only` a miss returns None instead of calling the LLM. If a
+    `cache_info` dict is given it receives the cache key and hit flag.
+    """
+    if cache_info is None:
+        cache_info = {}
+    try:
+        with metrics.stage("rag.build_inputs"):
+            input_data = build_profile_inputs(inmate_data, emotion_history, survey_summary, previous_profiles_str, survey_answers)
+        key = profile_cache.cache_key(input_data, LLM_MODEL_NAME, PROFILE_TEMPLATE)
+        cache_info.update({"key": key, "hit": False})
+
+        if not force_refresh:
+            cached = profile_cache.get_profile(key, count_miss=not cache_only)
+            if cached is not None:
+                cache_info["hit"] = True
+                return cached
+        if cache_only:
+            return None
+
+        from langchain_core.prompts import PromptTemplate
         prompt = PromptTemplate(
-            template=template,
+            template=PROFILE_TEMPLATE,
             input_variables=["age", "gender", "crime", "visual_emotion", "ocr_prescription", "emotions", "survey", "previous_profiles", "context"]
         )  
-        input_data = {
-            "age": getattr(inmate_data, 'age', 'N/A'),
-            "gender": getattr(inmate_data, 'gender', 'Unknown'),
-            "crime": getattr(inmate_data, 'crime_details', 'N/A'),
-            "visual_emotion": getattr(inmate_data, 'visual_emotion', 'N/A'),
-            "ocr_prescription": getattr(inmate_data, 'ocr_prescription', 'None'),
-            "emotions": emotion_history,
-            "survey": survey_summary,
-            "previous_profiles": previous_profiles_str,
-            "context": context
-        }
         
         print("Generating health profile...\n", prompt.format(**input_data)) 
         
-        chain = prompt | structured_llm
-        response_obj = chain.invoke(input_data)
-        return response_obj.model_dump()
+        chain = prompt | get_structured_llm()
+        llm_rate_limiter.acquire()
+        started = time.perf_counter()
+        try:
+            with metrics.stage("rag.llm"):
+                response = chain.invoke(input_data)
+        except Exception:
+            LLM_REQUESTS.inc(model=LLM_MODEL_NAME, status="error")
+            raise
+        seconds = time.perf_counter() - started
+        profile_cache.record_llm_call(seconds)
+        LLM_SECONDS.observe(seconds, model=LLM_MODEL_NAME)
+        usage = getattr(response["raw"], "usage_metadata", None) or {}
+        LLM_TOKENS.inc(usage.get("input_tokens", 0), model=LLM_MODEL_NAME, type="prompt")
+        LLM_TOKENS.inc(usage.get("output_tokens", 0), model=LLM_MODEL_NAME, type="completion")
+        if response["parsed"] is None:
+            LLM_REQUESTS.inc(model=LLM_MODEL_NAME, status="parse_error")
+            raise response["parsing_error"] or ValueError("LLM response did not match the HealthProfile schema")
+        LLM_REQUESTS.inc(model=LLM_MODEL_NAME, status="ok")
+
+        profile = response["parsed"].model_dump()
+        profile_cache.store_profile(key, profile, getattr(inmate_data, 'id', None))
+        return profile
 
     except Exception as e:
         print(f"Error generating profile: {e}")
+        if cache_only:
+            return None
         # Return a safe fallback structure on error
         return {
             "risk_level": "Unknown",
@@ -118,4 +180,4 @@ def generate_health_profile(inmate_data, emotion_history, survey_summary, previo
             "urgent_alert": False,
             "reasoning": str(e),
             "progress_indicator": "Error"
-        }
\ No newline at end of file
+        }
@@ -9,4 +9,12 @@ MEDICAL_QUESTIONS = [
     "8. Have you felt bad about yourself - or that you are a failure or have let yourself down?",
     "9. Do you have trouble concentrating on things, such as reading or watching TV?",
     "10. Have you had thoughts that you would be better off dead, or of hurting yourself?"
-]
\ No newline at end of file
+]
+
+# Fixed answer options offered for every question, ordered by severity (0-3)
+ANSWER_OPTIONS = [
+    "Not at all",
+    "Several days",
+    "More than half the days",
+    "Nearly every day"
+]
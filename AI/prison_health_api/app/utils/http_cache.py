@@ -0,0 +1,16 @@
+import hashlib
+import json
+from flask import request, current_app
+
+def conditional_json(payload, status=200):
+    """
+    JSON response with a strong ETag over its body. If the request's
+    If-None-Match matches, a bodyless 304 is returned instead, so polling
+    clients only download lists that changed.
+    """
+    body = json.dumps(payload, separators=(",", ":"), sort_keys=True, default=str)
+    response = current_app.response_class(body, status=status, mimetype="application/json")
+    response.set_etag(hashlib.sha1(body.encode()).hexdigest())
+    # Always revalidate, the data changes with every analysis
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
@@ -0,0 +1,226 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from app.utils import profiling
+
+# Minimal in-process Prometheus instrumentation (text exposition format 0.0.4).
+# Each metric keeps its series in a dict guarded by one lock; recording is a
+# dict lookup and a few additions, cheap enough to leave on permanently.
+# Every process (e.g. each gunicorn worker) exposes its own values.
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_metrics = {}
+_collectors = []
+_registry_lock = threading.Lock()
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1.0, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            series = dict(self._series)
+        for key, value in sorted(series.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._series[_label_key(self.labelnames, labels)] = float(value)
+
+    def inc(self, amount=1.0, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def render(self):
+        return Counter.render(self)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [per-bucket counts..., +Inf count], sum
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = self._header()
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+def _register(metric):
+    with _registry_lock:
+        existing = _metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        _metrics[metric.name] = metric
+        return metric
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter(name, documentation, labelnames))
+
+def gauge(name, documentation, labelnames=()):
+    return _register(Gauge(name, documentation, labelnames))
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+def register_collector(fn):
+    """
+    `fn()` is called on every scrape and returns extra exposition lines; used
+    for values that are cheaper to read on demand (e.g. queue depths).
+    """
+    _collectors.append(fn)
+    return fn
+
+def gauge_lines(name, documentation, samples):
+    """Exposition lines for a gauge computed at scrape time. samples: [(labels dict, value), ...]"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        names = tuple(labels)
+        lines.append(f"{name}{_format_labels(names, _label_key(names, labels))} {_format_value(value)}")
+    return lines
+
+def render():
+    """All metrics in Prometheus text format."""
+    with _registry_lock:
+        metrics = list(_metrics.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    for collect in list(_collectors):
+        try:
+            lines.extend(collect())
+        except Exception as e:
+            lines.append(f"# collector {getattr(collect, '__name__', collect)} failed: {e}")
+    return "\n".join(lines) + "\n"
+
+# --- Shared pipeline metrics ---
+
+STAGE_SECONDS = histogram("pipeline_stage_duration_seconds", "Time spent per pipeline stage.", ("stage",))
+HTTP_REQUEST_SECONDS = histogram("http_request_duration_seconds", "HTTP request latency by route.",
+                                 ("blueprint", "route", "method", "status"))
+HTTP_IN_FLIGHT = gauge("http_requests_in_flight", "HTTP requests currently being served.")
+
+def observe_stage(name, seconds):
+    """Records a stage timed elsewhere (also as a span when the request is profiled)."""
+    STAGE_SECONDS.observe(seconds, stage=name)
+    profiling.record(name, seconds)
+
+@contextmanager
+def stage(name):
+    """
+    Times the block into pipeline_stage_duration_seconds{stage=name}; when the
+    request is profiled the block is also a span in its tree.
+    """
+    started = time.perf_counter()
+    try:
+        with profiling.span(name):
+            yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=name)
+
+def init_app(app):
+    """Request latency / in-flight tracking for every route of `app`."""
+    if not METRICS_ENABLED:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+
+    @app.teardown_request
+    def _record_request(_exc=None):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return
+        HTTP_IN_FLIGHT.dec()
+        # The URL rule (not the path) keeps label cardinality bounded
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        status = getattr(g, '_metrics_status', 500 if _exc is not None else 200)
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, blueprint=request.blueprint or "",
+                                     route=route, method=request.method, status=status)
+
+    @app.after_request
+    def _remember_status(response):
+        g._metrics_status = response.status_code
+        return response
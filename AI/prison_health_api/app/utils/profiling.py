@@ -0,0 +1,286 @@
+import contextvars
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+# Opt-in per-request profiling. An admin sends `X-Profile: 1` (or ?profile=1)
+# and the request gets:
+#   - a span tree of the pipeline stages it went through (metrics.stage() and
+#     profiling.span() blocks, nested by call order, across worker threads
+#     started with profiling.wrap_thread_target), and
+#   - a sampled call profile of every thread that ran a span for it,
+#     exported as folded stacks ("a;b;c 42") for flamegraph.pl / speedscope.
+# The result is written to PROFILE_DIR and served by /api/admin/profiles.
+# Without the flag the only cost is one ContextVar lookup per stage.
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "1").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_MAX_STORED = int(os.getenv("PROFILE_MAX_STORED", "200"))
+
+_current = contextvars.ContextVar("profile_span", default=None)
+_PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+class Span:
+    __slots__ = ("name", "thread", "started", "seconds", "children", "attrs")
+
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.thread = threading.current_thread().name
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.children = []
+        self.attrs = attrs or {}
+
+    def to_dict(self, origin):
+        data = {
+            "name": self.name,
+            "thread": self.thread,
+            "start_ms": round((self.started - origin) * 1000, 3),
+            "duration_ms": round(self.seconds * 1000, 3) if self.seconds is not None else None,
+        }
+        if self.attrs:
+            data["attrs"] = self.attrs
+        if self.children:
+            data["children"] = [child.to_dict(origin) for child in self.children]
+        return data
+
+class Profile:
+    def __init__(self, name, meta):
+        self.id = uuid.uuid4().hex
+        self.meta = meta
+        self.root = Span(name)
+        self.lock = threading.Lock()
+        self.thread_ids = {threading.get_ident()}
+        self.samples = {}
+        self.sample_count = 0
+        self._stop = threading.Event()
+        self._sampler = None
+
+    # Sampling
+    def start_sampler(self, interval_ms=None):
+        interval = max(0.001, (interval_ms or PROFILE_SAMPLE_INTERVAL_MS) / 1000.0)
+        self._sampler = threading.Thread(target=self._sample_loop, args=(interval,), name=f"profiler-{self.id[:8]}", daemon=True)
+        self._sampler.start()
+
+    def _sample_loop(self, interval):
+        while not self._stop.wait(interval):
+            frames = sys._current_frames()
+            with self.lock:
+                thread_ids = list(self.thread_ids)
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                key = ";".join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            self.sample_count += 1
+
+    def finish(self):
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.root.seconds = time.perf_counter() - self.root.started
+
+    def folded(self):
+        """Folded stacks: one 'frame;frame;frame count' line per distinct stack."""
+        return "\n".join(f"{stack} {count}" for stack, count in sorted(self.samples.items())) + "\n"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            **self.meta,
+            "duration_ms": round(self.root.seconds * 1000, 3) if self.root.seconds is not None else None,
+            "sample_interval_ms": PROFILE_SAMPLE_INTERVAL_MS,
+            "samples": self.sample_count,
+            "spans": self.root.to_dict(self.root.started),
+        }
+
+# --- Spans ---
+
+def active():
+    """True while the current request/thread is being profiled."""
+    return _current.get() is not None
+
+@contextmanager
+def _span(parent, name, attrs):
+    profile, parent_span = parent
+    span = Span(name, attrs)
+    with profile.lock:
+        parent_span.children.append(span)
+        profile.thread_ids.add(threading.get_ident())
+    token = _current.set((profile, span))
+    try:
+        yield span
+    finally:
+        span.seconds = time.perf_counter() - span.started
+        _current.reset(token)
+
+_NO_SPAN = nullcontext()
+
+def span(name, **attrs):
+    """Records a nested span when the request is profiled, otherwise a shared no-op."""
+    parent = _current.get()
+    if parent is None:
+        return _NO_SPAN
+    return _span(parent, name, attrs)
+
+def record(name, seconds, **attrs):
+    """Adds an already-measured span (ending now) when the request is profiled."""
+    parent = _current.get()
+    if parent is None:
+        return
+    profile, parent_span = parent
+    span = Span(name, attrs)
+    span.started -= seconds
+    span.seconds = seconds
+    with profile.lock:
+        parent_span.children.append(span)
+
+def wrap_thread_target(target):
+    """Runs `target` in the caller's context, so spans from a worker thread join the request's tree."""
+    if _current.get() is None:
+        return target
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(target, *args, **kwargs)
+
+# --- Storage ---
+
+def _profile_path(profile_id, suffix):
+    if not _PROFILE_ID.match(profile_id or ""):
+        raise ValueError("Invalid profile id")
+    return os.path.join(PROFILE_DIR, f"{profile_id}{suffix}")
+
+def save(profile):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(_profile_path(profile.id, ".json"), "w") as f:
+        json.dump(profile.to_dict(), f)
+    with open(_profile_path(profile.id, ".folded"), "w") as f:
+        f.write(profile.folded())
+    _prune()
+
+def _prune():
+    entries = sorted((e for e in os.scandir(PROFILE_DIR) if e.name.endswith(".json")), key=lambda e: e.stat().st_mtime)
+    for entry in entries[:max(0, len(entries) - PROFILE_MAX_STORED)]:
+        delete(entry.name[:-5])
+
+def list_profiles(limit=50):
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    entries = sorted((e for e in os.scandir(PROFILE_DIR) if e.name.endswith(".json")),
+                     key=lambda e: e.stat().st_mtime, reverse=True)[:limit]
+    summaries = []
+    for entry in entries:
+        try:
+            with open(entry.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        data.pop("spans", None)
+        summaries.append(data)
+    return summaries
+
+def load(profile_id):
+    """The stored profile dict, or None."""
+    try:
+        with open(_profile_path(profile_id, ".json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def load_folded(profile_id):
+    try:
+        with open(_profile_path(profile_id, ".folded")) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def delete(profile_id):
+    deleted = False
+    for suffix in (".json", ".folded"):
+        try:
+            os.remove(_profile_path(profile_id, suffix))
+            deleted = True
+        except FileNotFoundError:
+            pass
+    return deleted
+
+# --- Flask integration ---
+
+def admin_user(req):
+    """The admin User behind the request's `Bearer mock-jwt-<id>-<username>` token, or None."""
+    from app.model import User
+    auth = req.headers.get("Authorization", "")
+    match = re.match(r"^Bearer mock-jwt-(\d+)-(.+)$", auth.strip())
+    if not match:
+        return None
+    user = User.query.get(int(match.group(1)))
+    if user is None or user.username != match.group(2) or user.role != "admin":
+        return None
+    return user
+
+def _requested(req):
+    flag = req.headers.get("X-Profile") or req.args.get("profile")
+    return flag is not None and flag.lower() in ("1", "true", "yes")
+
+def init_app(app):
+    if not PROFILING_ENABLED:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def _start_profile():
+        if not _requested(request):
+            return
+        user = admin_user(request)
+        if user is None:
+            return
+        profile = Profile(f"{request.method} {request.path}", {
+            "method": request.method,
+            "path": request.path,
+            "route": request.url_rule.rule if request.url_rule is not None else None,
+            "user": user.username,
+            "created_at": datetime.utcnow().isoformat()
+        })
+        g._profile = profile
+        g._profile_token = _current.set((profile, profile.root))
+        profile.start_sampler()
+
+    @app.after_request
+    def _tag_response(response):
+        profile = g.get('_profile')
+        if profile is not None:
+            profile.meta["status"] = response.status_code
+            response.headers["X-Profile-Id"] = profile.id
+        return response
+
+    @app.teardown_request
+    def _finish_profile(_exc=None):
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return
+        try:
+            _current.reset(g.pop('_profile_token'))
+        except ValueError:
+            # Streamed responses tear down in a copied context
+            _current.set(None)
+        profile.finish()
+        if _exc is not None:
+            profile.meta["error"] = str(_exc)
+        try:
+            save(profile)
+        except Exception as e:
+            print(f"Could not store profile {profile.id}: {e}")
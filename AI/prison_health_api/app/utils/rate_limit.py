@@ -0,0 +1,32 @@
+import threading
+import time
+
+class RateLimiter:
+    """
+    Thread-safe token bucket: at most `rate_per_minute` acquisitions per minute,
+    with bursts up to `burst`. A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate_per_minute, burst=None):
+        self.rate_per_second = rate_per_minute / 60.0 if rate_per_minute else 0.0
+        self.capacity = float(burst or max(1, int(rate_per_minute or 1)))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available. Returns the seconds spent waiting."""
+        if not self.rate_per_second:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate_per_second)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return waited
+                delay = (1.0 - self.tokens) / self.rate_per_second
+            time.sleep(delay)
+            waited += delay
@@ -0,0 +1,87 @@
+import gc
+import os
+import sys
+from app.services import model_registry
+from app.utils import startup
+
+# Production serving under gunicorn with preload_app (see gunicorn.conf.py):
+#   master:  create_app() runs the migrations once, marks interrupted jobs
+#            failed and loads the PRELOAD_MODELS weights, then forks. Workers
+#            share those pages copy-on-write instead of loading one copy each.
+#            When a worker exits (recycled, timed out, crashed) child_exit
+#            fails the jobs it was running and releases its queued ones.
+#   workers: post_fork sizes the torch and ONNX Runtime thread pools to this
+#            worker's share of the CPUs, drops inherited objects that are not fork-safe, and
+#            adopts released queued jobs. worker_exit cancels and releases
+#            the jobs still waiting in a stopping worker's pools.
+
+# Registry entries loaded in the master before fork. With INFERENCE_SERVER set
+# the models live in the inference server, so nothing is preloaded by default.
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS",
+                           "" if os.getenv("INFERENCE_SERVER") else "embeddings,gender_pipeline,voice_model,person_model,emotion_model")
+# Intra-op threads per worker (torch, and ONNX Runtime unless
+# ORT_INTRA_OP_THREADS is set); default splits the CPUs evenly between workers
+TORCH_THREADS_PER_WORKER = os.getenv("TORCH_THREADS_PER_WORKER", "")
+
+def torch_threads_for(workers):
+    if TORCH_THREADS_PER_WORKER:
+        return max(1, int(TORCH_THREADS_PER_WORKER))
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+def prepare_master(app):
+    """Runs once in the gunicorn master, after create_app() and before the first fork."""
+    from app.services.job_service import fail_interrupted_jobs, release_queued_jobs
+    # Tokenizer thread pools started before fork deadlock in the children
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+
+    # No worker exists yet, so anything still 'running' was interrupted and
+    # every queued job is up for adoption
+    with startup.timed("phase", "recover_jobs"):
+        fail_interrupted_jobs(app)
+        release_queued_jobs(app)
+
+    # Synchronously: a background loader thread would not survive the fork
+    model_registry.warm_up(PRELOAD_MODELS, background=False)
+
+    # Move everything allocated so far out of the collector's reach; otherwise
+    # the first GC pass in each worker touches (and copies) every shared page
+    gc.freeze()
+
+def configure_worker(app, workers):
+    """Runs in each worker right after fork."""
+    from app.model import db
+    from app.services import onnx_backend
+    from app.services.job_service import requeue_pending_jobs
+
+    threads = torch_threads_for(workers)
+    if "torch" in sys.modules:
+        import torch
+        torch.set_num_threads(threads)
+    # Inherited ONNX sessions are dropped below and re-created with this setting
+    onnx_backend.set_intra_op_threads(threads)
+
+    # Pooled SQLite connections belong to the master
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+    dropped = model_registry.reset_after_fork()
+    preload = set(model_registry._parse_selection(PRELOAD_MODELS))
+    for name in dropped:
+        if name in preload:
+            model_registry.get(name)
+
+    # Jobs released by the master or an exited worker; each row is adopted by one worker only
+    requeue_pending_jobs(app, unowned_only=True)
+
+def stop_worker(app):
+    """Runs in a worker that is exiting (recycled or shut down)."""
+    from app.services.job_service import shutdown_executors
+    shutdown_executors(app)
+
+def recover_worker_jobs(app, pid):
+    """Runs in the master after worker `pid` exited, however it ended."""
+    from app.services.job_service import fail_interrupted_jobs, release_queued_jobs
+    failed = fail_interrupted_jobs(app, owner_pid=pid)
+    released = release_queued_jobs(app, owner_pid=pid)
+    if failed or released:
+        print(f"Worker {pid} exited: {failed} running job(s) failed, {released} queued job(s) released")
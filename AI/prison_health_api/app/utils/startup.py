@@ -0,0 +1,49 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Startup timing: how long the process spent importing modules / libraries
+# and loading models, served by GET /api/health/startup.
+
+_process_started = time.time()
+_lock = threading.Lock()
+_timings = {"import": {}, "model": {}, "phase": {}}
+
+def _process_start_time():
+    """Wall-clock start of this process (from /proc on Linux), else when this module was imported."""
+    try:
+        with open(f"/proc/{os.getpid()}/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except Exception:
+        return _process_started
+
+def record(kind, name, seconds):
+    with _lock:
+        _timings[kind][name] = round(seconds, 4)
+
+@contextmanager
+def timed(kind, name):
+    """Times the block as `kind` ('import', 'model' or 'phase') under `name`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(kind, name, time.perf_counter() - started)
+
+def report():
+    with _lock:
+        timings = {kind: dict(values) for kind, values in _timings.items()}
+    started = _process_start_time()
+    return {
+        "pid": os.getpid(),
+        "process_started_at": started,
+        "uptime_s": round(time.time() - started, 3),
+        "imports": dict(sorted(timings["import"].items(), key=lambda kv: -kv[1])),
+        "models": dict(sorted(timings["model"].items(), key=lambda kv: -kv[1])),
+        "phases": timings["phase"],
+        "totals": {kind: round(sum(values.values()), 3) for kind, values in timings.items()}
+    }
@@ -0,0 +1,177 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from app.utils import metrics
+
+# Media uploads without the save-to-uploads/<client filename>-then-reread
+# round trip. Images and audio are read once from the request stream into
+# memory and decoded from there; videos, which OpenCV can only open from a
+# path, are streamed to a uniquely named temp file that is always removed.
+# Every kind has a size limit, and the bytes currently held are exported as
+# upload_bytes_in_flight{kind}.
+#
+# The per-kind checks only run once werkzeug has parsed the multipart body
+# (into its own spooled temp file), so init_app also caps the whole request
+# at UPLOAD_MAX_REQUEST_BYTES: anything larger is refused with a 413 while
+# it is being received, and the body of a request being parsed counts as
+# upload_bytes_in_flight{kind="request_body"}.
+
+UPLOAD_LIMITS = {
+    "image": int(os.getenv("UPLOAD_MAX_IMAGE_BYTES", str(20 * 1024 * 1024))),
+    "audio": int(os.getenv("UPLOAD_MAX_AUDIO_BYTES", str(50 * 1024 * 1024))),
+    "video": int(os.getenv("UPLOAD_MAX_VIDEO_BYTES", str(500 * 1024 * 1024))),
+}
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", "uploads")
+# Largest upload plus room for the other form fields and multipart framing
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(max(UPLOAD_LIMITS.values()) + 1024 * 1024)))
+# Non-file form fields held in memory (the form's text parts)
+UPLOAD_MAX_FORM_MEMORY_BYTES = int(os.getenv("UPLOAD_MAX_FORM_MEMORY_BYTES", str(1024 * 1024)))
+
+_COPY_CHUNK = 1024 * 1024
+
+BYTES_IN_FLIGHT = metrics.gauge("upload_bytes_in_flight", "Upload bytes currently held in memory or spooled to disk.", ("kind",))
+UPLOADS = metrics.counter("uploads_total", "Media uploads by kind and outcome.", ("kind", "status"))
+UPLOAD_BYTES = metrics.counter("upload_bytes_total", "Media upload bytes accepted.", ("kind",))
+
+class UploadError(ValueError):
+    """Unusable upload; `status` is the HTTP status to answer with."""
+    status = 400
+
+class UploadTooLarge(UploadError):
+    status = 413
+
+def _limit(kind):
+    return UPLOAD_LIMITS.get(kind, UPLOAD_LIMITS["video"])
+
+def _too_large(kind):
+    UPLOADS.inc(kind=kind, status="too_large")
+    return UploadTooLarge(f"{kind} upload exceeds the {_limit(kind) // (1024 * 1024)} MB limit")
+
+class InMemoryUpload:
+    """An upload's bytes plus decoders that work on them directly."""
+
+    def __init__(self, filename, data, kind):
+        self.filename = filename
+        self.data = data
+        self.kind = kind
+
+    def __len__(self):
+        return len(self.data)
+
+    def bgr(self):
+        """Decoded with cv2.imdecode (BGR uint8). Raises UploadError."""
+        import cv2
+        import numpy as np
+        frame = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise UploadError(f"{self.filename or 'upload'} is not a readable image")
+        return frame
+
+    def pil(self):
+        import io
+        from PIL import Image
+        try:
+            image = Image.open(io.BytesIO(self.data))
+            image.load()
+        except Exception as e:
+            raise UploadError(f"{self.filename or 'upload'} is not a readable image: {e}")
+        return image
+
+@contextmanager
+def in_memory(file_storage, kind):
+    """
+    Reads `file_storage` (a werkzeug FileStorage) into memory, enforcing the
+    limit for `kind`. Yields an InMemoryUpload; its bytes count as in flight
+    until the block exits.
+    """
+    limit = _limit(kind)
+    data = file_storage.stream.read(limit + 1)
+    if len(data) > limit:
+        raise _too_large(kind)
+    if not data:
+        UPLOADS.inc(kind=kind, status="empty")
+        raise UploadError(f"{file_storage.filename or 'upload'} is empty")
+    UPLOADS.inc(kind=kind, status="ok")
+    UPLOAD_BYTES.inc(len(data), kind=kind)
+    BYTES_IN_FLIGHT.inc(len(data), kind=kind)
+    try:
+        yield InMemoryUpload(file_storage.filename, data, kind)
+    finally:
+        BYTES_IN_FLIGHT.dec(len(data), kind=kind)
+
+def _copy_limited(file_storage, out, kind):
+    limit = _limit(kind)
+    written = 0
+    while True:
+        chunk = file_storage.stream.read(_COPY_CHUNK)
+        if not chunk:
+            return written
+        written += len(chunk)
+        if written > limit:
+            raise _too_large(kind)
+        out.write(chunk)
+
+def save_upload(file_storage, path, kind):
+    """Streams the upload to `path` (e.g. for a queued job that outlives the request). Returns its size."""
+    try:
+        with open(path, "wb") as out:
+            written = _copy_limited(file_storage, out, kind)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    UPLOADS.inc(kind=kind, status="ok")
+    UPLOAD_BYTES.inc(written, kind=kind)
+    return written
+
+@contextmanager
+def spooled(file_storage, kind="video"):
+    """
+    Streams the upload to a unique temp file in UPLOAD_SPOOL_DIR (keeping the
+    client's extension so containers are recognized) and yields its path.
+    The file is removed when the block exits, whatever happens inside it.
+    """
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    suffix = os.path.splitext(os.path.basename(file_storage.filename or ""))[1][:16]
+    fd, path = tempfile.mkstemp(prefix=f"{kind}_", suffix=suffix, dir=UPLOAD_SPOOL_DIR)
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            written = _copy_limited(file_storage, out, kind)
+        UPLOADS.inc(kind=kind, status="ok")
+        UPLOAD_BYTES.inc(written, kind=kind)
+        BYTES_IN_FLIGHT.inc(written, kind=kind)
+        try:
+            yield path
+        finally:
+            BYTES_IN_FLIGHT.dec(written, kind=kind)
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+def init_app(app):
+    """Request size cap at ingress, JSON 413s and in-flight accounting of request bodies."""
+    from flask import g, jsonify, request
+    from werkzeug.exceptions import RequestEntityTooLarge
+
+    app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_REQUEST_BYTES
+    app.config['MAX_FORM_MEMORY_SIZE'] = UPLOAD_MAX_FORM_MEMORY_BYTES
+
+    @app.errorhandler(RequestEntityTooLarge)
+    def _too_large_request(_e):
+        UPLOADS.inc(kind="request_body", status="too_large")
+        return jsonify({"error": f"Request exceeds the {UPLOAD_MAX_REQUEST_BYTES // (1024 * 1024)} MB limit"}), 413
+
+    @app.before_request
+    def _track_body():
+        # Bodies over the cap are refused when the view first reads them
+        size = request.content_length or 0
+        if size and request.mimetype == "multipart/form-data":
+            g._upload_body_bytes = size
+            BYTES_IN_FLIGHT.inc(size, kind="request_body")
+
+    @app.teardown_request
+    def _release_body(_exc=None):
+        size = g.pop('_upload_body_bytes', 0)
+        if size:
+            BYTES_IN_FLIGHT.dec(size, kind="request_body")
@@ -0,0 +1,175 @@
+"""
+Lookup latency of the hot SQL queries with and without the 0002 indexes.
+
+Builds a throwaway SQLite database with the baseline schema, fills it with
+synthetic inmates and log rows (generated inside SQLite, so 10M rows take
+minutes, not hours), times the queries the routes run, then adds the
+indexes from migrations/versions/0002_lookup_indexes.py and times them again.
+
+    python benchmarks/db_lookup_bench.py [--inmates 100000] [--log-rows 10000000]
+                                         [--queries 200] [--db /tmp/lookup.db] [--out results.json]
+
+Log rows are split across emotion_logs (50%), survey_answers (40%) and
+health_profile_logs (10%). Full scans are slow, so the unindexed pass runs
+at most --scan-queries queries per lookup.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from benchmarks.stage_bench import summarize, environment  # noqa: E402
+
+SCHEMA = """
+CREATE TABLE inmates (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, nic VARCHAR(20), address VARCHAR(200),
+                      tel_no VARCHAR(20), crime_details TEXT, age INTEGER, gender VARCHAR(20), visual_emotion VARCHAR(50),
+                      ocr_prescription TEXT, final_llm_report TEXT);
+CREATE TABLE emotion_logs (id INTEGER PRIMARY KEY, inmate_id INTEGER NOT NULL REFERENCES inmates(id),
+                           predicted_emotion VARCHAR(50) NOT NULL, confidence_score FLOAT, timestamp DATETIME);
+CREATE TABLE survey_answers (id INTEGER PRIMARY KEY, inmate_id INTEGER NOT NULL REFERENCES inmates(id),
+                             question_text VARCHAR(500) NOT NULL, answer_text VARCHAR(500) NOT NULL,
+                             voice_emotion VARCHAR(50), timestamp DATETIME);
+CREATE TABLE health_profile_logs (id INTEGER PRIMARY KEY, inmate_id INTEGER NOT NULL REFERENCES inmates(id),
+                                  risk_level VARCHAR(50), suspected_conditions TEXT, recommended_actions TEXT,
+                                  urgent_alert BOOLEAN, reasoning TEXT, progress_indicator VARCHAR(50), timestamp DATETIME);
+"""
+
+# Same indexes as migration 0002
+INDEXES = [
+    "CREATE INDEX ix_inmates_name ON inmates (name)",
+    "CREATE UNIQUE INDEX ix_inmates_nic ON inmates (nic)",
+    "CREATE INDEX ix_emotion_logs_inmate_id_timestamp ON emotion_logs (inmate_id, timestamp)",
+    "CREATE INDEX ix_survey_answers_inmate_id_timestamp ON survey_answers (inmate_id, timestamp)",
+    "CREATE INDEX ix_health_profile_logs_inmate_id_timestamp ON health_profile_logs (inmate_id, timestamp)",
+]
+
+# The statements SQLAlchemy emits for the routes' filter_by(...).first() / order_by(...).limit(...)
+QUERIES = {
+    "inmate_by_name": "SELECT * FROM inmates WHERE name = ? LIMIT 1",
+    "inmate_by_nic": "SELECT * FROM inmates WHERE nic = ? LIMIT 1",
+    "recent_emotions": "SELECT * FROM emotion_logs WHERE inmate_id = ? ORDER BY timestamp DESC LIMIT 5",
+    "recent_answers": "SELECT * FROM survey_answers WHERE inmate_id = ? ORDER BY timestamp DESC LIMIT 10",
+    "profile_history": "SELECT * FROM health_profile_logs WHERE inmate_id = ? ORDER BY timestamp DESC LIMIT 4",
+}
+
+def _fill_logs(conn, table, columns, values_sql, rows, inmates):
+    # Random inmate per row, timestamps spread over ~2 years
+    conn.execute(f"""
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {rows})
+        INSERT INTO {table} (inmate_id, {columns}, timestamp)
+        SELECT abs(random()) % {inmates} + 1, {values_sql},
+               datetime('2024-01-01', '+' || (abs(random()) % 63072000) || ' seconds')
+        FROM seq
+    """)
+
+def build_database(path, inmates, log_rows):
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.executescript("PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;" + SCHEMA)
+    timings = {}
+
+    started = time.perf_counter()
+    conn.execute(f"""
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {inmates})
+        INSERT INTO inmates (id, name, nic, age, gender, crime_details)
+        SELECT n, 'inmate_' || n, CASE WHEN n % 10 = 0 THEN NULL ELSE printf('%09dV', n) END,
+               18 + n % 60, CASE WHEN n % 2 THEN 'male' ELSE 'female' END, 'Synthetic record'
+        FROM seq
+    """)
+    timings["inmates_s"] = time.perf_counter() - started
+
+    split = {"emotion_logs": 0.5, "survey_answers": 0.4, "health_profile_logs": 0.1}
+    started = time.perf_counter()
+    _fill_logs(conn, "emotion_logs", "predicted_emotion, confidence_score",
+               "CASE abs(random()) % 4 WHEN 0 THEN 'Sad' WHEN 1 THEN 'Neutral' WHEN 2 THEN 'Angry' ELSE 'Happy' END, 0.8",
+               int(log_rows * split["emotion_logs"]), inmates)
+    _fill_logs(conn, "survey_answers", "question_text, answer_text, voice_emotion",
+               "'Little interest or pleasure in doing things?', 'Several days', 'neutral'",
+               int(log_rows * split["survey_answers"]), inmates)
+    _fill_logs(conn, "health_profile_logs", "risk_level, urgent_alert, progress_indicator",
+               "'Medium', 0, 'Stable'", int(log_rows * split["health_profile_logs"]), inmates)
+    conn.commit()
+    timings["logs_s"] = time.perf_counter() - started
+    return conn, {k: round(v, 2) for k, v in timings.items()}
+
+def _params(name, rng, inmates, count):
+    ids = [rng.randint(1, inmates) for _ in range(count)]
+    if name == "inmate_by_name":
+        return [(f"inmate_{i}",) for i in ids]
+    if name == "inmate_by_nic":
+        return [(f"{i:09d}V",) for i in ids]
+    return [(i,) for i in ids]
+
+def run_queries(conn, rng, inmates, count):
+    results = {}
+    for name, sql in QUERIES.items():
+        params = _params(name, rng, inmates, count)
+        plan = " | ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params[0]))
+        latencies = []
+        for p in params:
+            started = time.perf_counter()
+            conn.execute(sql, p).fetchall()
+            latencies.append(time.perf_counter() - started)
+        results[name] = summarize(latencies) | {"plan": plan}
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Inmate / log lookup latency with and without indexes")
+    parser.add_argument("--inmates", type=int, default=100_000)
+    parser.add_argument("--log-rows", type=int, default=10_000_000)
+    parser.add_argument("--queries", type=int, default=200, help="queries per lookup with indexes")
+    parser.add_argument("--scan-queries", type=int, default=10, help="queries per lookup without indexes")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--db", help="database path (default: a temp file, removed afterwards)")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix="db_lookup_bench_"), "lookup.db")
+    rng = random.Random(args.seed)
+    print(f"[db_lookup_bench] building {args.inmates} inmates / {args.log_rows} log rows in {path}", file=sys.stderr)
+    conn, build = build_database(path, args.inmates, args.log_rows)
+
+    print("[db_lookup_bench] timing without indexes...", file=sys.stderr)
+    before = run_queries(conn, rng, args.inmates, args.scan_queries)
+
+    started = time.perf_counter()
+    for ddl in INDEXES:
+        conn.execute(ddl)
+    conn.execute("ANALYZE")
+    conn.commit()
+    index_build_s = time.perf_counter() - started
+
+    print("[db_lookup_bench] timing with indexes...", file=sys.stderr)
+    after = run_queries(conn, rng, args.inmates, args.queries)
+    conn.close()
+
+    report = {
+        "environment": environment() | {"sqlite": sqlite3.sqlite_version},
+        "inmates": args.inmates,
+        "log_rows": args.log_rows,
+        "build_s": build,
+        "index_build_s": round(index_build_s, 2),
+        "db_size_mb": round(os.path.getsize(path) / (1024 * 1024), 1),
+        "without_indexes": before,
+        "with_indexes": after,
+        "p50_speedup": {name: round(before[name]["p50_ms"] / max(after[name]["p50_ms"], 1e-6), 1) for name in QUERIES}
+    }
+    if not args.db:
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Load test of the production server: starts gunicorn (gunicorn.conf.py,
+wsgi:app) once per worker count, drives it with a fixed number of
+closed-loop clients and reports throughput and latency, so the scaling
+from 1 to N workers can be read off directly.
+
+    python benchmarks/load_test.py [--workers 1,2,4] [--threads 4]
+                                   [--scenario image|list|live] [--clients 16]
+                                   [--duration 30] [--out results.json]
+
+Scenarios:
+    image  POST /api/inmate/analyze_initial_image with a synthetic photo
+           (gender + emotion models, CPU bound). Registers / reuses the
+           inmate "Load Test Inmate" in the configured database.
+    list   GET /api/inmate/all?limit=50 (database bound)
+    live   GET /api/health/live (server overhead only)
+
+Prints one JSON document: environment, then per worker count the successful
+request count, errors, p50/p95/p99/mean latency (ms), throughput (req/s) and
+the speedup over the first worker count.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import requests
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from benchmarks.stage_bench import summarize, environment
+
+LOAD_TEST_INMATE = "Load Test Inmate"
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def make_photo(rng, size=(480, 640)):
+    """JPEG bytes of a noisy image with a face-like blob, enough to exercise both models."""
+    import cv2
+    h, w = size
+    image = rng.integers(40, 90, size=(h, w, 3), dtype=np.uint8)
+    cv2.ellipse(image, (w // 2, h // 2), (w // 6, h // 4), 0, 0, 360, (150, 170, 200), -1)
+    ok, encoded = cv2.imencode(".jpg", image)
+    if not ok:
+        raise RuntimeError("Could not encode the test image")
+    return encoded.tobytes()
+
+class Server:
+    """One gunicorn instance on a free port; logs go to a file in `workdir`."""
+
+    def __init__(self, workers, threads, workdir, ready_timeout):
+        self.port = _free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.log_path = os.path.join(workdir, f"gunicorn_{workers}w.log")
+        env = dict(os.environ, GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(threads), PORT=str(self.port),
+                   # Recycling mid-run would show up as latency spikes
+                   GUNICORN_MAX_REQUESTS="0")
+        self._log = open(self.log_path, "w")
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "--config", "gunicorn.conf.py", "--bind", f"127.0.0.1:{self.port}", "wsgi:app"],
+            cwd=ROOT, env=env, stdout=self._log, stderr=subprocess.STDOUT
+        )
+        self._wait_ready(ready_timeout)
+
+    def _wait_ready(self, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with {self.process.returncode}, see {self.log_path}")
+            try:
+                if requests.get(f"{self.base_url}/api/health/ready", timeout=2).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.5)
+        self.stop()
+        raise RuntimeError(f"gunicorn not ready after {timeout}s, see {self.log_path}")
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.send_signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self._log.close()
+
+def _scenario_request(scenario, base_url, photo):
+    """Returns a callable(session) -> status code for one request of the scenario."""
+    if scenario == "image":
+        url = f"{base_url}/api/inmate/analyze_initial_image"
+        return lambda session: session.post(url, files={"image": ("load_test.jpg", photo, "image/jpeg")},
+                                            data={"Username": LOAD_TEST_INMATE}, timeout=300).status_code
+    if scenario == "list":
+        url = f"{base_url}/api/inmate/all?limit=50"
+        return lambda session: session.get(url, timeout=60).status_code
+    url = f"{base_url}/api/health/live"
+    return lambda session: session.get(url, timeout=60).status_code
+
+def _prepare(scenario, base_url):
+    if scenario == "image":
+        response = requests.post(f"{base_url}/api/inmate/register", timeout=60,
+                                 json={"name": LOAD_TEST_INMATE, "gender": "Male", "age": 30})
+        response.raise_for_status()
+
+def run_load(call, clients, duration, warmup):
+    """Closed loop: `clients` threads issue requests back to back for `duration` seconds after `warmup`."""
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    start = time.perf_counter() + warmup
+    stop = start + duration
+
+    def client():
+        session = requests.Session()
+        while True:
+            began = time.perf_counter()
+            if began >= stop:
+                return
+            try:
+                status = call(session)
+            except requests.RequestException as e:
+                status = type(e).__name__
+            ended = time.perf_counter()
+            # Requests that started during the warm-up are not counted
+            if began < start:
+                continue
+            with lock:
+                if status == 200:
+                    latencies.append(ended - began)
+                else:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+
+    threads = [threading.Thread(target=client, name=f"client-{i}", daemon=True) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput of the gunicorn deployment by worker count")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    parser.add_argument("--threads", type=int, default=4, help="gunicorn threads per worker")
+    parser.add_argument("--scenario", choices=("image", "list", "live"), default="image")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent closed-loop clients")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds per worker count")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds before each run")
+    parser.add_argument("--ready-timeout", type=float, default=600.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    worker_counts = [int(w) for w in args.workers.split(",") if w.strip()]
+    photo = make_photo(np.random.default_rng(args.seed)) if args.scenario == "image" else None
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+
+    runs = []
+    baseline = None
+    for workers in worker_counts:
+        print(f"Starting gunicorn with {workers} worker(s) x {args.threads} thread(s)...", file=sys.stderr)
+        server = Server(workers, args.threads, workdir, args.ready_timeout)
+        try:
+            _prepare(args.scenario, server.base_url)
+            latencies, errors = run_load(_scenario_request(args.scenario, server.base_url, photo),
+                                         args.clients, args.duration, args.warmup)
+        finally:
+            server.stop()
+        # Throughput over the wall-clock window, not the summed latencies
+        run = {"workers": workers, "threads": args.threads, "errors": errors,
+               **summarize(latencies, total_s=args.duration), "log": server.log_path}
+        throughput = run.get("throughput_per_s") or 0.0
+        if baseline is None:
+            baseline = throughput or None
+        run["speedup"] = round(throughput / baseline, 3) if baseline else None
+        runs.append(run)
+        print(f"  {workers} worker(s): {throughput} req/s, speedup {run['speedup']}", file=sys.stderr)
+
+    report = {"environment": environment(), "scenario": args.scenario, "clients": args.clients,
+              "duration_s": args.duration, "runs": runs}
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Parity check between the PyTorch and ONNX Runtime backends.
+
+Runs the same fixed, seeded sample set through both backends of each model
+and reports top-1 label agreement, mean absolute probability difference and
+the latency / throughput delta as JSON. "voice_batch" instead compares the
+voice model's batched, length-bucketed inference (as used by
+analyze_voice_emotions_batch) with one window at a time, on the active backend.
+
+    python -m app.services.onnx_backend export     # once
+    python benchmarks/onnx_parity.py [--models voice,voice_batch,gender,emotion] [--samples 32]
+                                     [--audio-dir DIR] [--image-dir DIR] [--out parity.json]
+
+Without --audio-dir / --image-dir synthetic inputs are used (seeded), which
+is enough for numerical parity; pass real samples to check label agreement
+on realistic data.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.services import model_registry, onnx_backend  # noqa: E402
+
+SAMPLE_RATE = 16000
+
+def _softmax(logits):
+    logits = np.asarray(logits, dtype=np.float64)
+    e = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+def _timed(fn, samples, warmup=2):
+    for sample in samples[:warmup]:
+        fn(sample)
+    outputs, latencies = [], []
+    started = time.perf_counter()
+    for sample in samples:
+        t0 = time.perf_counter()
+        outputs.append(fn(sample))
+        latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - started
+    return outputs, {
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 95) * 1000, 3),
+        "throughput_per_s": round(len(samples) / total, 3) if total else None
+    }
+
+def _compare(name, labels, torch_fn, onnx_fn, samples):
+    torch_probs, torch_stats = _timed(torch_fn, samples)
+    onnx_probs, onnx_stats = _timed(onnx_fn, samples)
+    torch_probs, onnx_probs = np.stack(torch_probs), np.stack(onnx_probs)
+    torch_top, onnx_top = torch_probs.argmax(-1), onnx_probs.argmax(-1)
+    disagreements = [{"sample": i, "torch": labels[int(torch_top[i])], "onnx": labels[int(onnx_top[i])]}
+                     for i in np.flatnonzero(torch_top != onnx_top)]
+    return {
+        "model": name,
+        "samples": len(samples),
+        "label_agreement": round(float((torch_top == onnx_top).mean()), 4),
+        "mean_abs_prob_diff": round(float(np.abs(torch_probs - onnx_probs).mean()), 6),
+        "max_abs_prob_diff": round(float(np.abs(torch_probs - onnx_probs).max()), 6),
+        "torch": torch_stats,
+        "onnx": onnx_stats,
+        "p50_speedup": round(torch_stats["p50_ms"] / onnx_stats["p50_ms"], 3) if onnx_stats["p50_ms"] else None,
+        "throughput_delta_pct": round(100 * (onnx_stats["throughput_per_s"] / torch_stats["throughput_per_s"] - 1), 1),
+        "disagreements": disagreements[:20]
+    }
+
+# --- Sample sets ---
+
+def voice_samples(count, seed, audio_dir=None):
+    if audio_dir:
+        from app.services.audio_frontend import prepare_voice_windows
+        paths = sorted(glob.glob(os.path.join(audio_dir, '*')))[:count]
+        windows = [prepare_voice_windows(p, SAMPLE_RATE) for p in paths]
+        return [w[0] for w in windows if w]
+    rng = np.random.default_rng(seed)
+    samples = []
+    for _ in range(count):
+        seconds = rng.uniform(1.0, 6.0)
+        t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+        # Voice-like: a few harmonics with a wandering pitch plus noise
+        pitch = rng.uniform(90, 260) * (1 + 0.05 * np.sin(2 * np.pi * rng.uniform(0.5, 3) * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+        wave = sum(np.sin(k * phase) / k for k in range(1, 6))
+        wave = wave * (0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(2, 5) * t) ** 2) + 0.05 * rng.standard_normal(len(t))
+        samples.append((0.3 * wave / np.abs(wave).max()).astype(np.float32))
+    return samples
+
+def image_samples(count, seed, image_dir=None, size=224):
+    from PIL import Image
+    if image_dir:
+        paths = sorted(glob.glob(os.path.join(image_dir, '*')))[:count]
+        return [Image.open(p).convert("RGB") for p in paths]
+    rng = np.random.default_rng(seed)
+    samples = []
+    for _ in range(count):
+        # Smooth blobs rather than white noise, closer to natural image statistics
+        low = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        samples.append(Image.fromarray(low).resize((size, size), Image.BICUBIC))
+    return samples
+
+# --- Per-model runners ---
+
+def parity_voice(samples):
+    import torch
+    torch_model, feature_extractor = model_registry._load_voice_model_torch()
+    onnx_path = onnx_backend.voice_model_path()
+    if onnx_path is None:
+        return {"model": "voice", "error": "no exported ONNX model"}
+    onnx_model = onnx_backend.OnnxVoiceModel(onnx_path, torch_model.config)
+
+    def runner(model):
+        def run(speech):
+            inputs = feature_extractor(speech, sampling_rate=SAMPLE_RATE, return_tensors="pt", padding=True)
+            with torch.no_grad():
+                return _softmax(model(**inputs).logits[0].numpy())
+        return run
+
+    labels = torch_model.config.id2label
+    result = _compare("voice", labels, runner(torch_model), runner(onnx_model), samples)
+    result["onnx_file"] = os.path.basename(onnx_path)
+    return result
+
+def parity_voice_batching(samples):
+    from app.services.analysis_pipeline import (voice_logits_local, _length_buckets,
+                                                VOICE_BATCH_SIZE, VOICE_BUCKET_RATIO)
+
+    def run_single(speech):
+        logits, _ = voice_logits_local([speech])
+        return logits[0]
+
+    single_logits, single_stats = _timed(run_single, samples)
+    batched_logits = [None] * len(samples)
+    labels = None
+    started = time.perf_counter()
+    for bucket in _length_buckets([len(s) for s in samples], VOICE_BATCH_SIZE, VOICE_BUCKET_RATIO):
+        logits, labels = voice_logits_local([samples[b] for b in bucket])
+        for row, b in enumerate(bucket):
+            batched_logits[b] = logits[row]
+    batched_s = time.perf_counter() - started
+
+    single_logits, batched_logits = np.stack(single_logits), np.stack(batched_logits)
+    single, batched = _softmax(single_logits), _softmax(batched_logits)
+    single_top, batched_top = single.argmax(-1), batched.argmax(-1)
+    return {
+        "model": "voice_batch",
+        "samples": len(samples),
+        "bucket_ratio": VOICE_BUCKET_RATIO,
+        "label_agreement": round(float((single_top == batched_top).mean()), 4),
+        "mean_abs_prob_diff": round(float(np.abs(single - batched).mean()), 6),
+        "max_abs_prob_diff": round(float(np.abs(single - batched).max()), 6),
+        # Zero padding shifts GroupNorm statistics; relative to the spread of the logits themselves
+        "max_abs_logit_diff": round(float(np.abs(single_logits - batched_logits).max()), 6),
+        "logit_std": round(float(single_logits.std()), 6),
+        "single": single_stats,
+        "batched": {"throughput_per_s": round(len(samples) / batched_s, 3) if batched_s else None},
+        "disagreements": [{"sample": int(i), "single": labels[int(single_top[i])], "batched": labels[int(batched_top[i])]}
+                          for i in np.flatnonzero(single_top != batched_top)][:20]
+    }
+
+def parity_gender(samples):
+    import torch
+    from transformers import AutoModelForImageClassification, AutoImageProcessor
+    onnx_path = onnx_backend.gender_model_path()
+    if onnx_path is None:
+        return {"model": "gender", "error": "no exported ONNX model"}
+    torch_model = AutoModelForImageClassification.from_pretrained(model_registry.GENDER_MODEL_NAME).eval()
+    processor = AutoImageProcessor.from_pretrained(model_registry.GENDER_MODEL_NAME)
+    session = onnx_backend.create_session(onnx_path)
+
+    def run_torch(image):
+        with torch.no_grad():
+            pixel_values = processor(images=image, return_tensors="pt")["pixel_values"]
+            return _softmax(torch_model(pixel_values=pixel_values).logits[0].numpy())
+
+    def run_onnx(image):
+        pixel_values = processor(images=image, return_tensors="np")["pixel_values"].astype(np.float32)
+        return _softmax(session.run(["logits"], {"pixel_values": pixel_values})[0][0])
+
+    result = _compare("gender", torch_model.config.id2label, run_torch, run_onnx, samples)
+    result["onnx_file"] = os.path.basename(onnx_path)
+    return result
+
+def parity_emotion(samples):
+    from ultralytics import YOLO
+    onnx_path = onnx_backend.yolo_model_path("emotion")
+    if onnx_path is None:
+        return {"model": "emotion", "error": "no exported ONNX model"}
+    torch_model = YOLO("app/models/best_new.pt")
+    onnx_model = YOLO(onnx_path, task="classify")
+
+    def runner(model):
+        def run(image):
+            frame = np.asarray(image)[:, :, ::-1].copy() # PIL RGB -> OpenCV BGR
+            return model(frame, verbose=False)[0].probs.data.cpu().numpy().astype(np.float64)
+        return run
+
+    result = _compare("emotion", torch_model.names, runner(torch_model), runner(onnx_model), samples)
+    result["onnx_file"] = os.path.basename(onnx_path)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="PyTorch vs ONNX Runtime parity")
+    parser.add_argument("--models", default="voice,gender,emotion")
+    parser.add_argument("--samples", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--audio-dir")
+    parser.add_argument("--image-dir")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    selected = [m.strip() for m in args.models.split(",") if m.strip()]
+    report = {
+        "seed": args.seed,
+        "ort_intra_op_threads": onnx_backend.ORT_INTRA_OP_THREADS,
+        "ort_inter_op_threads": onnx_backend.ORT_INTER_OP_THREADS,
+        "int8": onnx_backend.ONNX_USE_INT8,
+        "results": []
+    }
+    images = None
+    for name in selected:
+        try:
+            if name == "voice":
+                report["results"].append(parity_voice(voice_samples(args.samples, args.seed, args.audio_dir)))
+            elif name == "voice_batch":
+                report["results"].append(parity_voice_batching(voice_samples(args.samples, args.seed, args.audio_dir)))
+            elif name in ("gender", "emotion"):
+                if images is None:
+                    images = image_samples(args.samples, args.seed, args.image_dir)
+                runner = parity_gender if name == "gender" else parity_emotion
+                report["results"].append(runner(images))
+            else:
+                report["results"].append({"model": name, "error": "unknown model"})
+        except Exception as e:
+            report["results"].append({"model": name, "error": str(e)})
+
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
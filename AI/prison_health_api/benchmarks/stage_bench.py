@@ -0,0 +1,486 @@
+"""
+Per-stage benchmark of the analysis pipeline on synthetic inputs.
+
+Generates video clips with a moving person-shaped figure, WAV answers of
+varying length, prescription-like images and multi-page PDFs, then times
+every stage on its own. The LLM and Ollama are replaced by local stubs
+(benchmarks/stubs.py) and retrieval runs against a throwaway Chroma
+collection, so nothing outside this process is touched.
+
+    python benchmarks/stage_bench.py [--stages video_decode,person_detection,...]
+                                     [--repeat 3] [--quick] [--out results.json]
+
+Prints one JSON document: environment, then per stage the sample count,
+p50/p95/p99/mean latency (ms) and throughput (items per second).
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+STAGES = [
+    "video_decode", "person_detection", "emotion_classification", "gender_classification",
+    "voice_frontend", "voice_features", "voice_forward", "ocr_request", "ocr_stream",
+    "pdf_parse_split", "pdf_embed", "chroma_retrieval", "prompt_assembly", "llm_call"
+]
+
+# --- Statistics ---
+
+def summarize(latencies, items=None, total_s=None):
+    """p50/p95/p99/mean in ms plus throughput; `items` counts work units (frames, chunks...) if not one per call."""
+    values = np.asarray(latencies, dtype=np.float64)
+    if values.size == 0:
+        return {"count": 0}
+    total_s = float(values.sum()) if total_s is None else total_s
+    items = int(values.size) if items is None else items
+    return {
+        "count": int(values.size),
+        "items": items,
+        "p50_ms": round(float(np.percentile(values, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(values, 95)) * 1000, 3),
+        "p99_ms": round(float(np.percentile(values, 99)) * 1000, 3),
+        "mean_ms": round(float(values.mean()) * 1000, 3),
+        "total_s": round(total_s, 4),
+        "throughput_per_s": round(items / total_s, 3) if total_s > 0 else None
+    }
+
+def time_calls(fn, inputs, repeat=1, warmup=1):
+    """Calls fn(x) for every input `repeat` times (after `warmup` untimed calls). Returns (latencies, last outputs)."""
+    for x in inputs[:warmup]:
+        fn(x)
+    latencies, outputs = [], []
+    for _ in range(repeat):
+        outputs = []
+        for x in inputs:
+            started = time.perf_counter()
+            outputs.append(fn(x))
+            latencies.append(time.perf_counter() - started)
+    return latencies, outputs
+
+# --- Synthetic inputs ---
+
+def make_videos(directory, rng, count, seconds=4, fps=25, size=(640, 480)):
+    """MP4 clips: noisy background with a head+torso figure drifting across the frame."""
+    import cv2
+    paths = []
+    width, height = size
+    for n in range(count):
+        path = os.path.join(directory, f"clip_{n}.mp4")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+        background = rng.integers(40, 90, size=(height, width, 3), dtype=np.uint8)
+        skin = tuple(int(c) for c in rng.integers(90, 220, size=3))
+        shirt = tuple(int(c) for c in rng.integers(0, 255, size=3))
+        for i in range(int(seconds * fps)):
+            frame = background.copy()
+            cx = int(width * (0.3 + 0.4 * i / (seconds * fps)))
+            cv2.rectangle(frame, (cx - 70, 200), (cx + 70, height), shirt, -1) # torso
+            cv2.ellipse(frame, (cx, 140), (45, 60), 0, 0, 360, skin, -1) # head
+            cv2.circle(frame, (cx - 16, 125), 6, (30, 30, 30), -1)
+            cv2.circle(frame, (cx + 16, 125), 6, (30, 30, 30), -1)
+            cv2.ellipse(frame, (cx, 170), (18, 8), 0, 0, 180, (40, 40, 120), 2)
+            writer.write(frame)
+        writer.release()
+        paths.append(path)
+    return paths
+
+def make_wavs(directory, rng, durations, sr=16000):
+    """16-bit mono WAVs: a voiced harmonic signal with pauses, at the given durations (s)."""
+    paths = []
+    for n, seconds in enumerate(durations):
+        t = np.arange(int(seconds * sr)) / sr
+        pitch = rng.uniform(100, 240) * (1 + 0.05 * np.sin(2 * np.pi * 1.5 * t))
+        phase = 2 * np.pi * np.cumsum(pitch) / sr
+        voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+        # Syllable-like envelope with a pause roughly every 2s
+        envelope = np.clip(np.sin(2 * np.pi * 3 * t), 0, None) * (np.sin(2 * np.pi * 0.5 * t) > -0.5)
+        signal = 0.3 * voiced * envelope + 0.01 * rng.standard_normal(len(t))
+        pcm = (np.clip(signal, -1, 1) * 32767).astype(np.int16)
+        path = os.path.join(directory, f"answer_{n}_{seconds:.0f}s.wav")
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(sr)
+            f.writeframes(pcm.tobytes())
+        paths.append(path)
+    return paths
+
+def make_prescription_images(directory, rng, count, size=(1240, 1754)):
+    """A4-ish scans: printed header, handwritten-looking lines, slight rotation and noise."""
+    import cv2
+    lines = ["CITY HOSPITAL - OUTPATIENT", "Name: ________  Age: 34", "Rx",
+             "Sertraline 50mg  1 - 0 - 0  x 30 days", "Quetiapine 25mg  0 - 0 - 1  x 30 days",
+             "Omeprazole 20mg  1 - 0 - 0  before meals", "Review after 4 weeks", "Dr. A. Perera  MBBS"]
+    paths = []
+    width, height = size
+    for n in range(count):
+        page = np.full((height, width, 3), 245, dtype=np.uint8)
+        for i, text in enumerate(lines):
+            font = cv2.FONT_HERSHEY_SIMPLEX if i < 2 else cv2.FONT_HERSHEY_SCRIPT_SIMPLEX
+            cv2.putText(page, text, (80, 160 + i * 150), font, 1.6, (30, 30, 60), 3, cv2.LINE_AA)
+        angle = float(rng.uniform(-3, 3))
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        page = cv2.warpAffine(page, matrix, (width, height), borderValue=(245, 245, 245))
+        page = np.clip(page.astype(np.int16) + rng.integers(-12, 12, size=page.shape), 0, 255).astype(np.uint8)
+        path = os.path.join(directory, f"prescription_{n}.jpg")
+        cv2.imwrite(path, page, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        paths.append(path)
+    return paths
+
+_WORDS = ("patient assessment depression anxiety sleep appetite medication dose review counselling "
+          "risk self-harm monitoring symptoms weekly history treatment plan referral clinician "
+          "withdrawal support interview observation mood behaviour follow-up guideline").split()
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def make_pdf(path, rng, pages, lines_per_page=45):
+    """Writes a plain multi-page text PDF (Helvetica, one content stream per page)."""
+    objects = []
+    page_ids = [3 + 2 * i for i in range(pages)]
+    font_id = 3 + 2 * pages
+    objects.append((1, "<< /Type /Catalog /Pages 2 0 R >>"))
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects.append((2, f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>"))
+    for page, pid in enumerate(page_ids):
+        text_lines = [f"Section {page + 1}.{i + 1}: " + " ".join(rng.choice(_WORDS, size=10))
+                      for i in range(lines_per_page)]
+        ops = ["BT", "/F1 10 Tf", "14 TL", "50 800 Td"]
+        ops += [f"({_pdf_escape(line)}) Tj T*" for line in text_lines]
+        ops.append("ET")
+        stream = "\n".join(ops)
+        objects.append((pid, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                             f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {pid + 1} 0 R >>"))
+        objects.append((pid + 1, f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream"))
+    objects.append((font_id, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"))
+    objects.sort()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id, body in objects:
+        offsets[obj_id] = len(out)
+        out += f"{obj_id} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for obj_id, _ in objects:
+        out += f"{offsets[obj_id]:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+    return path
+
+def make_pdfs(directory, rng, page_counts):
+    return [make_pdf(os.path.join(directory, f"record_{n}.pdf"), rng, pages) for n, pages in enumerate(page_counts)]
+
+# --- Benchmark ---
+
+class StageBench:
+    def __init__(self, workdir, rng, repeat, quick):
+        self.workdir = workdir
+        self.rng = rng
+        self.repeat = repeat
+        self.quick = quick
+        self.results = {}
+        self._cache = {}
+
+    def _once(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    # Inputs, generated lazily so a single-stage run only builds what it needs
+    def videos(self):
+        return self._once("videos", lambda: make_videos(self.workdir, self.rng, 1 if self.quick else 3))
+
+    def wavs(self):
+        durations = [2, 5, 12] if self.quick else [1, 2, 4, 8, 15, 30, 60]
+        return self._once("wavs", lambda: make_wavs(self.workdir, self.rng, durations))
+
+    def prescriptions(self):
+        return self._once("prescriptions", lambda: make_prescription_images(self.workdir, self.rng, 2 if self.quick else 5))
+
+    def pdfs(self):
+        pages = [2, 5] if self.quick else [2, 5, 10, 25]
+        return self._once("pdfs", lambda: make_pdfs(self.workdir, self.rng, pages))
+
+    def sampled_frames(self):
+        def decode():
+            from app.services.emotion_service import VIDEO_BATCH_SIZE
+            batches = []
+            for path in self.videos():
+                frames = self._decode(path)
+                batches += [frames[i:i + VIDEO_BATCH_SIZE] for i in range(0, len(frames), VIDEO_BATCH_SIZE)]
+            return batches
+        return self._once("frames", decode)
+
+    def chunks(self):
+        def parse():
+            from app.services.pdf_service import _parse_pdf
+            return [content for path in self.pdfs() for content, _ in _parse_pdf(path)[0]]
+        return self._once("chunks", parse)
+
+    def vector_store(self):
+        def build():
+            from langchain_chroma import Chroma
+            from app.services.pdf_service import get_embeddings
+            store = Chroma(collection_name="stage_bench", embedding_function=get_embeddings(),
+                           persist_directory=os.path.join(self.workdir, "chroma"))
+            texts = self.chunks()
+            store.add_texts(texts, metadatas=[{"source": "bench", "inmate_id": "1"} for _ in texts])
+            return store
+        return self._once("store", build)
+
+    def _decode(self, path):
+        import cv2
+        from app.services.emotion_service import resolve_frame_stride
+        cap = cv2.VideoCapture(path)
+        step = resolve_frame_stride(cap.get(cv2.CAP_PROP_FPS), int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        frames, index = [], 0
+        while cap.grab():
+            if index % step == 0:
+                ret, frame = cap.retrieve()
+                if not ret:
+                    break
+                frames.append(frame)
+            index += 1
+        cap.release()
+        return frames
+
+    # Stages
+    def video_decode(self):
+        latencies, outputs = time_calls(self._decode, self.videos(), self.repeat)
+        frames = sum(len(f) for f in outputs) * self.repeat
+        return summarize(latencies, items=frames) | {"unit": "sampled frames"}
+
+    def person_detection(self):
+        from app.services.emotion_service import _detect_person_crops
+        from app.services import model_registry
+        model = model_registry.get("person_model")
+        batches = self.sampled_frames()
+        latencies, _ = time_calls(lambda b: _detect_person_crops(model, b), batches, self.repeat)
+        return summarize(latencies, items=sum(len(b) for b in batches) * self.repeat) | {"unit": "frames", "per": "batch"}
+
+    def emotion_classification(self):
+        from app.services.emotion_service import _detect_person_crops, _classify_crops
+        from app.services import model_registry
+        person_model = model_registry.get("person_model")
+        emotion_model = model_registry.get("emotion_model")
+        crop_batches = []
+        for batch in self.sampled_frames():
+            crops = _detect_person_crops(person_model, batch)
+            if not crops:
+                # The detector may not accept the synthetic figure; classify the figure region instead
+                crops = [frame[60:, frame.shape[1] // 4: 3 * frame.shape[1] // 4] for frame in batch]
+            crop_batches.append(crops)
+        latencies, _ = time_calls(lambda c: _classify_crops(emotion_model, c), crop_batches, self.repeat)
+        return summarize(latencies, items=sum(len(c) for c in crop_batches) * self.repeat) | {"unit": "crops", "per": "batch"}
+
+    def gender_classification(self):
+        import cv2
+        from app.services.analysis_pipeline import analyze_gender
+        paths = []
+        for n, batch in enumerate(self.sampled_frames()[:4]):
+            path = os.path.join(self.workdir, f"face_{n}.jpg")
+            cv2.imwrite(path, batch[0])
+            paths.append(path)
+        latencies, _ = time_calls(analyze_gender, paths, self.repeat)
+        return summarize(latencies) | {"unit": "images"}
+
+    def voice_frontend(self):
+        from app.services.audio_frontend import prepare_voice_windows
+        latencies, _ = time_calls(prepare_voice_windows, self.wavs(), self.repeat)
+        return summarize(latencies) | {"unit": "recordings"}
+
+    def _voice_windows(self):
+        from app.services.audio_frontend import prepare_voice_windows
+        return self._once("voice_windows", lambda: [w for p in self.wavs() for w in prepare_voice_windows(p)])
+
+    def voice_features(self):
+        from app.services.analysis_pipeline import get_voice_model, VOICE_SAMPLE_RATE
+        _model, feature_extractor = get_voice_model()
+        windows = self._voice_windows()
+        latencies, _ = time_calls(lambda w: feature_extractor(w, sampling_rate=VOICE_SAMPLE_RATE, return_tensors="pt"),
+                                  windows, self.repeat)
+        return summarize(latencies) | {"unit": "windows"}
+
+    def voice_forward(self):
+        import torch
+        from app.services.analysis_pipeline import get_voice_model, VOICE_SAMPLE_RATE
+        model, feature_extractor = get_voice_model()
+        inputs = [feature_extractor(w, sampling_rate=VOICE_SAMPLE_RATE, return_tensors="pt") for w in self._voice_windows()]
+
+        def forward(x):
+            with torch.no_grad():
+                return model(**x).logits
+        latencies, _ = time_calls(forward, inputs, self.repeat)
+        audio_s = sum(len(w) for w in self._voice_windows()) / VOICE_SAMPLE_RATE * self.repeat
+        return summarize(latencies) | {"unit": "windows", "audio_seconds_per_s": round(audio_s / sum(latencies), 3)}
+
+    @contextlib.contextmanager
+    def _ollama_stub(self, **options):
+        from benchmarks.stubs import start_ollama_stub
+        server, base_url = start_ollama_stub(**options)
+        previous = os.environ.get("LLM_BASE_URL")
+        os.environ["LLM_BASE_URL"] = base_url
+        try:
+            yield server
+        finally:
+            server.shutdown()
+            if previous is None:
+                os.environ.pop("LLM_BASE_URL", None)
+            else:
+                os.environ["LLM_BASE_URL"] = previous
+
+    @staticmethod
+    def _sent_kb(server):
+        sizes = server.state["image_bytes"]
+        return round(sum(sizes) / len(sizes) / 1024, 1) if sizes else None
+
+    def ocr_request(self):
+        from app.services.analysis_pipeline import extract_prescription_ocr
+        with self._ollama_stub() as server:
+            latencies, _ = time_calls(extract_prescription_ocr, self.prescriptions(), self.repeat)
+        return summarize(latencies) | {"unit": "images", "base64_kb_sent": self._sent_kb(server),
+                                       "note": "client side only, Ollama is stubbed"}
+
+    def ocr_stream(self):
+        from app.services.analysis_pipeline import stream_prescription_ocr
+        first_text = []
+
+        def stream(path):
+            started = time.perf_counter()
+            for i, _fragment in enumerate(stream_prescription_ocr(path)):
+                if i == 0:
+                    first_text.append(time.perf_counter() - started)
+        with self._ollama_stub(chunk_delay_s=0.005) as server:
+            latencies, _ = time_calls(stream, self.prescriptions(), self.repeat)
+        return summarize(latencies) | {"unit": "images", "first_text_p50_ms": round(float(np.median(first_text)) * 1000, 3),
+                                       "base64_kb_sent": self._sent_kb(server),
+                                       "note": "stub streams one word every 5 ms"}
+
+    def pdf_parse_split(self):
+        from app.services.pdf_service import _parse_pdf
+        latencies, outputs = time_calls(_parse_pdf, self.pdfs(), self.repeat)
+        chunks = sum(len(o[0]) for o in outputs) * self.repeat
+        return summarize(latencies, items=chunks) | {"unit": "chunks", "per": "document"}
+
+    def pdf_embed(self):
+        from app.services.pdf_service import get_embeddings, EMBED_BATCH_SIZE
+        embeddings = get_embeddings()
+        texts = self.chunks()
+        batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+        latencies, _ = time_calls(embeddings.embed_documents, batches, self.repeat)
+        return summarize(latencies, items=len(texts) * self.repeat) | {"unit": "chunks", "per": "batch"}
+
+    def chroma_retrieval(self):
+        store = self.vector_store()
+        queries = [f"treatment guidelines for {' '.join(self.rng.choice(_WORDS, size=4))}" for _ in range(20)]
+        latencies, _ = time_calls(lambda q: store.similarity_search(q, k=3), queries, self.repeat)
+        return summarize(latencies) | {"unit": "queries", "collection_size": len(self.chunks())}
+
+    def _install_stubs(self):
+        from benchmarks.stubs import install_registry_instance, make_stub_llm
+        store = self.vector_store()
+        install_registry_instance("chroma_general", store)
+        install_registry_instance("chroma_inmates", store)
+        install_registry_instance("llm", make_stub_llm())
+
+    def _profile_inputs(self):
+        from types import SimpleNamespace
+        inmate = SimpleNamespace(id=1, age=34, gender="male", crime_details="Theft", visual_emotion="Sad",
+                                 ocr_prescription="Sertraline 50mg")
+        survey = "; ".join(f"Q: Question {i} A: Several days (Voice: sad)" for i in range(9))
+        return [(inmate, "Sad, Neutral, Sad, Angry, Neutral", survey)] * 10
+
+    def prompt_assembly(self):
+        from langchain_core.prompts import PromptTemplate
+        from app.services.rag_service import build_profile_inputs, PROFILE_TEMPLATE
+        self._install_stubs()
+        prompt = PromptTemplate.from_template(PROFILE_TEMPLATE)
+
+        def assemble(args):
+            return prompt.format(**build_profile_inputs(*args))
+        latencies, _ = time_calls(assemble, self._profile_inputs(), self.repeat)
+        return summarize(latencies) | {"unit": "prompts", "note": "includes Chroma retrieval for both stores"}
+
+    def llm_call(self):
+        from langchain_core.prompts import PromptTemplate
+        from app.services.rag_service import build_profile_inputs, PROFILE_TEMPLATE, get_structured_llm
+        self._install_stubs()
+        chain = PromptTemplate.from_template(PROFILE_TEMPLATE) | get_structured_llm()
+        inputs = [build_profile_inputs(*args) for args in self._profile_inputs()]
+        latencies, _ = time_calls(chain.invoke, inputs, self.repeat)
+        return summarize(latencies) | {"unit": "calls", "note": "stub LLM: chain + schema overhead only"}
+
+    def run(self, stages):
+        for stage in stages:
+            print(f"[stage_bench] {stage}...", file=sys.stderr)
+            try:
+                self.results[stage] = getattr(self, stage)()
+            except Exception as e:
+                self.results[stage] = {"error": f"{type(e).__name__}: {e}"}
+        return self.results
+
+def environment():
+    env = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count()
+    }
+    try:
+        env["git_commit"] = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                                    stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        env["git_commit"] = None
+    if "torch" in sys.modules:
+        env["torch_threads"] = sys.modules["torch"].get_num_threads()
+    for var in ("INFERENCE_BACKEND", "VIDEO_BATCH_SIZE", "VOICE_BATCH_SIZE", "EMBED_BATCH_SIZE", "OMP_NUM_THREADS"):
+        if os.getenv(var):
+            env[var] = os.getenv(var)
+    return env
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage pipeline benchmark on synthetic inputs")
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--quick", action="store_true", help="fewer / smaller inputs")
+    parser.add_argument("--keep", action="store_true", help="keep the generated inputs")
+    parser.add_argument("--out")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)} (available: {', '.join(STAGES)})")
+
+    workdir = tempfile.mkdtemp(prefix="stage_bench_")
+    try:
+        bench = StageBench(workdir, np.random.default_rng(args.seed), max(1, args.repeat), args.quick)
+        results = bench.run(stages)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {"environment": environment(), "seed": args.seed, "repeat": args.repeat, "quick": args.quick, "stages": results}
+    if args.keep:
+        report["inputs_dir"] = workdir
+    output = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output)
+    print(output)
+
+if __name__ == "__main__":
+    main()
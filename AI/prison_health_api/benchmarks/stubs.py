@@ -0,0 +1,123 @@
+"""
+Local stand-ins for the external services, so benchmarks measure only our
+own code: a structured "LLM" that answers instantly (or after a fixed
+latency) and a minimal Ollama HTTP server for the OCR call.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STUB_OCR_TEXT = (
+    "Rx: Sertraline 50mg - 1 tablet daily in the morning\n"
+    "Rx: Quetiapine 25mg - 1 tablet at night\n"
+    "Review in 4 weeks. Dr. A. Perera"
+)
+
+def stub_profile():
+    return {
+        "risk_level": "Medium",
+        "suspected_conditions": ["Depression"],
+        "recommended_actions": ["Weekly counselling session"],
+        "urgent_alert": False,
+        "reasoning": "Benchmark stub response.",
+        "progress_indicator": "Initial"
+    }
+
+def make_stub_llm(latency_s=0.0):
+    """A runnable that behaves like llm.with_structured_output(HealthProfile, include_raw=True)."""
+    from langchain_core.messages import AIMessage
+    from langchain_core.runnables import RunnableLambda
+    from app.services.rag_service import HealthProfile
+
+    def respond(prompt_value):
+        if latency_s:
+            time.sleep(latency_s)
+        prompt_tokens = len(prompt_value.to_string()) // 4
+        raw = AIMessage(content="", usage_metadata={"input_tokens": prompt_tokens, "output_tokens": 120,
+                                                    "total_tokens": prompt_tokens + 120})
+        return {"raw": raw, "parsed": HealthProfile(**stub_profile()), "parsing_error": None}
+
+    return RunnableLambda(respond)
+
+def install_registry_instance(name, instance):
+    """Puts a ready-made object into the model registry under `name` (bypasses its loader)."""
+    from app.services import model_registry
+    model_registry._instances[name] = instance
+
+class _OllamaHandler(BaseHTTPRequestHandler):
+    latency_s = 0.0
+    chunk_delay_s = 0.0
+    response_text = STUB_OCR_TEXT
+    # Shared per server: {"fail_remaining": n, "requests": n, "image_bytes": [...]}
+    state = None
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.rstrip("/") != "/api/generate":
+            self.send_error(404)
+            return
+        with self.state["lock"]:
+            self.state["requests"] += 1
+            self.state["image_bytes"] += [len(image) for image in payload.get("images") or []]
+            failing = self.state["fail_remaining"] > 0
+            if failing:
+                self.state["fail_remaining"] -= 1
+        if failing:
+            self._send_json(503, {"error": "stub: model is loading"})
+            return
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        # Like Ollama, answers are streamed unless "stream": false
+        if payload.get("stream", True):
+            self._stream(payload)
+        else:
+            self._send_json(200, {"model": payload.get("model"), "response": self.response_text, "done": True})
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, payload):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = self.response_text.split(" ")
+        fragments = [word + " " for word in words[:-1]] + words[-1:]
+        for fragment in fragments:
+            self._chunk({"model": payload.get("model"), "response": fragment, "done": False})
+            if self.chunk_delay_s:
+                time.sleep(self.chunk_delay_s)
+        self._chunk({"model": payload.get("model"), "response": "", "done": True})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _chunk(self, payload):
+        line = json.dumps(payload).encode() + b"\n"
+        self.wfile.write(f"{len(line):X}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, *args):
+        pass
+
+def start_ollama_stub(port=0, latency_s=0.0, chunk_delay_s=0.0, fail_first=0):
+    """
+    Starts the Ollama stub on localhost in a daemon thread. It streams the
+    answer word by word (chunk_delay_s apart) unless the request says
+    "stream": false, and answers 503 to the first `fail_first` requests.
+    Returns (server, base_url); server.state counts requests and the base64
+    image sizes received. Call server.shutdown() when done.
+    """
+    state = {"lock": threading.Lock(), "fail_remaining": fail_first, "requests": 0, "image_bytes": []}
+    handler = type("OllamaHandler", (_OllamaHandler,), {"latency_s": latency_s, "chunk_delay_s": chunk_delay_s,
+                                                        "state": state})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.state = state
+    threading.Thread(target=server.serve_forever, name="ollama-stub", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
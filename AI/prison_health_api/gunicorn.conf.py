@@ -0,0 +1,49 @@
+import multiprocessing
+import os
+
+# gunicorn --config gunicorn.conf.py wsgi:app
+# Every setting can be overridden through the environment.
+
+wsgi_app = "wsgi:app"
+bind = f"0.0.0.0:{os.getenv('PORT', '5010')}"
+
+# Worker processes x request threads. Inference is CPU bound and releases the
+# GIL inside torch / onnxruntime, so a few processes with a few threads each
+# beat many single-threaded workers; torch and ONNX Runtime intra-op threads
+# are split between them.
+workers = int(os.getenv("GUNICORN_WORKERS", str(max(1, min(4, multiprocessing.cpu_count() // 2)))))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+# Load the app (and the PRELOAD_MODELS weights) once in the master; workers
+# share them copy-on-write
+preload_app = True
+
+# Video / voice analysis can legitimately take minutes
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "300"))
+# Recycled or stopping workers get this long to finish requests and running jobs
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "120"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Recycle workers after a number of requests to cap slow memory growth. A
+# recycled worker hands its queued background jobs back (worker_exit) and
+# the master fails any job it could not finish (child_exit), see serving.py
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "100"))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+def post_fork(server, worker):
+    from app.utils import serving
+    serving.configure_worker(server.app.wsgi(), server.num_workers)
+
+def worker_exit(server, worker):
+    from app.utils import serving
+    serving.stop_worker(server.app.wsgi())
+
+def child_exit(server, worker):
+    # In the master, also after SIGKILL (timeout / graceful_timeout exceeded)
+    from app.utils import serving
+    serving.recover_worker_jobs(server.app.wsgi(), worker.pid)
@@ -0,0 +1,135 @@
+"""baseline schema
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-17 09:00:00
+
+Tables as they were created by db.create_all(). Each table is only created
+if it is missing, so existing databases can be stamped forward by simply
+running the upgrade.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _missing(table_name):
+    return not sa.inspect(op.get_bind()).has_table(table_name)
+
+
+def upgrade():
+    if _missing('inmates'):
+        op.create_table(
+            'inmates',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=100), nullable=False),
+            sa.Column('nic', sa.String(length=20), nullable=True),
+            sa.Column('address', sa.String(length=200), nullable=True),
+            sa.Column('tel_no', sa.String(length=20), nullable=True),
+            sa.Column('crime_details', sa.Text(), nullable=True),
+            sa.Column('age', sa.Integer(), nullable=True),
+            sa.Column('gender', sa.String(length=20), nullable=True),
+            sa.Column('visual_emotion', sa.String(length=50), nullable=True),
+            sa.Column('ocr_prescription', sa.Text(), nullable=True),
+            sa.Column('final_llm_report', sa.Text(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if _missing('survey_answers'):
+        op.create_table(
+            'survey_answers',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('inmate_id', sa.Integer(), nullable=False),
+            sa.Column('question_text', sa.String(length=500), nullable=False),
+            sa.Column('answer_text', sa.String(length=500), nullable=False),
+            sa.Column('voice_emotion', sa.String(length=50), nullable=True),
+            sa.Column('timestamp', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['inmate_id'], ['inmates.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if _missing('emotion_logs'):
+        op.create_table(
+            'emotion_logs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('inmate_id', sa.Integer(), nullable=False),
+            sa.Column('predicted_emotion', sa.String(length=50), nullable=False),
+            sa.Column('confidence_score', sa.Float(), nullable=True),
+            sa.Column('timestamp', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['inmate_id'], ['inmates.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if _missing('staff'):
+        op.create_table(
+            'staff',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('name', sa.String(length=100), nullable=False),
+            sa.Column('role', sa.String(length=50), nullable=False),
+            sa.Column('department', sa.String(length=100), nullable=True),
+            sa.Column('contact', sa.String(length=100), nullable=True),
+            sa.Column('joined_date', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if _missing('health_profile_logs'):
+        op.create_table(
+            'health_profile_logs',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('inmate_id', sa.Integer(), nullable=False),
+            sa.Column('risk_level', sa.String(length=50), nullable=True),
+            sa.Column('suspected_conditions', sa.Text(), nullable=True),
+            sa.Column('recommended_actions', sa.Text(), nullable=True),
+            sa.Column('urgent_alert', sa.Boolean(), nullable=True),
+            sa.Column('reasoning', sa.Text(), nullable=True),
+            sa.Column('progress_indicator', sa.String(length=50), nullable=True),
+            sa.Column('timestamp', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['inmate_id'], ['inmates.id']),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if _missing('users'):
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('username', sa.String(length=80), nullable=False),
+            sa.Column('password', sa.String(length=255), nullable=False),
+            sa.Column('role', sa.String(length=50), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('username')
+        )
+    if _missing('jobs'):
+        op.create_table(
+            'jobs',
+            sa.Column('id', sa.String(length=32), nullable=False),
+            sa.Column('job_type', sa.String(length=50), nullable=False),
+            sa.Column('status', sa.String(length=20), nullable=False),
+            sa.Column('payload', sa.Text(), nullable=True),
+            sa.Column('result', sa.Text(), nullable=True),
+            sa.Column('error', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('started_at', sa.DateTime(), nullable=True),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+    if _missing('health_profile_cache'):
+        op.create_table(
+            'health_profile_cache',
+            sa.Column('key', sa.String(length=64), nullable=False),
+            sa.Column('inmate_id', sa.Integer(), nullable=True),
+            sa.Column('profile', sa.Text(), nullable=False),
+            sa.Column('profile_log_id', sa.Integer(), nullable=True),
+            sa.Column('hit_count', sa.Integer(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('last_hit_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('key')
+        )
+
+
+def downgrade():
+    for table_name in ('health_profile_cache', 'jobs', 'users', 'health_profile_logs', 'staff',
+                       'emotion_logs', 'survey_answers', 'inmates'):
+        op.drop_table(table_name)
@@ -0,0 +1,58 @@
+"""lookup indexes on inmates and the per-inmate log tables
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 09:30:00
+
+- inmates.name: every route resolves the inmate by name
+- inmates.nic: unique (lookup / register); empty strings become NULL first
+  so inmates registered without a NIC don't collide
+- (inmate_id, timestamp) on emotion_logs, survey_answers and
+  health_profile_logs: per-inmate history, newest first
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_inmates_name', 'inmates', ['name'], False),
+    ('ix_inmates_nic', 'inmates', ['nic'], True),
+    ('ix_emotion_logs_inmate_id_timestamp', 'emotion_logs', ['inmate_id', 'timestamp'], False),
+    ('ix_survey_answers_inmate_id_timestamp', 'survey_answers', ['inmate_id', 'timestamp'], False),
+    ('ix_health_profile_logs_inmate_id_timestamp', 'health_profile_logs', ['inmate_id', 'timestamp'], False),
+]
+
+
+def _existing_indexes(table_name):
+    return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table_name)}
+
+
+def upgrade():
+    bind = op.get_bind()
+
+    # NIC is optional: store "no NIC" as NULL (NULLs never collide in a unique index)
+    bind.execute(sa.text("UPDATE inmates SET nic = TRIM(nic) WHERE nic IS NOT NULL"))
+    bind.execute(sa.text("UPDATE inmates SET nic = NULL WHERE nic = ''"))
+    duplicates = bind.execute(sa.text(
+        "SELECT nic, COUNT(*) FROM inmates WHERE nic IS NOT NULL GROUP BY nic HAVING COUNT(*) > 1"
+    )).fetchall()
+    if duplicates:
+        listed = ", ".join(f"{nic} ({count} inmates)" for nic, count in duplicates[:20])
+        raise RuntimeError(f"Cannot make inmates.nic unique, duplicate NICs must be merged first: {listed}")
+
+    for name, table_name, columns, unique in INDEXES:
+        if name not in _existing_indexes(table_name):
+            op.create_index(name, table_name, columns, unique=unique)
+
+
+def downgrade():
+    for name, table_name, _columns, _unique in reversed(INDEXES):
+        if name in _existing_indexes(table_name):
+            op.drop_index(name, table_name=table_name)
@@ -0,0 +1,37 @@
+"""owning process of background jobs
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 19:10:00
+
+- jobs.owner_pid: the process whose in-memory pool holds a queued or
+  running job, so the jobs of a gunicorn worker that exits (recycled,
+  timed out, crashed) can be failed or handed to another worker
+- (status, owner_pid) index for those recovery queries
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('jobs')}
+    if 'owner_pid' not in columns:
+        with op.batch_alter_table('jobs') as batch_op:
+            batch_op.add_column(sa.Column('owner_pid', sa.Integer(), nullable=True))
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('jobs')}
+    if 'ix_jobs_status_owner_pid' not in indexes:
+        op.create_index('ix_jobs_status_owner_pid', 'jobs', ['status', 'owner_pid'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_jobs_status_owner_pid', table_name='jobs')
+    with op.batch_alter_table('jobs') as batch_op:
+        batch_op.drop_column('owner_pid')
@@ -0,0 +1,12 @@
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from app import create_app
+from app.utils import serving
+
+# Production entry point: gunicorn --config gunicorn.conf.py wsgi:app
+# Imported once in the gunicorn master (preload_app), so migrations and
+# model loading happen before the workers are forked.
+app = create_app(start_background_work=False)
+serving.prepare_master(app)